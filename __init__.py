@@ -1,7 +1,7 @@
 import bpy
 from bpy.types import Operator, AddonPreferences
 from bpy.props import StringProperty, IntProperty, BoolProperty
-from . operators import op_render_sprite_animation, op_export_data_sheets
+from . operators import op_render_sprite_animation, op_export_data_sheets, op_fit_sprite_bounds
 from . ui import ui_export_panel, ui_render_panel, ui_subject_panel
 
 bl_info = {
@@ -18,6 +18,7 @@ bl_info = {
 
 classes = (
     op_render_sprite_animation.MK_SPRITES_OP_render_sprite_animation,
+    op_fit_sprite_bounds.MK_SPRITES_OP_fit_sprite_bounds,
     op_export_data_sheets.MK_SPRITES_OP_export_image_json,
     op_export_data_sheets.MK_SPRITES_OP_export_bevy_image_json,
     op_export_data_sheets.MK_SPRITES_OP_export_godot_sprite_frames,
@@ -31,6 +32,7 @@ classes = (
     ui_subject_panel.MK_SPRITES_PT_subject_panel,
     ui_render_panel.MK_SPRITES_PT_render_panel_properties,
     ui_render_panel.MK_SPRITES_PT_render_panel,
+    ui_export_panel.MK_SPRITES_page_item,
     ui_export_panel.MK_SPRITES_image_item,
     ui_export_panel.MK_SPRITES_PT_export_panel_properties,
     ui_export_panel.MK_SPRITES_OP_export_image_data,
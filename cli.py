@@ -0,0 +1,200 @@
+"""Headless sprite baking driven by a job manifest.
+
+    blender -b -P path/to/SpriteAtlasAddon/cli.py -- manifest.json
+
+The manifest is JSON (or TOML when Blender's python ships tomllib) with a list of jobs,
+relative paths are resolved against the manifest's folder:
+
+    {
+      "jobs": [
+        {
+          "blend": "characters/knight.blend",
+          "subject": "Knight",
+          "actions": ["Walk", "Idle"],
+          "rotations": 8,
+          "resolution": [64, 64],
+          "output": "build/knight.png",
+          "file_format": "PNG",
+          "formats": ["json", "bevy", "godot", "xml", "mono"],
+          "render": {"auto_resolution": true}
+        }
+      ]
+    }
+
+"render" holds any extra Render panel settings. Blender exits with a non-zero code
+when any job fails.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import sys
+import traceback
+
+import bpy
+
+ADDON_DIR = os.path.dirname(os.path.abspath(__file__))
+
+EXPORT_FORMATS = {
+    "json": "export_json",
+    "bevy": "export_bevy_json",
+    "godot": "export_godot_sprite_frames",
+    "xml": "export_xml",
+    "mono": "export_mono",
+}
+
+def load_addon():
+    sys.path.insert(0, os.path.dirname(ADDON_DIR))
+    addon = importlib.import_module(os.path.basename(ADDON_DIR))
+
+    # the addon may already be enabled in the user preferences
+    if not hasattr(bpy.types.Scene, "mk_sprites_subject_panel_properties"):
+        addon.register()
+
+    return addon
+
+def load_manifest(path):
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if path.lower().endswith(".toml"):
+        import tomllib
+        return tomllib.loads(data.decode("utf-8"))
+
+    return json.loads(data)
+
+def resolve(base, path):
+    return os.path.normpath(os.path.join(base, bpy.path.native_pathsep(path)))
+
+def run_job(job, base):
+    bpy.ops.wm.open_mainfile(filepath=resolve(base, job["blend"]))
+
+    context = bpy.context
+    scene = context.scene
+    subject_props = scene.mk_sprites_subject_panel_properties
+    render_props = scene.mk_sprites_render_panel_properties
+
+    subject = bpy.data.objects.get(job["subject"])
+    if subject is None:
+        raise ValueError("Subject %s not found in %s" % (job["subject"], job["blend"]))
+    subject_props.obj = subject
+
+    if "rotations" in job:
+        subject_props.rotations = job["rotations"]
+
+    if "actions" in job:
+        subject_props.obj_actions.clear()
+        for action_name in job["actions"]:
+            action = bpy.data.actions.get(action_name)
+            if action is None:
+                raise ValueError("Action %s not found in %s" % (action_name, job["blend"]))
+            subject_props.obj_actions.add().action = action
+
+    if "resolution" in job:
+        render_props.resolution_x, render_props.resolution_y = job["resolution"]
+
+    for key, value in job.get("render", {}).items():
+        setattr(render_props, key, value)
+
+    result = bpy.ops.mk_sprites.render_sprite_animation(
+        subject_rotations=subject_props.rotations,
+        use_animations=len(subject_props.obj_actions) > 0,
+    )
+    if "FINISHED" not in result:
+        raise RuntimeError("Rendering %s was cancelled" % job["subject"])
+
+    # the export dialog can't be opened without a window, call the same export logic directly
+    export_panel = importlib.import_module(os.path.basename(ADDON_DIR) + ".ui.ui_export_panel")
+
+    output = resolve(base, job["output"])
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+
+    export_props = scene.mk_sprites_export_panel_properties
+    export_props.image_props[export_props.active_image].image.file_format = job.get("file_format", "PNG")
+
+    options = {}
+    for name in job.get("formats", []):
+        if name not in EXPORT_FORMATS:
+            raise ValueError("Unknown export format %s" % name)
+        options[EXPORT_FORMATS[name]] = True
+
+    export_panel.export_image_data(context, output, export_image=True, **options)
+    print("Exported %s" % output)
+
+# render worker started by the Render operator when its work is split between processes
+def run_worker(path):
+    load_addon()
+
+    with open(path) as f:
+        job = json.load(f)
+
+    result = bpy.ops.mk_sprites.render_sprite_animation(
+        subject_rotations=job["subject_rotations"],
+        use_animations=job["use_animations"],
+        action_index=job["action_index"],
+        shard_job=path,
+    )
+    return 0 if "FINISHED" in result else 1
+
+# network render worker, fetches the scene from the coordinator and renders units until none are left
+def run_network_worker(address, threads):
+    addon = load_addon()
+    netutils = importlib.import_module(addon.__name__ + ".utils.netutils")
+
+    host, port = address.rsplit(":", 1)
+    client = netutils.RenderWorkerClient(host, int(port), netutils.GetWorkerToken())
+    scene_path = os.path.join(bpy.app.tempdir, "coordinator_scene.blend")
+    client.fetch_scene(scene_path)
+    client.close()
+
+    bpy.ops.wm.open_mainfile(filepath=scene_path)
+    result = bpy.ops.mk_sprites.render_sprite_animation(net_worker=address, worker_threads=threads)
+    return 0 if "FINISHED" in result else 1
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="blender -b -P cli.py --", description="Bake sprite sheets from a job manifest")
+    parser.add_argument("manifest", nargs="?", help="JSON or TOML job manifest")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--net-worker", metavar="HOST:PORT", help="render units handed out by a coordinator, its token is read from MK_SPRITES_TOKEN")
+    parser.add_argument("--threads", type=int, default=0, help="render threads of a network worker, 0 for all cores")
+    args = parser.parse_args(argv)
+
+    if args.net_worker:
+        try:
+            return run_network_worker(args.net_worker, args.threads)
+        except Exception:
+            traceback.print_exc()
+            return 1
+
+    if args.worker:
+        try:
+            return run_worker(args.worker)
+        except Exception:
+            traceback.print_exc()
+            return 1
+
+    if args.manifest is None:
+        parser.error("a manifest is required")
+
+    manifest_path = os.path.abspath(args.manifest)
+    base = os.path.dirname(manifest_path)
+    jobs = load_manifest(manifest_path).get("jobs", [])
+
+    load_addon()
+
+    failed = 0
+    for i, job in enumerate(jobs):
+        print("Sprite job %d/%d: %s" % (i + 1, len(jobs), job.get("subject")))
+        try:
+            run_job(job, base)
+        except Exception:
+            traceback.print_exc()
+            failed += 1
+
+    print("%d of %d sprite jobs failed" % (failed, len(jobs)))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    sys.exit(main(argv))
@@ -7,11 +7,32 @@ from bpy.types import PropertyGroup
 from bpy.props import PointerProperty, StringProperty, IntProperty, BoolProperty, CollectionProperty, EnumProperty
 
 from ..utils.xmlutils import GetMonoXMLHeader, GetXMLHeader, XMLIndent, ExportXml
-from ..utils.helpers import GetTilePos, GetActionFrameCount
+from ..utils.helpers import GetActionFrameCount, GetSheetLayout, SheetGrid
 
 def make_mono_source(width, height, pos_x, pos_y):
     return str(pos_x) + " " + str(pos_y) + " " + str(width) + " " + str(height)
 
+# file a sheet page is saved to, the first page keeps the exported name
+def get_page_path(filepath, page):
+    if page == 0:
+        return filepath
+    base, ext = os.path.splitext(filepath)
+    return "%s_%d%s" % (base, page, ext)
+
+# animations in the sheet with their frame rects, see GetSheetLayout
+def get_sheet_layout(context, image_prop):
+    if image_prop.sprite_data:
+        return json.loads(image_prop.sprite_data)
+
+    # sheets rendered before the layout was stored with them
+    animations = []
+    for item in image_prop.object_actions:
+        if item.action is not None:
+            animations.append({"name": item.action.name, "frame_count": item.frame_count or GetActionFrameCount(item.action, context.scene.frame_step)})
+
+    return GetSheetLayout(animations, image_prop.object_angles, image_prop.sprite_width, image_prop.sprite_height,
+        image_prop.image.size[0], image_prop.image.size[1], image_prop.mirror_angles)
+
 class MK_SPRITES_OP_export_bevy_image_json(bpy.types.Operator):
     """open_action_menu"""
     bl_idname = "mk_sprites.export_bevy_image_json"
@@ -21,9 +42,7 @@ class MK_SPRITES_OP_export_bevy_image_json(bpy.types.Operator):
     filepath: bpy.props.StringProperty(name="filepath")
 
     def execute(self, context):
-        mk_render_props = context.scene.mk_sprites_render_panel_properties
         export_props = context.scene.mk_sprites_export_panel_properties
-        frame_step = context.scene.frame_step
         active_image = export_props.image_props[export_props.active_image]
 
         if active_image.image is None:
@@ -31,34 +50,58 @@ class MK_SPRITES_OP_export_bevy_image_json(bpy.types.Operator):
 
         image_width = active_image.image.size[0]
         image_height = active_image.image.size[1]
+        sprite_width = active_image.sprite_width
+        sprite_height = active_image.sprite_height
+        # pages are sized to their own tiles, so every page has its own column count
+        page_images = [active_image.image] + [item.image or active_image.image for item in active_image.pages]
+        columns = [SheetGrid.from_sheet(sprite_width, sprite_height, image.size[0], image.size[1]).columns for image in page_images]
+
+        # packed frames are indices into the sheet's texture rects
+        textures = []
+        texture_indices = {}
 
         animations = {}
-        n = 0
-        for action_obj in active_image.object_actions:
-            for obj_rot in range(active_image.object_angles):
-                if action_obj is None or action_obj.action is None:
-                    continue
-
-                action_mode =  action_obj.action.get("mode", "Repeat X")
-                print(f"Setting up action {action_obj.action.name}, r:{obj_rot},n:{n}, mode: {action_mode}")
-                action_name = action_obj.action.name + "_" + str(obj_rot)
-                animations[action_name] = {
-                    "mode": action_mode,
-                    "fps": context.scene.render.fps,
-                    "size_x": mk_render_props.resolution_x,
-                    "size_y": mk_render_props.resolution_y,
-                    "frames": list(range(GetActionFrameCount(action_obj.action, frame_step))),
-                    "row": n
-                }
-                n += 1
+        for animation in get_sheet_layout(context, active_image):
+            action = bpy.data.actions.get(animation["action"])
+            action_mode = action.get("mode", "Repeat X") if action else "Repeat X"
+            print(f"Setting up action {animation['name']}, mode: {action_mode}")
+
+            # frames are atlas indices, an animation may wrap onto the next row
+            if active_image.packed:
+                frames = []
+                for frame in animation["frames"]:
+                    rect = (frame["x"], frame["y"], frame["width"], frame["height"])
+                    if (frame.get("page", 0), rect) not in texture_indices:
+                        texture_indices[(frame.get("page", 0), rect)] = len(textures)
+                        textures.append(list(rect))
+                    frames.append(texture_indices[(frame.get("page", 0), rect)])
+            else:
+                frames = [(frame["y"] // sprite_height) * columns[frame.get("page", 0)] + frame["x"] // sprite_width for frame in animation["frames"]]
+            animations[animation["name"]] = {
+                "mode": action_mode,
+                "fps": context.scene.render.fps,
+                "size_x": sprite_width,
+                "size_y": sprite_height,
+                "frames": frames,
+                "durations": [frame.get("duration", 1) for frame in animation["frames"]],
+                "offsets": [[frame.get("offset_x", 0), frame.get("offset_y", 0)] for frame in animation["frames"]],
+                "pages": [frame.get("page", 0) for frame in animation["frames"]],
+                "row": frames[0] // columns[animation["frames"][0].get("page", 0)] if frames and not active_image.packed else 0,
+                "mirror_of": animation["mirror_of"],
+                "flip_x": animation.get("flip_x", False),
+            }
 
         img_path = os.path.splitext(self.filepath)
 
         output = {
             "width": image_width,
             "height": image_height,
-            "animations": animations
+            "animations": animations,
+            "pages": [os.path.basename(get_page_path(self.filepath, page)) for page in range(len(active_image.pages) + 1)],
+            "page_sizes": [list(image.size) for image in page_images],
         }
+        if active_image.packed:
+            output["textures"] = textures
 
         with open(img_path[0] + ".animation_set.json", 'w') as f:
             json.dump(output, f, indent=2, sort_keys=True)
@@ -74,55 +117,54 @@ class MK_SPRITES_OP_export_godot_sprite_frames(bpy.types.Operator):
     filepath: bpy.props.StringProperty(name="filepath")
 
     def execute(self, context):
-        mk_render_props = context.scene.mk_sprites_render_panel_properties
         export_props = context.scene.mk_sprites_export_panel_properties
-        frame_step = context.scene.frame_step
         active_image = export_props.image_props[export_props.active_image]
 
         if active_image.image is None:
             return {'FINISHED'}
 
-        image_width = active_image.image.size[0]
-        image_height = active_image.image.size[1]
-        sprite_width = mk_render_props.resolution_x
-        sprite_height = mk_render_props.resolution_y
-        frames_per_row = image_width // sprite_width
-        image_name = os.path.basename(self.filepath)
-
         tres_content = '[gd_resource type="SpriteFrames" load_steps=20 format=3]\n\n'
-        tres_content += f'[ext_resource type="Texture2D" path="res://sprites/animated/{image_name}" id=1]\n\n'
+        # one texture per sheet page
+        for page in range(len(active_image.pages) + 1):
+            image_name = os.path.basename(get_page_path(self.filepath, page))
+            tres_content += f'[ext_resource type="Texture2D" path="res://sprites/animated/{image_name}" id={page + 1}]\n'
+        tres_content += '\n'
 
         sub_resources = ""
         animations = '[resource]\nanimations = ['
         frame_index = 0
         animation_counter = 0
 
-        for action_obj in active_image.object_actions:
-            for obj_rot in range(active_image.object_angles):
-                if action_obj is None or action_obj.action is None:
-                    continue
-
-                action_frames = GetActionFrameCount(action_obj.action, frame_step)
-                animation_frames = []
-
-                for i in range(action_frames):
-                    x = (frame_index % frames_per_row) * sprite_width
-                    y = (frame_index // frames_per_row) * sprite_height
-
-                    sub_resource_id = f"AtlasTexture_{frame_index}"
-                    sub_resources += f'[sub_resource type="AtlasTexture" id="{sub_resource_id}"]\n'
-                    sub_resources += 'atlas = ExtResource(1)\n'
-                    sub_resources += f'region = Rect2({x}, {y}, {sprite_width}, {sprite_height})\n\n'
-                    
-                    animation_frames.append(f'{{"duration": 1.0, "texture": SubResource("{sub_resource_id}")}}')
-                    frame_index += 1
-
-                animation_name = action_obj.action.name + "_" + str(obj_rot)
-                animations += '{\n'
-                animations += '"frames": [\n' + ',\n'.join(animation_frames) + '\n],\n'
-                animations += f'"loop": true,\n"name": "{animation_name}",\n"speed": 12.0\n'
-                animations += '},\n'
-                animation_counter += 1
+        # mirrored angles use the flipped tiles in the sheet, sprite frames can't flip
+        # angles that were left out, the sprite's flip_h has to be set for them
+        for animation in get_sheet_layout(context, active_image):
+            animation_frames = []
+            if animation.get("flip_x", False):
+                self.report({'WARNING'}, "%s is drawn from %s flipped, set flip_h when playing it" % (animation["name"], animation["mirror_of"]))
+
+            for frame in animation["frames"]:
+                sub_resource_id = f"AtlasTexture_{frame_index}"
+                sub_resources += f'[sub_resource type="AtlasTexture" id="{sub_resource_id}"]\n'
+                sub_resources += f'atlas = ExtResource({frame.get("page", 0) + 1})\n'
+                sub_resources += f'region = Rect2({frame["x"]}, {frame["y"]}, {frame["width"]}, {frame["height"]})\n'
+                # trimmed frames are padded back to their original size
+                margin_w = frame.get("source_width", frame["width"]) - frame["width"]
+                margin_h = frame.get("source_height", frame["height"]) - frame["height"]
+                if margin_w or margin_h:
+                    sub_resources += f'margin = Rect2({frame.get("offset_x", 0)}, {frame.get("offset_y", 0)}, {margin_w}, {margin_h})\n'
+                sub_resources += '\n'
+
+                # held frames are stored once and shown for longer
+                duration = float(frame.get("duration", 1))
+                animation_frames.append(f'{{"duration": {duration}, "texture": SubResource("{sub_resource_id}")}}')
+                frame_index += 1
+
+            animation_name = animation["name"]
+            animations += '{\n'
+            animations += '"frames": [\n' + ',\n'.join(animation_frames) + '\n],\n'
+            animations += f'"loop": true,\n"name": "{animation_name}",\n"speed": 12.0\n'
+            animations += '},\n'
+            animation_counter += 1
 
         animations += ']'
         tres_content += sub_resources + animations
@@ -143,38 +185,40 @@ class MK_SPRITES_OP_export_image_json(bpy.types.Operator):
     filepath: bpy.props.StringProperty(name="filepath")
 
     def execute(self, context):
-        mk_render_props = context.scene.mk_sprites_render_panel_properties
         export_props = context.scene.mk_sprites_export_panel_properties
-        frame_step = context.scene.frame_step
         active_image = export_props.image_props[export_props.active_image]
 
         if active_image.image == None:
             return {'FINISHED'}
 
-        image_width = active_image.image.size[0]
-        image_height = active_image.image.size[1]
-
-        n = 0
         items = []
-        for obj_rot in range(active_image.object_angles):
-            for action_obj in active_image.object_actions:
-                if (action_obj == None or action_obj.action == None):
-                    continue
-
-                item = {}
-                item["frames"] = GetActionFrameCount(action_obj.action, frame_step)
-                item["framerate"] = context.scene.render.fps
-                item["loop"] = True
-                item["name"] = action_obj.action.name + "_" + str(obj_rot)
-                item["width"] = mk_render_props.resolution_x
-                item["height"] = mk_render_props.resolution_y
-                posX, posY = GetTilePos(mk_render_props.resolution_x, mk_render_props.resolution_y, image_width, image_height, n)
-                item["source_x"] = str(posX)
-                item["source_y"] = str(posY)
-                item["texture"] = os.path.basename(self.filepath)
-
-                items.append(item)
-                n += 1
+        for animation in get_sheet_layout(context, active_image):
+            frames = animation["frames"]
+            if not frames:
+                continue
+
+            item = {}
+            item["frames"] = len(frames)
+            item["framerate"] = context.scene.render.fps
+            item["loop"] = True
+            item["name"] = animation["name"]
+            item["width"] = frames[0]["width"]
+            item["height"] = frames[0]["height"]
+            item["source_x"] = str(frames[0]["x"])
+            item["source_y"] = str(frames[0]["y"])
+            # every frame, animations can wrap onto the next row
+            item["frame_rects"] = [[frame["x"], frame["y"], frame["width"], frame["height"]] for frame in frames]
+            item["durations"] = [frame.get("duration", 1) for frame in frames]
+            # position of each rect in the untrimmed frame
+            item["frame_offsets"] = [[frame.get("offset_x", 0), frame.get("offset_y", 0)] for frame in frames]
+            item["source_width"] = frames[0].get("source_width", frames[0]["width"])
+            item["source_height"] = frames[0].get("source_height", frames[0]["height"])
+            item["mirror_of"] = animation["mirror_of"]
+            item["flip_x"] = animation.get("flip_x", False)
+            item["texture"] = os.path.basename(get_page_path(self.filepath, frames[0].get("page", 0)))
+            item["frame_pages"] = [frame.get("page", 0) for frame in frames]
+
+            items.append(item)
 
         img_path = os.path.splitext(self.filepath)
 
@@ -195,9 +239,7 @@ class MK_SPRITES_OP_export_image_xml(bpy.types.Operator):
     use_mono: bpy.props.BoolProperty(name="use_mono")
 
     def execute(self, context):
-        mk_render_props = context.scene.mk_sprites_render_panel_properties
         export_props = context.scene.mk_sprites_export_panel_properties
-        frame_step = context.scene.frame_step
         active_image = export_props.image_props[export_props.active_image]
 
         # start tree
@@ -211,38 +253,46 @@ class MK_SPRITES_OP_export_image_xml(bpy.types.Operator):
         if active_image.image == None:
             return {'FINISHED'}
 
-        image_width = active_image.image.size[0]
-        image_height = active_image.image.size[1]
-        n = 0
-
-        for obj_rot in range(active_image.object_angles):
-            for action_obj in active_image.object_actions:
-
-                print(action_obj.action)
-                if (action_obj == None or action_obj.action == None):
-                    continue
-
-                item = xml.SubElement(animations, "Item")
-
-                xml.SubElement(item, "frames").text = str(GetActionFrameCount(action_obj.action, frame_step))
-                xml.SubElement(item, "framerate").text = str(context.scene.render.fps)
-                xml.SubElement(item, "loop").text = "True"
-                xml.SubElement(item, "name").text = action_obj.action.name + "_" + str(obj_rot)
-
-                width = mk_render_props.resolution_x
-                height = mk_render_props.resolution_y
-                posX, posY = GetTilePos(width, height, image_width, image_height, n)
-
-                if self.use_mono:
-                    xml.SubElement(item, "source").text = make_mono_source(width, height, posX, posY)
-                else:
-                    xml.SubElement(item, "width").text = str(width)
-                    xml.SubElement(item, "height").text = str(height)
-                    xml.SubElement(item, "source_x").text = str(posX)
-                    xml.SubElement(item, "source_y").text = str(posY)
-
-                xml.SubElement(item, "texture").text = os.path.basename(self.filepath)
-                n+=1
+        for animation in get_sheet_layout(context, active_image):
+            frames = animation["frames"]
+            if not frames:
+                continue
+
+            item = xml.SubElement(animations, "Item")
+
+            xml.SubElement(item, "frames").text = str(len(frames))
+            xml.SubElement(item, "framerate").text = str(context.scene.render.fps)
+            xml.SubElement(item, "loop").text = "True"
+            xml.SubElement(item, "name").text = animation["name"]
+
+            width = frames[0]["width"]
+            height = frames[0]["height"]
+            posX, posY = frames[0]["x"], frames[0]["y"]
+
+            if self.use_mono:
+                xml.SubElement(item, "source").text = make_mono_source(width, height, posX, posY)
+            else:
+                xml.SubElement(item, "width").text = str(width)
+                xml.SubElement(item, "height").text = str(height)
+                xml.SubElement(item, "source_x").text = str(posX)
+                xml.SubElement(item, "source_y").text = str(posY)
+
+            # every frame, grid animations can wrap mid row and held frames leave gaps
+            xml.SubElement(item, "frame_rects").text = ";".join("%d %d %d %d" % (frame["x"], frame["y"], frame["width"], frame["height"]) for frame in frames)
+            if active_image.packed:
+                xml.SubElement(item, "frame_offsets").text = ";".join("%d %d" % (frame.get("offset_x", 0), frame.get("offset_y", 0)) for frame in frames)
+                xml.SubElement(item, "source_width").text = str(active_image.sprite_width)
+                xml.SubElement(item, "source_height").text = str(active_image.sprite_height)
+
+            xml.SubElement(item, "durations").text = " ".join(str(frame.get("duration", 1)) for frame in frames)
+            if animation["mirror_of"] is not None:
+                xml.SubElement(item, "mirror_of").text = animation["mirror_of"]
+            if animation.get("flip_x", False):
+                xml.SubElement(item, "flip_x").text = "True"
+
+            xml.SubElement(item, "texture").text = os.path.basename(get_page_path(self.filepath, frames[0].get("page", 0)))
+            if len(active_image.pages):
+                xml.SubElement(item, "frame_pages").text = " ".join(str(frame.get("page", 0)) for frame in frames)
 
         img_path = os.path.splitext(self.filepath)
         xml_path = img_path[0] + ".xml"
@@ -0,0 +1,95 @@
+import bpy
+import mathutils
+
+from ..utils.boundsutils import FitSpriteSize, GetOrbitViews, GetViewBounds, GetWorldPoints, MergeBounds
+from ..utils.gridutils import GetHierarchy, GetOrthoTileSize
+from ..utils.helpers import GetActionFrameCount
+
+
+class MK_SPRITES_OP_fit_sprite_bounds(bpy.types.Operator):
+    """Shrink the sprite resolution and orthographic scale to what the subject covers in every action, frame and angle"""
+
+    bl_idname = "mk_sprites.fit_sprite_bounds"
+    bl_label = "Fit Sprite Size"
+    bl_options = {"REGISTER", "UNDO"}
+
+    padding: bpy.props.IntProperty(name="Padding", description="Empty pixels kept around the subject", default=1, min=0)
+    multiple: bpy.props.IntProperty(name="Multiple", description="Round the sprite size up to a multiple of this", default=2, min=1)
+
+    def execute(self, context):
+        scene = context.scene
+        mk_render_props = scene.mk_sprites_render_panel_properties
+        mk_subject_props = scene.mk_sprites_subject_panel_properties
+        subject = mk_subject_props.obj
+        camera = scene.camera
+
+        if subject is None:
+            self.report({"ERROR"}, "No subject selected.")
+            return {"CANCELLED"}
+
+        camera_track = next((child for child in subject.children if child.name == "CameraTrack"), None)
+        if camera_track is None:
+            self.report({"ERROR"}, "CameraTrack object not found as a child of the subject.")
+            return {"CANCELLED"}
+
+        if camera is None or camera.data.type != 'ORTHO':
+            self.report({"ERROR"}, "Fitting the sprite size needs an orthographic scene camera.")
+            return {"CANCELLED"}
+
+        # keep the current pixel density, only the size of the sprite changes
+        old_width, old_height = mk_render_props.resolution_x, mk_render_props.resolution_y
+        pixel_size = GetOrthoTileSize(camera.data, old_width, old_height)[0] / old_width
+
+        objs = GetHierarchy(subject, camera_track)
+        anim_data = subject.animation_data
+        old_action = anim_data.action if anim_data else None
+        old_frame = scene.frame_current
+
+        # every frame of every action, or the current pose without actions
+        passes = [(anim.action, range(int(anim.action.frame_range[0]), int(anim.action.frame_range[1]) + 1, scene.frame_step))
+            for anim in mk_subject_props.obj_actions if anim.action]
+        if not passes:
+            passes = [(old_action, [old_frame])]
+
+        bounds = None
+        try:
+            for action, frames in passes:
+                if anim_data is not None:
+                    anim_data.action = action
+
+                for f in frames:
+                    scene.frame_set(f)
+                    depsgraph = context.evaluated_depsgraph_get()
+
+                    track = camera_track.evaluated_get(depsgraph)
+                    pivot = track.matrix_world @ track.matrix_basis.inverted() @ mathutils.Matrix.Translation(track.location)
+                    views = GetOrbitViews(camera.evaluated_get(depsgraph).matrix_world, pivot, mk_subject_props.rotations)
+
+                    bounds = MergeBounds(bounds, GetViewBounds(GetWorldPoints(depsgraph, objs), views))
+        finally:
+            if anim_data is not None:
+                anim_data.action = old_action
+            scene.frame_set(old_frame)
+
+        if bounds is None:
+            self.report({"ERROR"}, "The subject has no geometry to fit.")
+            return {"CANCELLED"}
+
+        width, height, center_x, center_y = FitSpriteSize(bounds, pixel_size, self.padding, self.multiple)
+
+        scale = max(width, height) * pixel_size
+        camera.data.sensor_fit = 'AUTO'
+        camera.data.ortho_scale = scale
+        camera.data.shift_x = center_x / scale
+        camera.data.shift_y = center_y / scale
+        mk_render_props.resolution_x = width
+        mk_render_props.resolution_y = height
+
+        tiles = max(1, mk_subject_props.rotations) * max(1, sum(GetActionFrameCount(anim.action, scene.frame_step)
+            for anim in mk_subject_props.obj_actions if anim.action))
+        old_pixels = old_width * old_height * tiles
+        new_pixels = width * height * tiles
+        self.report({"INFO"}, "Sprite size %dx%d -> %dx%d, %d fewer pixels to render and pack (%.0f%%)" % (
+            old_width, old_height, width, height, old_pixels - new_pixels, 100 * (old_pixels - new_pixels) / old_pixels))
+
+        return {"FINISHED"}
@@ -1,12 +1,22 @@
+import json
 import math
 import os
+from contextlib import contextmanager
 
 import bpy
 import mathutils
 
-from ..utils.helpers import AutoImageSize
-from ..utils.ioutils import ClearTempFolder, CreateTempFolder, GetTempFolder
-from ..utils.tileutils import TilePathsIntoImage
+from ..utils.boundsutils import GetBorderRect, GetScreenBounds, GetWorldPoints, UncropFrame
+from ..utils.cacheutils import EvictClothBakes, GetBakeFiles, GetCacheFolder, GetClothBakeFolder, GetClothBakeKey, GetFrameKey, GetJobKey, GetRenderStateKey, GetStoredBake, RenderCache, StoreClothBake
+from ..utils.captureutils import CanCaptureInMemory, ViewerCapture
+from ..utils.decodeutils import DecodeFrame
+from ..utils.gridutils import CreateGridInstance, GetGridGutter, GetGridShape, GetHierarchy, GetOrthoTileSize, MoveToGridCell, SliceGrid
+from ..utils.helpers import AutoImageSize, BuildRenderPlan, ChunkRenderPlan, FitSheetGrid, GetActionFrameCount, GetActionTileOffsets, GetHeldTiles, GetHoldFrames, GetMirroredTiles, GetPageMap, GetSheetLayout, SheetGrid, SplitRenderPlan
+from ..utils.ioutils import ClearTempFolder, CountRead, CountWritten, CreateTempFolder, FormatIOStats, GetFileSize, GetTempFolder
+from ..utils.journalutils import GetJobFolder, JournalStream, PruneJobFolders, RenderJournal
+from ..utils.netutils import GetWorkerToken, RenderCoordinator, RenderWorkerClient
+from ..utils.tileutils import CeilToMultiple, GetSpritesheet, IsMirrorImage, LoadImagePixels, SpritesheetStream
+from ..utils.workerutils import CollectShardFrames, FrameRing, GetRingFolder, GetRingFrameSize, GetWorkerThreads, LaunchNetworkWorkers, LaunchWorkers, NetworkFrameWriter, RING_SLOTS, RingWriter, ShardWriter, WriteShardJobs
 
 
 def get_scene_framerate(context):
@@ -14,6 +24,129 @@ def get_scene_framerate(context):
     frame_end = context.scene.frame_end
 
 
+# pixels kept around the subject's outline for antialiasing
+BORDER_PADDING = 2
+
+def find_camera_track(subject):
+    return next((child for child in subject.children if child.name == "CameraTrack"), None)
+
+@contextmanager
+def orbit_camera_track(camera_track, rotations, arc):
+    # yields the start angle, and leaves the track where angle by angle rendering would have left it
+    start_angle = camera_track.rotation_euler[2]
+    try:
+        yield start_angle
+    finally:
+        camera_track.rotation_euler[2] = start_angle + arc * rotations
+
+# pixels of a frame blender wrote to disk, the file is removed once it is read
+def read_render_file(path):
+    CountWritten(GetFileSize(path))
+    pixels = DecodeFrame(path)
+    if pixels is None:
+        pixels = LoadImagePixels(path)
+    CountRead(GetFileSize(path))
+    os.remove(path)
+    return pixels
+
+# modifiers that change from frame to frame without any fcurve
+TIME_MODIFIERS = {'CLOTH', 'SOFT_BODY', 'DYNAMIC_PAINT', 'FLUID', 'OCEAN', 'PARTICLE_SYSTEM', 'WAVE', 'EXPLODE'}
+
+def is_animated(id_data):
+    anim_data = getattr(id_data, "animation_data", None)
+    return anim_data is not None and (anim_data.action is not None or len(anim_data.drivers) > 0 or len(anim_data.nla_tracks) > 0)
+
+def is_material_animated(material):
+    # keyframed node values live on the node tree
+    return material is not None and (is_animated(material) or is_animated(material.node_tree))
+
+# true when anything but the subject's action changes the hierarchy over time, renders that
+# move the action to other scene frames would show that at the wrong time
+def has_other_animation(subject, camera_track):
+    if subject.animation_data is not None and len(subject.animation_data.drivers) > 0:
+        return True
+
+    for obj in GetHierarchy(subject, camera_track):
+        if obj != subject and is_animated(obj):
+            return True
+        if any(modifier.type in TIME_MODIFIERS for modifier in obj.modifiers):
+            return True
+        if is_animated(obj.data) or is_animated(getattr(obj.data, "shape_keys", None)):
+            return True
+        if any(is_material_animated(slot.material) for slot in obj.material_slots):
+            return True
+
+    return False
+
+# true when the sampled fcurves are all the subject's pose depends on
+def can_detect_holds(hierarchy, cameras):
+    if any(is_animated(camera) for camera in cameras if camera is not None):
+        return False
+
+    for obj in hierarchy:
+        if any(modifier.type in TIME_MODIFIERS for modifier in obj.modifiers):
+            return False
+
+        anim_data = obj.animation_data
+        if anim_data is not None:
+            if any(not track.mute for track in anim_data.nla_tracks):
+                return False
+
+            for fcurve in anim_data.drivers:
+                driver = fcurve.driver
+                if driver.type == 'SCRIPTED' and "frame" in driver.expression:
+                    return False
+                for variable in driver.variables:
+                    for target in variable.targets:
+                        if target.id is not None and target.id not in hierarchy and is_animated(target.id):
+                            return False
+
+        # shape keys and materials can have actions of their own
+        if is_animated(getattr(obj.data, "shape_keys", None)):
+            return False
+        if any(is_material_animated(slot.material) for slot in obj.material_slots):
+            return False
+
+        constraints = list(obj.constraints)
+        if obj.pose is not None:
+            constraints += [constraint for bone in obj.pose.bones for constraint in bone.constraints]
+        for constraint in constraints:
+            target = getattr(constraint, "target", None)
+            if target is not None and target not in hierarchy and is_animated(target):
+                return False
+
+    return True
+
+def sample_pose(actions, frame):
+    return tuple(fcurve.evaluate(frame) for action in actions for fcurve in action.fcurves)
+
+# image entry the sheet was last rendered into, if its tile layout still matches the subject
+def find_image_prop(context, image):
+    scene = context.scene
+    mk_export_props = scene.mk_sprites_export_panel_properties
+    mk_render_props = scene.mk_sprites_render_panel_properties
+    mk_subject_props = scene.mk_sprites_subject_panel_properties
+
+    for image_prop in reversed(mk_export_props.image_props):
+        if image_prop.image != image or image_prop.object_angles != mk_subject_props.rotations:
+            continue
+        if image_prop.sprite_width != mk_render_props.resolution_x or image_prop.sprite_height != mk_render_props.resolution_y:
+            continue
+        if len(image_prop.object_actions) != len(mk_subject_props.obj_actions):
+            continue
+
+        same_actions = True
+        for item, anim in zip(image_prop.object_actions, mk_subject_props.obj_actions):
+            if item.action != anim.action or item.frame_count != GetActionFrameCount(anim.action, scene.frame_step):
+                same_actions = False
+                break
+
+        if same_actions:
+            return image_prop
+
+    return None
+
+
 class MK_SPRITES_OP_render_sprite_animation(bpy.types.Operator):
     """render subject to sprite atlass"""
 
@@ -23,21 +156,44 @@ class MK_SPRITES_OP_render_sprite_animation(bpy.types.Operator):
 
     subject_rotations: bpy.props.IntProperty(default=0)
     use_animations: bpy.props.BoolProperty(default=False)
+    action_index: bpy.props.IntProperty(default=-1)
+    shard_job: bpy.props.StringProperty(default="", options={'HIDDEN'})
+    net_worker: bpy.props.StringProperty(default="", options={'HIDDEN'})
+    worker_threads: bpy.props.IntProperty(default=0, options={'HIDDEN'})
 
     n = 0
+    tile = 0
+    capture = None
+    stream = None
+    cache = None
+    frame_slots = None
+    assigned = None
+    journal = None
+    border_objects = None
+    mirrored = {}
+    held = {}
+    cloth_caches = None
+    cloth_bakes = None
 
-    def render(self, context, renderpaths):
+    def render(self, context):
         mk_subject_props = context.scene.mk_sprites_subject_panel_properties
         subject = mk_subject_props.obj
 
         if self.use_animations:
-            self.render_animations(context, renderpaths, subject)
+            if context.scene.mk_sprites_render_panel_properties.render_order == 'GRID':
+                if self.can_render_grid(context, subject):
+                    return self.render_animations_grid(context, subject)
+                print("Grid rendering needs an orthographic camera and a subject animated only by its action, rendering frame by frame")
+
+            self.cloth_caches = []
+            try:
+                return self.render_animations(context, subject)
+            finally:
+                self.restore_cloth_caches(context)
         else:
-            self.render_frames(context, renderpaths, 0, 0, subject)
+            return self.render_frames(context, 0, 0, subject)
 
-    def render_frames(
-        self, context, renderpaths, first_frame=0, frames=0, subject=None
-    ):
+    def render_frames(self, context, first_frame=0, frames=0, subject=None):
         arc = (math.pi * 2) / self.subject_rotations
 
         rotations = max(1, self.subject_rotations)
@@ -45,12 +201,7 @@ class MK_SPRITES_OP_render_sprite_animation(bpy.types.Operator):
             rotations = 1
 
         # Find the "CameraTrack" child object
-        camera_track = None
-        if subject:
-            for child in subject.children:
-                if child.name == "CameraTrack":
-                    camera_track = child
-                    break
+        camera_track = find_camera_track(subject) if subject else None
 
         if not camera_track:
             self.report(
@@ -58,32 +209,427 @@ class MK_SPRITES_OP_render_sprite_animation(bpy.types.Operator):
             )
             return {"CANCELLED"}
 
-        file_type_ext = context.scene.render.file_extension
-        frame_step = context.scene.frame_step
+        scene = context.scene
+        frame_step = scene.frame_step
+
+        frame_list = [scene.frame_current]
+        if frames > 0:
+            frame_list = list(range(first_frame, first_frame + frames + 1, frame_step))
+
+        state_key = None
+        if self.cache is not None:
+            action = subject.animation_data.action if subject.animation_data else None
+            state_key = GetRenderStateKey(scene, subject, action, camera_track)
+
+        mk_render_props = scene.mk_sprites_render_panel_properties
+        if frames > 0 and rotations > 1:
+            if mk_render_props.render_order == 'FRAME':
+                return self.render_frames_frame_major(context, frame_list, camera_track, state_key, rotations, arc)
+            if mk_render_props.render_order == 'TIMELINE' and self.can_render_timeline(subject, camera_track):
+                return self.render_frames_timeline(context, frame_list, camera_track, state_key, rotations, arc, subject)
 
         for i in range(rotations):
             img_path = os.path.join(GetTempFolder(), str(self.n))
             self.n += 1
 
-            context.scene.render.filepath = img_path
+            scene.render.filepath = img_path
+
+            # frames found in the render cache go straight to the sheet
+            self.queue_frames(frame_list, camera_track, state_key)
 
-            if frames > 0:
-                bpy.ops.render.render(animation=True)
+            if not self.frame_slots:
+                print("Nothing left to render for rotation %d" % i)
 
-                for f in range(first_frame, first_frame + frames + 1, frame_step):
-                    renderpaths.append(img_path + str(f).zfill(4) + file_type_ext)
+            elif frames > 0 and self.capture is None and self.border_objects is None and len(self.frame_slots) == len(frame_list):
+                # tile every frame as soon as it is written instead of after the whole animation
+                bpy.app.handlers.render_write.append(self.on_frame_written)
+                try:
+                    bpy.ops.render.render(animation=True)
+                finally:
+                    bpy.app.handlers.render_write.remove(self.on_frame_written)
 
             else:
-                renderpaths.append(img_path + file_type_ext)
-                bpy.ops.render.render(animation=False, write_still=True)
+                self.render_frame_list(context)
 
             # Apply rotation to the "CameraTrack" object instead of the subject
             if camera_track and self.subject_rotations > 0:
                 print("Rotating by arc:", arc)
                 camera_track.rotation_euler[2] += arc
 
-    # Function to bake cloth simulation
+    def queue_frames(self, frame_list, camera_track, state_key):
+        self.frame_slots = {}
+
+        for f in frame_list:
+            index = self.tile
+            self.tile += 1
+
+            # render workers only render the tiles they were handed
+            if self.assigned is not None and index not in self.assigned:
+                continue
+
+            # finished by an interrupted run of the same job, flipped from another angle or held
+            if self.is_done(index):
+                continue
+
+            key = None
+            if self.cache is not None:
+                key = GetFrameKey(state_key, camera_track, f)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    self.stream.add(cached, index, remove_file=False)
+                    continue
+
+            self.frame_slots[f] = (index, key)
+
+    # queue every angle first, the tiles are the same as when rendering angle by angle
+    def queue_angles(self, frame_list, camera_track, state_key, start_angle, rotations, arc):
+        angle_slots = []
+        for i in range(rotations):
+            camera_track.rotation_euler[2] = start_angle + arc * i
+            self.queue_frames(frame_list, camera_track, state_key)
+            angle_slots.append(self.frame_slots)
+        return angle_slots
+
+    def is_done(self, index):
+        return index in self.mirrored or index in self.held or (self.journal is not None and index in self.journal)
+
+    def add_frame(self, frame, source):
+        index, key = self.frame_slots.pop(frame)
+        if isinstance(source, str):
+            CountWritten(GetFileSize(source))
+        self.add_tile(index, key, source)
+
+    def add_tile(self, index, key, source):
+        if key is not None:
+            self.cache.put(key, source)
+        self.stream.add(source, index)
+
+    def on_frame_written(self, scene, *args):
+        self.add_frame(scene.frame_current, scene.render.frame_path(frame=scene.frame_current))
+
+    # render the queued frames one by one, captured frames are kept in memory
+    # and only frames that can't be read back are written to disk
+    def render_frame_list(self, context):
+        scene = context.scene
+
+        for f in sorted(self.frame_slots):
+            scene.frame_set(f)
+            self.add_frame(f, self.render_still(context, f))
+
+    def render_still(self, context, frame):
+        scene = context.scene
+
+        rect = None
+        if self.border_objects is not None:
+            rect = self.set_render_border(context)
+
+        if self.capture is not None:
+            self.capture.clear()
+        bpy.ops.render.render(animation=False, write_still=False)
+
+        pixels = None
+        if self.capture is not None:
+            pixels = self.capture.read()
+
+        if pixels is None:
+            path = scene.render.frame_path(frame=frame)
+            bpy.data.images["Render Result"].save_render(path)
+            pixels = path
+
+        if rect is not None:
+            pixels = self.uncrop_frame(context, pixels, rect)
+
+        return pixels
+
+    # only render the part of the frame the subject covers, returns the pixel rect or None for the whole frame
+    def set_render_border(self, context):
+        render = context.scene.render
+        width, height = self.get_frame_size(context)
+
+        depsgraph = context.evaluated_depsgraph_get()
+        camera = context.scene.camera.evaluated_get(depsgraph)
+        projection = camera.calc_matrix_camera(depsgraph, x=width, y=height, scale_x=render.pixel_aspect_x, scale_y=render.pixel_aspect_y)
+
+        bounds = GetScreenBounds(GetWorldPoints(depsgraph, self.border_objects), projection @ camera.matrix_world.inverted())
+        rect = GetBorderRect(bounds, width, height, BORDER_PADDING) if bounds is not None else None
+
+        render.use_border = rect is not None
+        render.use_crop_to_border = rect is not None
+        if rect is not None:
+            # a quarter pixel in, so blender rounds to exactly these pixels
+            render.border_min_x = (rect[0] + 0.25) / width
+            render.border_min_y = (rect[1] + 0.25) / height
+            render.border_max_x = (rect[2] + 0.25) / width
+            render.border_max_y = (rect[3] + 0.25) / height
+        return rect
+
+    def uncrop_frame(self, context, pixels, rect):
+        if isinstance(pixels, str):
+            pixels = read_render_file(pixels)
+
+        width, height = self.get_frame_size(context)
+        return UncropFrame(pixels, rect, width, height)
+
+    def get_frame_size(self, context):
+        render = context.scene.render
+        return render.resolution_x * render.resolution_percentage // 100, render.resolution_y * render.resolution_percentage // 100
+
+    # step frames in the outer loop and angles in the inner one, so the animation,
+    # modifiers and simulations are evaluated once per frame instead of once per angle
+    def render_frames_frame_major(self, context, frame_list, camera_track, state_key, rotations, arc):
+        scene = context.scene
+
+        with orbit_camera_track(camera_track, rotations, arc) as start_angle:
+            rotation_slots = self.queue_angles(frame_list, camera_track, state_key, start_angle, rotations, arc)
+            rotation_paths = []
+            for i in range(rotations):
+                rotation_paths.append(os.path.join(GetTempFolder(), str(self.n)))
+                self.n += 1
+
+            old_persistent_data = scene.render.use_persistent_data
+            scene.render.use_persistent_data = True
+            try:
+                for f in frame_list:
+                    if not any(f in slots for slots in rotation_slots):
+                        continue
+
+                    scene.frame_set(f)
+                    for i, slots in enumerate(rotation_slots):
+                        if f not in slots:
+                            continue
+
+                        camera_track.rotation_euler[2] = start_angle + arc * i
+                        scene.render.filepath = rotation_paths[i]
+                        self.frame_slots = slots
+                        self.add_frame(f, self.render_still(context, f))
+            finally:
+                scene.render.use_persistent_data = old_persistent_data
+
+    def can_render_timeline(self, subject, camera_track):
+        # simulations are cached per scene frame, and other animation in the hierarchy
+        # would keep playing at the scene frame instead of following the moved action
+        if has_other_animation(subject, camera_track):
+            return False
+
+        # existing NLA strips or CameraTrack animation would be shifted along with the timeline
+        if subject.animation_data is None or len(subject.animation_data.nla_tracks) > 0:
+            return False
+        if camera_track.animation_data is not None and camera_track.animation_data.action is not None:
+            return False
+
+        return True
+
+    # lay the angles of the action out one after another on the timeline, every angle
+    # gets its own NLA strip of the action and a CameraTrack keyframe, so the whole
+    # action renders in one animation render
+    def render_frames_timeline(self, context, frame_list, camera_track, state_key, rotations, arc, subject):
+        scene = context.scene
+        first_frame = frame_list[0]
+        anim_data = subject.animation_data
+        action = anim_data.action
+
+        # segments start on a multiple of the frame step so every segment renders the same frames
+        span = CeilToMultiple(int(action.frame_range[1]) - first_frame + 1, scene.frame_step)
+
+        with orbit_camera_track(camera_track, rotations, arc) as start_angle:
+            # timeline frame -> (tile, cache key)
+            timeline_slots = {}
+            for i, slots in enumerate(self.queue_angles(frame_list, camera_track, state_key, start_angle, rotations, arc)):
+                for f, slot in slots.items():
+                    timeline_slots[first_frame + i * span + f - first_frame] = slot
+
+            scene.render.filepath = os.path.join(GetTempFolder(), str(self.n))
+            self.n += 1
+
+            old_frame_range = (scene.frame_start, scene.frame_end)
+            old_persistent_data = scene.render.use_persistent_data
+            had_camera_data = camera_track.animation_data is not None
+            track = anim_data.nla_tracks.new()
+            track.name = "mk_sprites_timeline"
+            anim_data.action = None
+
+            try:
+                for i in range(rotations):
+                    track.strips.new("%s_%d" % (action.name, i), first_frame + i * span, action)
+
+                    camera_track.rotation_euler[2] = start_angle + arc * i
+                    camera_track.keyframe_insert("rotation_euler", index=2, frame=first_frame + i * span)
+                for fcurve in camera_track.animation_data.action.fcurves:
+                    for key in fcurve.keyframe_points:
+                        key.interpolation = 'CONSTANT'
+
+                scene.frame_start = first_frame
+                scene.frame_end = first_frame + rotations * span - 1
+                scene.render.use_persistent_data = True
+
+                self.frame_slots = timeline_slots
+                if not self.frame_slots:
+                    print("Nothing left to render for %s" % action.name)
+                elif len(self.frame_slots) == rotations * len(frame_list) and self.capture is None and self.border_objects is None:
+                    bpy.app.handlers.render_write.append(self.on_frame_written)
+                    try:
+                        bpy.ops.render.render(animation=True)
+                    finally:
+                        bpy.app.handlers.render_write.remove(self.on_frame_written)
+                else:
+                    # some tiles are cached or captured in memory, render the rest one by one
+                    self.render_frame_list(context)
+
+            finally:
+                scene.frame_start, scene.frame_end = old_frame_range
+                scene.render.use_persistent_data = old_persistent_data
+
+                anim_data.nla_tracks.remove(track)
+                anim_data.action = action
+
+                camera_action = camera_track.animation_data.action
+                if had_camera_data:
+                    camera_track.animation_data.action = None
+                else:
+                    camera_track.animation_data_clear()
+                if camera_action is not None:
+                    bpy.data.actions.remove(camera_action)
+
+    def can_render_grid(self, context, subject):
+        camera = context.scene.camera
+        if camera is None or camera.type != 'CAMERA' or camera.data.type != 'ORTHO':
+            return False
+        camera_track = find_camera_track(subject)
+        if camera_track is None or subject.animation_data is None:
+            return False
+        # every copy plays the action at its own time, simulations and any other
+        # animation the copies share would play at the scene frame
+        if len(subject.animation_data.nla_tracks) > 0 or has_other_animation(subject, camera_track):
+            return False
+        return True
+
+    # render many frames at once: linked copies of the subject, each playing the action
+    # at another frame, are lined up in front of the orthographic camera and rendered
+    # into one image that is cut back into tiles
+    def render_animations_grid(self, context, subject):
+        scene = context.scene
+        mk_render_props = scene.mk_sprites_render_panel_properties
+        mk_subject_props = scene.mk_sprites_subject_panel_properties
+        camera_track = find_camera_track(subject)
+        frame_step = scene.frame_step
+
+        rotations = max(1, self.subject_rotations)
+        arc = (math.pi * 2) / rotations
+        offsets = GetActionTileOffsets(mk_subject_props.obj_actions, self.subject_rotations, frame_step)
+
+        # the frame every copy is evaluated at, strips are placed so each copy shows its own frame
+        play_frame = max(int(anim.action.frame_range[1]) for anim in mk_subject_props.obj_actions) + 1
+
+        with orbit_camera_track(camera_track, rotations, arc) as start_angle:
+            for i in range(rotations):
+                camera_track.rotation_euler[2] = start_angle + arc * i
+
+                # (action, frame, tile, cache key) of every tile of this angle that is still missing
+                slots = []
+                for index, anim in enumerate(mk_subject_props.obj_actions):
+                    if self.action_index >= 0 and index != self.action_index:
+                        continue
+
+                    first_frame = int(anim.action.frame_range[0])
+                    frame_list = list(range(first_frame, int(anim.action.frame_range[1]) + 1, frame_step))
+
+                    state_key = None
+                    if self.cache is not None:
+                        subject.animation_data.action = anim.action
+                        state_key = GetRenderStateKey(scene, subject, anim.action, camera_track, 'GRID')
+
+                    self.tile = offsets[index] + i * len(frame_list)
+                    self.queue_frames(frame_list, camera_track, state_key)
+                    for f, (tile, key) in sorted(self.frame_slots.items()):
+                        slots.append((anim.action, f, tile, key))
+
+                context.view_layer.update()
+                for start in range(0, len(slots), mk_render_props.grid_tiles):
+                    self.render_grid_block(context, subject, camera_track, slots[start:start + mk_render_props.grid_tiles], play_frame)
+
+    def render_grid_block(self, context, subject, camera_track, slots, play_frame):
+        scene = context.scene
+        camera = scene.camera
+        render = scene.render
+        width, height = render.resolution_x, render.resolution_y
+
+        # cells are a tile plus its gutter, in pixels and in world units
+        gutter_x, gutter_y = GetGridGutter(width, height)
+        cell_x, cell_y = width + gutter_x, height + gutter_y
+        tile_width, tile_height = GetOrthoTileSize(camera.data, width, height)
+        tile_width *= cell_x / width
+        tile_height *= cell_y / height
+        cols, rows = GetGridShape(len(slots), cell_x, cell_y)
+        right = camera.matrix_world.col[0].xyz.normalized()
+        up = camera.matrix_world.col[1].xyz.normalized()
+        base = subject.parent.matrix_world.copy() if subject.parent else mathutils.Matrix.Identity(4)
+
+        hierarchy = GetHierarchy(subject, camera_track)
+        old_hide_render = [obj.hide_render for obj in hierarchy]
+        old_camera = (camera.data.ortho_scale, camera.data.shift_x, camera.data.shift_y, camera.data.sensor_fit)
+        old_resolution = (render.resolution_x, render.resolution_y)
+        old_frame = scene.frame_current
+
+        collection = bpy.data.collections.new("mk_sprites_grid")
+        scene.collection.children.link(collection)
+
+        # the grid covers the whole frame anyway
+        border_objects = self.border_objects
+        self.border_objects = None
+
+        try:
+            for j, (action, frame, tile, key) in enumerate(slots):
+                strip_start = play_frame - frame + int(action.frame_range[0])
+                anchor = CreateGridInstance(subject, camera_track, collection, action, strip_start)
+                MoveToGridCell(anchor, base, right, up, (j % cols) * tile_width, (j // cols) * tile_height)
+
+            for obj in hierarchy:
+                obj.hide_render = True
+
+            # widen the camera over the whole grid, centered where the first tile was
+            scale = max(cols * tile_width, rows * tile_height)
+            camera.data.shift_x = (old_camera[1] * old_camera[0] + (cols - 1) / 2 * tile_width) / scale
+            camera.data.shift_y = (old_camera[2] * old_camera[0] - (rows - 1) / 2 * tile_height) / scale
+            camera.data.ortho_scale = scale
+            camera.data.sensor_fit = 'AUTO'
+            render.resolution_x = cols * cell_x
+            render.resolution_y = rows * cell_y
+
+            scene.frame_set(play_frame)
+            render.filepath = os.path.join(GetTempFolder(), "grid")
+            pixels = self.render_still(context, play_frame)
+
+            if isinstance(pixels, str):
+                pixels = read_render_file(pixels)
+
+            for (action, frame, tile, key), tile_pixels in zip(slots, SliceGrid(pixels, cols, rows, len(slots), gutter_x, gutter_y)):
+                self.add_tile(tile, key, tile_pixels)
+
+        finally:
+            for obj in list(collection.objects):
+                bpy.data.objects.remove(obj, do_unlink=True)
+            bpy.data.collections.remove(collection)
+
+            for obj, hide_render in zip(hierarchy, old_hide_render):
+                obj.hide_render = hide_render
+            camera.data.ortho_scale, camera.data.shift_x, camera.data.shift_y, camera.data.sensor_fit = old_camera
+            render.resolution_x, render.resolution_y = old_resolution
+            scene.frame_set(old_frame)
+            self.border_objects = border_objects
+
+    # Function to bake cloth simulation, bakes are stored per action and reused until something they depend on changes
     def bake_cloth_simulation(self, context, objs):
+        scene = context.scene
+        mk_render_props = scene.mk_sprites_render_panel_properties
+        subject = scene.mk_sprites_subject_panel_properties.obj
+        action = subject.animation_data.action if subject.animation_data else None
+
+        # disk caches need a saved file, and render workers sharing its cache folder only read bakes
+        bake_folder = None
+        if mk_render_props.reuse_cloth_bakes and bpy.data.is_saved:
+            bake_folder = GetClothBakeFolder(mk_render_props.cache_folder)
+        store_bakes = bake_folder is not None and not self.shard_job and not self.net_worker
+
         for obj in objs:
 
             if obj.hide_render:
@@ -96,27 +642,91 @@ class MK_SPRITES_OP_render_sprite_animation(bpy.types.Operator):
             
             for modifier in obj.modifiers:
                 if modifier.type == 'CLOTH':
-                    # Clear previous bake
-                    
-                    # Keep defined modifier simulation range
-                    # modifier.point_cache.frame_start = context.scene.frame_start
-                    # modifier.point_cache.frame_end = context.scene.frame_end
-                    bpy.ops.ptcache.free_bake_all()
-                    print(f"Cleared previous bake for: {obj.name}")
-
-                    print(f"Baking cloth simulation for: {obj.name}")
+                    point_cache = modifier.point_cache
+
+                    # the user's cache settings are put back once every action is rendered
+                    if self.cloth_caches is not None and not any(cache == point_cache for o, cache, settings in self.cloth_caches):
+                        self.cloth_caches.append((obj, point_cache, (point_cache.use_disk_cache, point_cache.use_external,
+                            point_cache.filepath, point_cache.name, point_cache.index)))
+
+                    key = None
+                    if bake_folder is not None or self.cloth_bakes is not None:
+                        key = GetClothBakeKey(scene, subject, obj, modifier, action, find_camera_track(subject))
+
+                    # render workers keep what they baked for earlier units in memory
+                    if self.cloth_bakes is not None and self.cloth_bakes.get((obj.name, modifier.name)) == key \
+                            and point_cache.is_baked and not point_cache.use_external:
+                        print(f"Keeping cloth bake for: {obj.name}")
+                        break
+
+                    folder = None
+                    if bake_folder is not None:
+                        folder = os.path.join(bake_folder, key)
+                        stored = GetStoredBake(folder) if os.path.isdir(folder) else None
+                        if stored is not None:
+                            # read the stored bake in place, external caches are never rewritten,
+                            # the name and index pick the stored files
+                            print(f"Reusing cloth bake for: {obj.name}")
+                            point_cache.use_external = True
+                            point_cache.filepath = folder
+                            point_cache.name, point_cache.index = stored
+                            os.utime(folder)
+                            if self.cloth_bakes is not None:
+                                self.cloth_bakes.pop((obj.name, modifier.name), None)
+                            break
+
                     # Override the context for baking
                     override = context.copy()
                     override['active_object'] = obj
                     override['object'] = obj
-                    override['point_cache'] = modifier.point_cache
+                    override['point_cache'] = point_cache
                     with bpy.context.temp_override(**override):
+                        # Clear previous bake of this object only
+                        # Keep defined modifier simulation range
+                        point_cache.use_external = False
+                        bpy.ops.ptcache.free_bake()
+                        print(f"Cleared previous bake for: {obj.name}")
+
+                        if store_bakes:
+                            point_cache.use_disk_cache = True
+
+                        print(f"Baking cloth simulation for: {obj.name}")
                         bpy.ops.ptcache.bake(bake=True)
+
+                    if store_bakes and point_cache.use_disk_cache:
+                        StoreClothBake(GetBakeFiles(point_cache, obj), folder)
+                    if self.cloth_bakes is not None:
+                        self.cloth_bakes[(obj.name, modifier.name)] = key
                     break  # Assuming we only have one cloth modifier per object
 
             # Deselect the object after baking
             obj.select_set(False)
 
+        if store_bakes:
+            EvictClothBakes(bake_folder, mk_render_props.cache_size * 1024 * 1024)
+
+    def restore_cloth_caches(self, context):
+        for obj, point_cache, settings in self.cloth_caches or []:
+            use_disk_cache, use_external, filepath, name, index = settings
+
+            override = context.copy()
+            override['active_object'] = obj
+            override['object'] = obj
+            override['point_cache'] = point_cache
+            with bpy.context.temp_override(**override):
+                point_cache.use_external = False
+                # a bake written to disk for the store is freed before the disk cache is turned off again
+                if point_cache.use_disk_cache != use_disk_cache:
+                    bpy.ops.ptcache.free_bake()
+                    point_cache.use_disk_cache = use_disk_cache
+
+            point_cache.name = name
+            point_cache.index = index
+            point_cache.filepath = filepath
+            point_cache.use_external = use_external
+
+        self.cloth_caches = None
+
     def prepare_for_rendering(self, context, subject):
         # Check the subject and its siblings for cloth modifiers and bake if necessary
         if subject:
@@ -125,11 +735,24 @@ class MK_SPRITES_OP_render_sprite_animation(bpy.types.Operator):
 
     # render the animation or sprites for each animation
     # these animations are stored in scene.mk_sprites_subject_panel_properties
-    def render_animations(self, context, renderpaths, subject):
+    def render_animations(self, context, subject):
         mk_subject_props = context.scene.mk_sprites_subject_panel_properties
 
-        # render each animation
-        for anim in mk_subject_props.obj_actions:
+        offsets = GetActionTileOffsets(mk_subject_props.obj_actions, self.subject_rotations, context.scene.frame_step)
+
+        # render each animation, or only the one being patched
+        for index, anim in enumerate(mk_subject_props.obj_actions):
+            if self.action_index >= 0 and index != self.action_index:
+                continue
+
+            tiles = range(offsets[index], offsets[index] + GetActionFrameCount(anim.action, context.scene.frame_step) * max(1, self.subject_rotations))
+            if self.assigned is not None and self.assigned.isdisjoint(tiles):
+                continue
+            if all(self.is_done(tile) for tile in tiles):
+                print(f"Skipping finished animation: {anim.action.name}")
+                continue
+
+            self.tile = offsets[index]
 
             print(f"Rendering animation: {anim.action.name}")
 
@@ -145,18 +768,342 @@ class MK_SPRITES_OP_render_sprite_animation(bpy.types.Operator):
 
             # Bake any physics simulations etc.
             self.prepare_for_rendering(context, subject)
-            self.render_frames(context, renderpaths, frame_start, frame_range, subject)
+            result = self.render_frames(context, frame_start, frame_range, subject)
+            if result == {"CANCELLED"}:
+                return result
 
-    def execute(self, context):
+    # render in this process, every frame goes to self.stream
+    def render_local(self, context):
+        scene = context.scene
+        mk_render_props = scene.mk_sprites_render_panel_properties
+
+        if mk_render_props.use_render_cache:
+            cache_folder = GetCacheFolder(mk_render_props.cache_folder)
+            self.cache = RenderCache(cache_folder, mk_render_props.cache_size * 1024 * 1024)
+
+        # capture frames from the compositor, the temp folder is only used as a fallback
+        old_frame = scene.frame_current
+        if mk_render_props.capture_in_memory and CanCaptureInMemory(scene):
+            self.capture = ViewerCapture(scene)
+
+        # the cropped away part of a frame has to be transparent
+        render = scene.render
+        old_border = (render.use_border, render.use_crop_to_border, render.border_min_x, render.border_min_y, render.border_max_x, render.border_max_y)
+        subject = scene.mk_sprites_subject_panel_properties.obj
+        if mk_render_props.use_subject_border and render.film_transparent and scene.camera is not None:
+            self.border_objects = GetHierarchy(subject, find_camera_track(subject))
+
+        try:
+            result = self.render(context)
+        finally:
+            if self.capture is not None:
+                self.capture.remove()
+                self.capture = None
+            self.border_objects = None
+            render.use_border, render.use_crop_to_border, render.border_min_x, render.border_min_y, render.border_max_x, render.border_max_y = old_border
+            scene.frame_set(old_frame)
+
+        if self.cache is not None:
+            self.cache.evict()
+            self.cache = None
+
+        return result
+
+    # split the actions and rotations between background blender processes and tile what they send back
+    def render_sharded(self, context):
         scene = context.scene
-        mk_export_props = scene.mk_sprites_export_panel_properties
         mk_render_props = scene.mk_sprites_render_panel_properties
         mk_subject_props = scene.mk_sprites_subject_panel_properties
-        frame_step = scene.frame_step
+        workers = mk_render_props.render_workers
+
+        plan = BuildRenderPlan(mk_subject_props.obj_actions, self.subject_rotations, scene.frame_step)
+        if self.action_index >= 0:
+            plan = [unit for unit in plan if unit["action"] == self.action_index]
+
+        folder = os.path.join(GetTempFolder(), "shards")
+        os.makedirs(folder, exist_ok=True)
+
+        # the workers load the scene as it is right now
+        blend_path = os.path.join(folder, "shard.blend")
+        bpy.ops.wm.save_as_mainfile(filepath=blend_path, copy=True)
+
+        options = {
+            "subject_rotations": self.subject_rotations,
+            "use_animations": True,
+            "action_index": self.action_index,
+            "threads": GetWorkerThreads(workers),
+        }
+        shards = [[tile for tile in shard if not self.is_done(tile)] for shard in SplitRenderPlan(plan, workers)]
+
+        # captured frames come back through memory-mapped rings, frames written to disk as numbered files
+        height, width = GetRingFrameSize(scene)
+        ring_folder = GetRingFolder(folder)
+        rings = []
+        try:
+            for i in range(len(shards)):
+                path = os.path.join(ring_folder, "mk_sprites_%d_ring_%d" % (os.getpid(), i))
+                rings.append(FrameRing(path, RING_SLOTS, height, width, create=True))
+        except OSError as e:
+            print("Unable to create frame rings, falling back to files: %s" % e)
+            for ring in rings:
+                ring.close(remove=True)
+            rings = []
+
+        job_paths = WriteShardJobs(folder, shards, options, rings or None)
+        processes = LaunchWorkers(blend_path, job_paths)
+
+        try:
+            collected = CollectShardFrames(os.path.join(folder, "frames"), self.stream, processes, rings)
+        finally:
+            for ring in rings:
+                ring.close(remove=True)
+        expected = sum(len(shard) for shard in shards)
+
+        if collected != expected or any(process.returncode != 0 for process in processes):
+            self.report({"ERROR"}, "Render workers failed, %d of %d frames rendered" % (collected, expected))
+            return {"CANCELLED"}
+
+        return {"FINISHED"}
+
+    # worker side of render_sharded, renders the assigned tiles and writes them to the shard folder
+    def execute_shard(self, context):
+        scene = context.scene
+        mk_render_props = scene.mk_sprites_render_panel_properties
+
+        with open(self.shard_job) as f:
+            job = json.load(f)
+
+        scene.render.threads_mode = 'FIXED'
+        scene.render.threads = job["threads"]
+        scene.render.resolution_x = mk_render_props.resolution_x
+        scene.render.resolution_y = mk_render_props.resolution_y
+
+        if not CreateTempFolder(mk_render_props.scratch_folder, mk_render_props.use_ram_disk):
+            return {"CANCELLED"}
+
+        self.assigned = set(job["tiles"])
+        self.stream = ShardWriter(job["output"])
+        if "ring" in job:
+            height, width = GetRingFrameSize(scene)
+            ring = FrameRing(job["ring"]["path"], job["ring"]["slots"], height, width)
+            self.stream = RingWriter(ring, self.stream)
+
+        try:
+            result = self.render_local(context)
+        finally:
+            self.stream.finish()
+
+        print("Render worker scratch I/O: %s" % FormatIOStats())
+        ClearTempFolder()
+        return result
+
+    # hand frame chunks out to network workers, local workers are started to join in
+    def render_distributed(self, context):
+        scene = context.scene
+        mk_render_props = scene.mk_sprites_render_panel_properties
+        mk_subject_props = scene.mk_sprites_subject_panel_properties
+
+        plan = BuildRenderPlan(mk_subject_props.obj_actions, self.subject_rotations, scene.frame_step)
+        if self.action_index >= 0:
+            plan = [unit for unit in plan if unit["action"] == self.action_index]
+
+        folder = os.path.join(GetTempFolder(), "coordinator")
+        os.makedirs(folder, exist_ok=True)
+
+        blend_path = os.path.join(folder, "scene.blend")
+        bpy.ops.wm.save_as_mainfile(filepath=blend_path, copy=True)
+
+        options = {
+            "subject_rotations": self.subject_rotations,
+            "use_animations": True,
+            "action_index": self.action_index,
+        }
+        chunks = [[tile for tile in chunk if not self.is_done(tile)] for chunk in ChunkRenderPlan(plan, mk_render_props.chunk_size)]
+
+        # only workers on this machine connect unless remote ones are asked for, and those must know the token
+        host = "127.0.0.1"
+        token = None
+        if mk_render_props.allow_remote_workers:
+            if not mk_render_props.coordinator_token:
+                self.report({"ERROR"}, "Remote render workers need a token")
+                return {"CANCELLED"}
+            host = "0.0.0.0"
+            token = mk_render_props.coordinator_token
+
+        coordinator = RenderCoordinator(
+            [chunk for chunk in chunks if chunk],
+            options,
+            host=host,
+            port=mk_render_props.coordinator_port,
+            lease_timeout=mk_render_props.lease_timeout,
+            scene_path=blend_path,
+            token=token,
+        )
+        coordinator.start()
+        print("Render coordinator listening on %s:%d" % coordinator.address)
+
+        workers = mk_render_props.render_workers
+        processes = LaunchNetworkWorkers("127.0.0.1", coordinator.address[1], workers, GetWorkerThreads(workers), coordinator.token)
+
+        try:
+            success = coordinator.run(self.stream)
+        finally:
+            coordinator.stop()
+            for process in processes:
+                if process.poll() is None:
+                    process.terminate()
+
+        if not success:
+            self.report({"ERROR"}, "Distributed render failed, %d units could not be rendered" % len(coordinator.failed))
+            return {"CANCELLED"}
+
+        return {"FINISHED"}
+
+    # worker side of render_distributed, renders units until the coordinator runs out of them
+    def execute_network_worker(self, context):
+        scene = context.scene
+        mk_render_props = scene.mk_sprites_render_panel_properties
+
+        if self.worker_threads > 0:
+            scene.render.threads_mode = 'FIXED'
+            scene.render.threads = self.worker_threads
+        scene.render.resolution_x = mk_render_props.resolution_x
+        scene.render.resolution_y = mk_render_props.resolution_y
+
+        if not CreateTempFolder(mk_render_props.scratch_folder, mk_render_props.use_ram_disk):
+            return {"CANCELLED"}
+
+        host, port = self.net_worker.rsplit(":", 1)
+        client = RenderWorkerClient(host, int(port), GetWorkerToken())
+        self.stream = NetworkFrameWriter(client)
+        # an action is split into several units, its cloth is only baked once per worker
+        self.cloth_bakes = {}
+        result = {"FINISHED"}
+
+        try:
+            while True:
+                unit = client.next_unit()
+                if unit is None:
+                    break
+
+                options = unit["options"]
+                self.subject_rotations = options["subject_rotations"]
+                self.use_animations = options["use_animations"]
+                self.action_index = options["action_index"]
+                self.assigned = set(unit["tiles"])
+                self.tile = 0
+
+                try:
+                    result = self.render_local(context)
+                except Exception as e:
+                    client.fail(str(e))
+                    raise
+
+                if result == {"CANCELLED"}:
+                    client.fail("render cancelled")
+                    break
+
+                client.complete()
+        finally:
+            client.close()
+            print("Render worker scratch I/O: %s" % FormatIOStats())
+            ClearTempFolder()
+
+        return result
+
+    def use_mirrored_angles(self, context):
+        mk_subject_props = context.scene.mk_sprites_subject_panel_properties
+        if mk_subject_props.mirror_angles == 'OFF' or self.subject_rotations < 3:
+            return False
+        if mk_subject_props.mirror_angles == 'ON':
+            return True
+
+        symmetric = self.detect_mirror_symmetry(context, mk_subject_props.obj)
+        print("Subject %s symmetric: %s" % (mk_subject_props.obj.name, symmetric))
+        return symmetric
+
+    # render the first angles on either side of angle 0 and check if one is the other flipped
+    def detect_mirror_symmetry(self, context, subject):
+        scene = context.scene
+        mk_subject_props = scene.mk_sprites_subject_panel_properties
+        camera_track = find_camera_track(subject)
+        if camera_track is None:
+            return False
+
+        # test a pose from the middle of the first action, if there is one
+        anim_data = subject.animation_data
+        old_action = anim_data.action if anim_data else None
+        old_frame = scene.frame_current
+        if self.use_animations and anim_data and len(mk_subject_props.obj_actions) > 0:
+            action = mk_subject_props.obj_actions[0].action
+            anim_data.action = action
+            scene.frame_set(int(sum(action.frame_range) / 2))
+
+        arc = (math.pi * 2) / self.subject_rotations
+        start_angle = camera_track.rotation_euler[2]
+        frames = []
+        try:
+            for i in (1, self.subject_rotations - 1):
+                camera_track.rotation_euler[2] = start_angle + arc * i
+                bpy.ops.render.render(animation=False, write_still=False)
+
+                path = os.path.join(GetTempFolder(), "mirror_test_%d%s" % (i, scene.render.file_extension))
+                bpy.data.images["Render Result"].save_render(path)
+                frames.append(LoadImagePixels(path))
+                os.remove(path)
+        finally:
+            camera_track.rotation_euler[2] = start_angle
+            if anim_data is not None:
+                anim_data.action = old_action
+            scene.frame_set(old_frame)
+
+        return IsMirrorImage(frames[0], frames[1])
+
+    # sample the fcurves of every action, frames that repeat the previous pose are held
+    def detect_hold_frames(self, context, subject):
+        scene = context.scene
+        mk_subject_props = scene.mk_sprites_subject_panel_properties
+        camera_track = find_camera_track(subject)
+
+        hierarchy = GetHierarchy(subject, camera_track)
+        if not can_detect_holds(hierarchy, (camera_track, scene.camera)):
+            print("Subject %s depends on more than its actions, rendering every frame" % subject.name)
+            return None
+
+        # actions of the subject's children play along with every action
+        child_actions = [obj.animation_data.action for obj in hierarchy
+            if obj != subject and obj.animation_data is not None and obj.animation_data.action is not None]
+
+        holds = []
+        for anim in mk_subject_props.obj_actions:
+            frames = range(int(anim.action.frame_range[0]), int(anim.action.frame_range[1]) + 1, scene.frame_step)
+            holds.append(GetHoldFrames([sample_pose([anim.action] + child_actions, f) for f in frames]))
+        return holds
+
+    def open_journal(self, context):
+        mk_render_props = context.scene.mk_sprites_render_panel_properties
+        mk_subject_props = context.scene.mk_sprites_subject_panel_properties
+        subject = mk_subject_props.obj
+        camera_track = find_camera_track(subject)
+
+        actions = [anim.action for anim in mk_subject_props.obj_actions] if self.use_animations else []
+        job_key = GetJobKey(context.scene, subject, actions, self.subject_rotations, camera_track)
+        cache_folder = GetCacheFolder(mk_render_props.cache_folder)
+        folder = GetJobFolder(cache_folder, job_key)
+        PruneJobFolders(cache_folder, folder)
+        return RenderJournal(folder)
+
+    def execute(self, context):
+        if self.shard_job:
+            return self.execute_shard(context)
+        if self.net_worker:
+            return self.execute_network_worker(context)
+
+        mk_render_props = context.scene.mk_sprites_render_panel_properties
 
         # set up folders to render into
         old_path = bpy.context.scene.render.filepath
-        if not CreateTempFolder():
+        if not CreateTempFolder(mk_render_props.scratch_folder, mk_render_props.use_ram_disk):
             return {"FINISHED"}
         bpy.context.scene.render.filepath = GetTempFolder()
 
@@ -166,11 +1113,32 @@ class MK_SPRITES_OP_render_sprite_animation(bpy.types.Operator):
         context.scene.render.resolution_x = mk_render_props.resolution_x
         context.scene.render.resolution_y = mk_render_props.resolution_y
 
-        renderpaths = []
+        # frames that can't go anywhere are reported, whenever the render stops the scene is put back
+        try:
+            return self.render_sheet(context)
+        except ValueError as e:
+            self.report({"ERROR"}, str(e))
+            return {"CANCELLED"}
+        finally:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+            bpy.context.scene.render.filepath = old_path
+            context.scene.render.resolution_x = old_x
+            context.scene.render.resolution_y = old_y
+            ClearTempFolder()
 
-        self.render(context, renderpaths)
+    def render_sheet(self, context):
+        scene = context.scene
+        mk_export_props = scene.mk_sprites_export_panel_properties
+        mk_render_props = scene.mk_sprites_render_panel_properties
+        mk_subject_props = scene.mk_sprites_subject_panel_properties
+        frame_step = scene.frame_step
 
-        # once all images rendered
+        # the sheet size is known up front, so frames can be tiled while rendering
         size = (mk_render_props.image_resolution_x, mk_render_props.image_resolution_y)
 
         print(
@@ -181,35 +1149,164 @@ class MK_SPRITES_OP_render_sprite_animation(bpy.types.Operator):
             mk_subject_props.rotations,
         )
         print("Auto resolution: ", mk_subject_props.obj_actions)
+
+        # tiles of every action and angle in the order they are laid out
+        frame_counts = [GetActionFrameCount(anim.action, frame_step) for anim in mk_subject_props.obj_actions] if self.use_animations else [1]
+        unit_lengths = [count for count in frame_counts for rotation in range(max(1, self.subject_rotations))]
+
+        sprite_x, sprite_y = mk_render_props.resolution_x, mk_render_props.resolution_y
+        max_size = mk_render_props.max_sheet_size
+
+        # untrimmed sprites larger than a sheet can't go anywhere, trimmed ones may still fit
+        if max_size and (sprite_x > max_size or sprite_y > max_size) and not mk_render_props.trim_frames:
+            self.report({"ERROR"}, "%dx%d sprites are larger than the %d pixel sheet size" % (sprite_x, sprite_y, max_size))
+            return {"CANCELLED"}
+
+        page_grid = SheetGrid.from_sheet(sprite_x, sprite_y, size[0], size[1])
         if mk_render_props.auto_resolution:
-            size = AutoImageSize(
-                mk_render_props.resolution_x,
-                mk_render_props.resolution_y,
-                mk_subject_props.obj_actions,
-                mk_subject_props.rotations,
-                frame_step,
-            )
-            print(size)
+            page_grid = SheetGrid(sprite_x, sprite_y, max_size // sprite_x, max_size // sprite_y) if max_size else None
+            if page_grid is None or sum(unit_lengths) <= page_grid.columns * page_grid.rows:
+                size = AutoImageSize(
+                    sprite_x,
+                    sprite_y,
+                    mk_subject_props.obj_actions,
+                    mk_subject_props.rotations,
+                    frame_step,
+                    mk_render_props.grid_fit,
+                    mk_render_props.grid_aspect,
+                    max_size,
+                )
+                print(size)
 
         name = mk_subject_props.obj.name
-        img = TilePathsIntoImage(name, renderpaths, size[0], size[1])
 
-        image_prop = mk_export_props.image_props.add()
-        image_prop.image = img
-        image_prop.object_angles = mk_subject_props.rotations
-        for anim in mk_subject_props.obj_actions:
-            item = image_prop.object_actions.add()
-            item.action = anim.action
+        # sheets after the first are named after their page
+        def get_page_image(page, width, height):
+            return GetSpritesheet("%s_%d" % (name, page), width, height)
+
+        # packed sheets are sized once every frame is in, trimming always packs
+        packer = None
+        if mk_render_props.sheet_layout != 'GRID' or mk_render_props.trim_frames:
+            method = 'SHELF' if mk_render_props.sheet_layout == 'GRID' else mk_render_props.sheet_layout
+            packer = {"method": method, "objective": mk_render_props.pack_objective,
+                "padding": mk_render_props.pack_padding, "trim": mk_render_props.trim_frames,
+                "max_size": max_size, "get_page_image": get_page_image, "spill_folder": GetTempFolder(),
+                "groups": [unit for unit, length in enumerate(unit_lengths) for i in range(length)]}
+            existing = bpy.data.images.get(name)
+            size = tuple(existing.size) if existing is not None else (1, 1)
+
+        # tiles that don't fit one sheet spill onto more pages, each action and angle stays on one
+        pages = None
+        if packer is None and page_grid is not None and sum(unit_lengths) > page_grid.columns * page_grid.rows:
+            page_map = GetPageMap(unit_lengths, page_grid.columns * page_grid.rows)
+            page_count = page_map[-1][0] + 1
+            page_grids = [page_grid] * page_count
+            if mk_render_props.auto_resolution:
+                page_grids = [FitSheetGrid(sum(1 for tile_page, slot in page_map if tile_page == page), sprite_x, sprite_y,
+                    mk_render_props.grid_fit, mk_render_props.grid_aspect, max_size) for page in range(page_count)]
+            size = page_grids[0].size
+            pages = {"page_map": page_map, "page_grids": page_grids, "get_page_image": get_page_image}
+            print("Splitting %d frames over %d pages" % (len(page_map), page_count))
+
+        spritesheet = GetSpritesheet(name, size[0], size[1])
+
+        # a single action can only be patched in place while the tile layout is unchanged
+        image_prop = find_image_prop(context, spritesheet)
+        if self.action_index >= 0 and (image_prop is None or packer is not None or pages is not None or image_prop.packed or len(image_prop.pages)):
+            self.report({"INFO"}, "Sprite layout changed, rendering every action")
+            self.action_index = -1
+
+        stream = SpritesheetStream(spritesheet, keep_existing=self.action_index >= 0, packer=packer, pages=pages)
+        self.stream = stream
+
+        # angles of a symmetric subject that are flips of earlier ones are tiled from those,
+        # or left out for engines that flip them when drawing
+        mirror = self.use_mirrored_angles(context)
+        flip_mirrored = mirror and mk_subject_props.mirror_tiles == 'FLIP'
+        self.mirrored = {}
+        if mirror:
+            self.mirrored = GetMirroredTiles(frame_counts, self.subject_rotations)
+            if not flip_mirrored:
+                for target, source in self.mirrored.items():
+                    self.stream.mirrors.setdefault(source, []).append(target)
+            elif pages is not None:
+                stream.sheet.skip(self.mirrored)
+
+        # frames that repeat the previous pose are rendered once and exported with a duration
+        holds = None
+        self.held = {}
+        if mk_render_props.skip_held_frames and self.use_animations:
+            holds = self.detect_hold_frames(context, mk_subject_props.obj)
+            if holds is not None:
+                self.held = GetHeldTiles(holds, self.subject_rotations)
+                print("Skipping %d held frames" % len(self.held))
+                if pages is not None:
+                    stream.sheet.skip(self.held)
+
+        # frames of an interrupted render of the same job are reused
+        if mk_render_props.resume_renders:
+            self.journal = self.open_journal(context)
+            if len(self.journal):
+                print("Resuming render, %d frames already finished" % len(self.journal))
+            self.stream = JournalStream(self.stream, self.journal)
+            self.stream.restore()
+
+        if mk_render_props.use_distributed and self.use_animations:
+            result = self.render_distributed(context)
+        elif mk_render_props.render_workers > 1 and self.use_animations:
+            result = self.render_sharded(context)
+        else:
+            result = self.render_local(context)
+
+        # once all images rendered
+        img = self.stream.finish()
+        self.stream = None
+        print("Scratch I/O: %s" % FormatIOStats())
+
+        journal = self.journal
+        self.journal = None
+
+        if result == {"CANCELLED"}:
+            if journal is not None and len(journal):
+                self.report({"INFO"}, "%d finished frames are kept, rendering the same job again resumes it" % len(journal))
+            return result
+
+        # only a new layout needs a new image entry
+        if image_prop is None:
+            image_prop = mk_export_props.image_props.add()
+            image_prop.image = img
+            image_prop.object_angles = mk_subject_props.rotations
+            image_prop.sprite_width = mk_render_props.resolution_x
+            image_prop.sprite_height = mk_render_props.resolution_y
+            for anim in mk_subject_props.obj_actions:
+                item = image_prop.object_actions.add()
+                item.action = anim.action
+                item.frame_count = GetActionFrameCount(anim.action, frame_step)
 
         print(image_prop.object_actions)
 
-        mk_export_props.image = img
-        mk_export_props.active_image = len(mk_export_props.image_props) - 1
+        # frame rects the exporters write out
+        image_prop.mirror_angles = mirror
+        image_prop.packed = packer is not None
+        rects = stream.sheet.rects if packer is not None else None
+        page_layout = (pages["page_map"], pages["page_grids"]) if pages is not None else None
+        animations = [{"name": item.action.name, "frame_count": item.frame_count} for item in image_prop.object_actions if item.action]
+        image_prop.sprite_data = json.dumps(GetSheetLayout(animations, image_prop.object_angles,
+            image_prop.sprite_width, image_prop.sprite_height, img.size[0], img.size[1], mirror, holds, rects, page_layout, flip_mirrored))
 
-        # cleanup
-        bpy.context.scene.render.filepath = old_path
-        context.scene.render.resolution_x = old_x
-        context.scene.render.resolution_y = old_y
+        # images of the pages after the first, pages left over from a larger render are removed
+        page_images = stream.sheet.page_images if packer is not None or pages is not None else {}
+        old_pages = [item.image for item in image_prop.pages if item.image is not None]
+        image_prop.pages.clear()
+        for page in sorted(page_images):
+            image_prop.pages.add().image = page_images[page]
+        for image in old_pages:
+            if image not in page_images.values():
+                bpy.data.images.remove(image)
 
-        ClearTempFolder()
+        mk_export_props.image = img
+        mk_export_props.active_image = list(mk_export_props.image_props).index(image_prop)
+
+        if journal is not None:
+            journal.remove()
         return {"FINISHED"}
@@ -8,8 +8,8 @@ from bpy.props import PointerProperty, StringProperty, IntProperty, BoolProperty
 from .ui_subject_panel import MK_SPRITES_action_item
 
 from ..utils.xmlutils import GetMonoXMLHeader, XMLIndent, ExportXml
-from ..utils.tileutils import GetTilePos
-from ..operators.op_export_data_sheets import MK_SPRITES_OP_export_image_json, MK_SPRITES_OP_export_image_xml, MK_SPRITES_OP_export_bevy_image_json, MK_SPRITES_OP_export_godot_sprite_frames
+from ..utils.helpers import GetTilePos
+from ..operators.op_export_data_sheets import get_page_path, MK_SPRITES_OP_export_image_json, MK_SPRITES_OP_export_image_xml, MK_SPRITES_OP_export_bevy_image_json, MK_SPRITES_OP_export_godot_sprite_frames
 
 def update_active_image(self, context):
     export_props = context.scene.mk_sprites_export_panel_properties
@@ -23,6 +23,45 @@ def update_active_image(self, context):
             export_props.image_props[export_props.active_image].image = image_prop.image
             return
 
+# shared by the export dialog and the headless batch runner
+def export_image_data(context, filepath, export_image=True, export_json=False, export_bevy_json=False,
+        export_godot_sprite_frames=False, export_xml=False, export_mono=False):
+    export_props = context.scene.mk_sprites_export_panel_properties
+
+    if not export_props.image_props[export_props.active_image]:
+        return
+
+    if export_image:
+        export_props.image_props[export_props.active_image].image.filepath_raw = filepath
+        export_props.image_props[export_props.active_image].image.save()
+
+        # pages after the first are saved next to it with their page number
+        file_format = export_props.image_props[export_props.active_image].image.file_format
+        for page, page_item in enumerate(export_props.image_props[export_props.active_image].pages, 1):
+            if page_item.image is None:
+                continue
+            page_item.image.file_format = file_format
+            page_item.image.filepath_raw = get_page_path(filepath, page)
+            page_item.image.save()
+
+    if export_json:
+        bpy.ops.mk_sprites.export_image_json(filepath = filepath)
+
+    if export_bevy_json:
+        bpy.ops.mk_sprites.export_bevy_image_json(filepath = filepath)
+
+    if export_godot_sprite_frames:
+        bpy.ops.mk_sprites.export_godot_sprite_frames(filepath = filepath)
+
+    if export_xml or export_mono:
+        bpy.ops.mk_sprites.export_image_xml(filepath = filepath, use_mono = export_mono)
+
+class MK_SPRITES_page_item(bpy.types.PropertyGroup):
+    image: PointerProperty(
+        type=bpy.types.Image,
+        name='Image'
+    )
+
 class MK_SPRITES_image_item(bpy.types.PropertyGroup):
     image: PointerProperty(
         type=bpy.types.Image,
@@ -44,6 +83,24 @@ class MK_SPRITES_image_item(bpy.types.PropertyGroup):
         name="sprite_height",
         default=32,
     )
+    mirror_angles: BoolProperty(
+        name="mirror_angles",
+        default=False,
+    )
+    # sheets after the first when the frames didn't fit one sheet
+    pages: CollectionProperty(
+        type=MK_SPRITES_page_item,
+    )
+    # frames packed by a layout engine instead of laid out in a grid
+    packed: BoolProperty(
+        name="packed",
+        default=False,
+    )
+    # JSON list of the animations in the sheet with their frame rects, written when rendering
+    sprite_data: StringProperty(
+        name="sprite_data",
+        default="",
+    )
 
 class MK_SPRITES_OP_export_image_data(bpy.types.Operator):
     """open_action_menu"""
@@ -229,27 +286,8 @@ class MK_SPRITES_OP_export_image_data(bpy.types.Operator):
         col.prop(self, "export_mono")
 
     def execute(self, context):
-        export_props = context.scene.mk_sprites_export_panel_properties
-
-        if not export_props.image_props[export_props.active_image]:
-            return {'FINISHED'}
-
-        if self.export_image:
-            export_props.image_props[export_props.active_image].image.filepath_raw = self.filepath #os.path.join(self.filepath, "TEMP IMAGE NAME.png")
-            export_props.image_props[export_props.active_image].image.save()
-            pass
-
-        if self.export_json:
-            bpy.ops.mk_sprites.export_image_json(filepath = self.filepath)
-
-        if self.export_bevy_json:
-            bpy.ops.mk_sprites.export_bevy_image_json(filepath = self.filepath)
-
-        if self.export_godot_sprite_frames:
-            bpy.ops.mk_sprites.export_godot_sprite_frames(filepath = self.filepath)
-
-        if self.export_xml or self.export_mono:
-            bpy.ops.mk_sprites.export_image_xml(filepath = self.filepath, use_mono = self.export_mono)
+        export_image_data(context, self.filepath, self.export_image, self.export_json, self.export_bevy_json,
+            self.export_godot_sprite_frames, self.export_xml, self.export_mono)
 
         rs = context.scene.render.image_settings
 
@@ -1,6 +1,6 @@
 import bpy
 from bpy.types import PropertyGroup
-from bpy.props import PointerProperty, StringProperty, IntProperty, BoolProperty, EnumProperty
+from bpy.props import PointerProperty, StringProperty, IntProperty, FloatProperty, BoolProperty, EnumProperty
 from bpy.app.translations import pgettext_tip as tip_
 from ..utils.xmlutils import ExportXml
 
@@ -37,6 +37,27 @@ class MK_SPRITES_PT_render_panel_properties(bpy.types.PropertyGroup):
         name="auto",
         default=True
     )
+    grid_fit: EnumProperty(
+        name="fit",
+        description="How the automatic sheet size is chosen",
+        items=[
+            ('AREA', "Smallest Area", "Smallest sheet within a factor of two of the aspect ratio"),
+            ('ASPECT', "Aspect Ratio", "Sheet closest to the aspect ratio"),
+        ],
+        default='AREA'
+    )
+    grid_aspect: FloatProperty(
+        name="aspect ratio",
+        description="Sheet width divided by its height",
+        default=1.0,
+        min=0.01
+    )
+    max_sheet_size: IntProperty(
+        name="max sheet size",
+        description="Largest width or height of a sheet, frames that don't fit spill onto more sheets. 0 for no limit",
+        default=0,
+        min=0
+    )
     image_resolution_x: IntProperty(
         name="resolution_x",
         default=256
@@ -45,6 +66,148 @@ class MK_SPRITES_PT_render_panel_properties(bpy.types.PropertyGroup):
         name="resolution y",
         default=256
     )
+    capture_in_memory: BoolProperty(
+        name="in-memory capture",
+        description="Read rendered frames back from the compositor instead of saving and reloading them",
+        default=True
+    )
+    render_workers: IntProperty(
+        name="render workers",
+        description="Background Blender processes the actions and rotations are split between",
+        default=1,
+        min=1
+    )
+    use_subject_border: BoolProperty(
+        name="crop to subject",
+        description="Only render the part of each frame the subject covers, needs a transparent film. Shadows and effects outside the subject's outline are cut off",
+        default=False
+    )
+    trim_frames: BoolProperty(
+        name="trim frames",
+        description="Crop every frame to its visible pixels and pack the crops into the sheet. The offset in the original frame is exported with each frame",
+        default=False
+    )
+    sheet_layout: EnumProperty(
+        name="sheet layout",
+        description="How frames are placed on the sheet",
+        items=[
+            ('GRID', "Grid", "Every frame gets a cell of the sprite size, in render order"),
+            ('SHELF', "Shelves", "Pack frames in rows, tallest first. Fast"),
+            ('MAXRECTS', "MaxRects", "Pack frames into the free space left by the others. Tighter for mixed frame sizes"),
+        ],
+        default='GRID'
+    )
+    pack_objective: EnumProperty(
+        name="pack objective",
+        description="Sheet size packed frames are fitted into",
+        items=[
+            ('AREA', "Smallest Area", "Smallest sheet the frames fit into"),
+            ('POT', "Power of Two", "Smallest sheet with power of two sides"),
+        ],
+        default='AREA'
+    )
+    pack_padding: IntProperty(
+        name="pack padding",
+        description="Transparent pixels between packed frames",
+        default=1,
+        min=0
+    )
+    skip_held_frames: BoolProperty(
+        name="skip held frames",
+        description="Render frames where no fcurve changes once, the exported animations hold them instead of repeating them",
+        default=False
+    )
+    render_order: EnumProperty(
+        name="render order",
+        description="Order the frames and angles of an action are rendered in, the sheet layout is the same",
+        items=
+        [
+            ('ROTATION', 'Angle by angle', "Render the whole animation once per angle"),
+            ('FRAME', 'Frame-major', "Render every angle of a frame before moving to the next frame, the animation and simulations are evaluated once per frame instead of once per angle"),
+            ('TIMELINE', 'One render per action', "Lay every angle of an action out on a temporary timeline and render it in a single animation render"),
+            ('GRID', 'Atlas grid', "Render many frames at once as a grid of copies of the subject, needs an orthographic camera. Other scenery is only rendered behind the first tile of each grid"),
+        ],
+        default='ROTATION'
+    )
+    grid_tiles: IntProperty(
+        name="grid tiles",
+        description="Frames rendered at once in the atlas grid order",
+        default=64,
+        min=1
+    )
+    scratch_folder: StringProperty(
+        name="scratch folder",
+        description="Where frames are kept until they are in the sheet, empty uses Blender's temp folder",
+        default="",
+        subtype='DIR_PATH'
+    )
+    use_ram_disk: BoolProperty(
+        name="use RAM disk",
+        description="Keep frames in /dev/shm when the system has it, instead of the scratch folder",
+        default=False
+    )
+    resume_renders: BoolProperty(
+        name="resume renders",
+        description="Keep a copy of every finished frame in the cache folder while rendering, rendering an interrupted job again only renders the missing frames",
+        default=False
+    )
+    use_distributed: BoolProperty(
+        name="distributed",
+        description="Hand frame chunks out to network render workers over TCP, the render workers above are started locally",
+        default=False
+    )
+    coordinator_port: IntProperty(
+        name="port",
+        description="Port network workers connect to, start them with: blender -b -P cli.py -- --net-worker HOST:PORT",
+        default=7878,
+        min=0,
+        max=65535
+    )
+    allow_remote_workers: BoolProperty(
+        name="remote workers",
+        description="Accept workers from other machines, otherwise only workers on this machine can connect",
+        default=False
+    )
+    coordinator_token: StringProperty(
+        name="token",
+        description="Shared secret remote workers must send, set it in their MK_SPRITES_TOKEN environment variable. Workers on this machine get a random one",
+        subtype='PASSWORD',
+        default=""
+    )
+    chunk_size: IntProperty(
+        name="chunk size",
+        description="Frames handed to a network worker at a time",
+        default=8,
+        min=1
+    )
+    lease_timeout: IntProperty(
+        name="lease timeout",
+        description="Seconds without news from a worker before its frames are handed to another worker",
+        default=300,
+        min=1
+    )
+    use_render_cache: BoolProperty(
+        name="render cache",
+        description="Reuse frames rendered earlier with the same action, subject, camera angle and render settings",
+        default=False
+    )
+    reuse_cloth_bakes: BoolProperty(
+        name="reuse cloth bakes",
+        description="Keep cloth bakes in the cache folder and reuse them while the action, mesh and cloth settings are unchanged. Needs a saved file",
+        default=True
+    )
+    cache_folder: StringProperty(
+        name="cache folder",
+        description="Folder the render cache, cloth bakes and resumable jobs are kept in, the system temp folder is used when empty",
+        subtype='DIR_PATH',
+        default=""
+    )
+    cache_size: IntProperty(
+        name="cache size (MB)",
+        description="Least recently used frames are removed once the cache grows past this size. Stored cloth bakes are limited to the same size",
+        default=2048,
+        min=0
+    )
 
     def register():
         bpy.types.Scene.mk_sprites_render_panel_properties = PointerProperty(type=MK_SPRITES_PT_render_panel_properties)
@@ -117,19 +280,67 @@ class MK_SPRITES_PT_render_panel(bpy.types.Panel):
 
         col.prop(render_props, "resolution_x", text="Resolution X")
         col.prop(render_props, "resolution_y", text="Y")
+        col.operator("mk_sprites.fit_sprite_bounds")
 
         col = layout.column(align=True)
         col.prop(render_props, "resolution_presets")
 
         col.prop(render_props, "auto_resolution")
         sub = col.column(align=True)
+        sub.enabled = render_props.auto_resolution
+        sub.prop(render_props, "grid_fit")
+        sub.prop(render_props, "grid_aspect")
+        sub.prop(render_props, "max_sheet_size")
+        sub = col.column(align=True)
         sub.enabled = not render_props.auto_resolution
         sub.prop(render_props, "image_resolution_x", text="ImageSize X")
         sub.prop(render_props, "image_resolution_y", text="Y")
 
+        col = layout.column(align=True)
+        col.prop(render_props, "capture_in_memory")
+        col.prop(render_props, "use_subject_border")
+        col.prop(render_props, "sheet_layout")
+        col.prop(render_props, "trim_frames")
+        if render_props.sheet_layout != 'GRID' or render_props.trim_frames:
+            col.prop(render_props, "pack_objective")
+            col.prop(render_props, "pack_padding")
+        col.prop(render_props, "skip_held_frames")
+        col.prop(render_props, "render_order")
+        if render_props.render_order == 'GRID':
+            col.prop(render_props, "grid_tiles")
+        col.prop(render_props, "scratch_folder")
+        col.prop(render_props, "use_ram_disk")
+        col.prop(render_props, "resume_renders")
+        col.prop(render_props, "render_workers")
+        col.prop(render_props, "use_distributed")
+        sub = col.column(align=True)
+        sub.enabled = render_props.use_distributed
+        sub.prop(render_props, "coordinator_port")
+        sub.prop(render_props, "allow_remote_workers")
+        row = sub.row()
+        row.enabled = render_props.allow_remote_workers
+        row.prop(render_props, "coordinator_token")
+        sub.prop(render_props, "chunk_size")
+        sub.prop(render_props, "lease_timeout")
+        col.prop(render_props, "use_render_cache")
+        col.prop(render_props, "reuse_cloth_bakes")
+        sub = col.column(align=True)
+        sub.enabled = render_props.use_render_cache or render_props.reuse_cloth_bakes
+        sub.prop(render_props, "cache_folder")
+        sub = col.column(align=True)
+        sub.enabled = render_props.use_render_cache
+        sub.prop(render_props, "cache_size")
+
         col = layout.column(heading="Frame Rate")
         self.draw_framerate(col, rd)
 
         op = col.operator("mk_sprites.render_sprite_animation")
         op.subject_rotations = subject_props.rotations
         op.use_animations = len(subject_props.obj_actions) > 0
+
+        # re-render only the selected action into the existing sheet
+        if len(subject_props.obj_actions) > 0:
+            op = col.operator("mk_sprites.render_sprite_animation", text="Render Active Action")
+            op.subject_rotations = subject_props.rotations
+            op.use_animations = True
+            op.action_index = subject_props.active_action
@@ -1,6 +1,6 @@
 import bpy
 from bpy.types import PropertyGroup, ID
-from bpy.props import PointerProperty, StringProperty, IntProperty, BoolProperty, CollectionProperty
+from bpy.props import PointerProperty, StringProperty, IntProperty, BoolProperty, CollectionProperty, EnumProperty
 from ..utils.xmlutils import ExportXml
 
 class MK_SPRITES_action_item(bpy.types.PropertyGroup):
@@ -8,6 +8,10 @@ class MK_SPRITES_action_item(bpy.types.PropertyGroup):
         type=bpy.types.Action,
         name='Action'
     )
+    frame_count: IntProperty(
+        name='Frame Count',
+        default=0
+    )
 
 class MK_SPRITES_PT_subject_panel_properties(bpy.types.PropertyGroup):
     rotations: IntProperty(
@@ -25,6 +29,27 @@ class MK_SPRITES_PT_subject_panel_properties(bpy.types.PropertyGroup):
         type=MK_SPRITES_action_item,
         name='Actions'
     )
+    mirror_angles: EnumProperty(
+        name='Mirror Angles',
+        description="Only render the angles of one side of a symmetric subject, the other side is flipped while tiling. Angle 0 has to look at the subject's mirror plane",
+        items=
+        [
+            ('OFF', 'Off', "Render every angle"),
+            ('ON', 'Symmetric', "The subject is symmetric, flip the angles of the other side"),
+            ('AUTO', 'Detect', "Compare a test render of two mirrored angles to decide"),
+        ],
+        default='OFF'
+    )
+    mirror_tiles: EnumProperty(
+        name='Mirrored Tiles',
+        description="How the angles flipped from the other side are stored in the sheet",
+        items=
+        [
+            ('COPY', 'Flipped Copies', "Store a flipped copy of every mirrored tile, works with any engine"),
+            ('FLIP', 'Flip When Drawn', "Leave the mirrored tiles out, their frames point at the tiles they mirror and are flagged to be drawn flipped. Godot sprite frames can't flip, set flip_h on the sprite for those animations"),
+        ],
+        default='COPY'
+    )
 
     def register():
         bpy.types.Scene.mk_sprites_subject_panel_properties = PointerProperty(type=MK_SPRITES_PT_subject_panel_properties)
@@ -93,6 +118,9 @@ class MK_SPRITES_PT_subject_panel(bpy.types.Panel):
 
         if panel_props.obj:
             layout.prop(panel_props, "rotations")
+            layout.prop(panel_props, "mirror_angles")
+            if panel_props.mirror_angles != 'OFF':
+                layout.prop(panel_props, "mirror_tiles")
 
             layout.label(text="Actions:")
             row = layout.row()
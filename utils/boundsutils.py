@@ -0,0 +1,110 @@
+import math
+
+import numpy
+
+GEOMETRY_TYPES = {'MESH', 'CURVE', 'SURFACE', 'META', 'FONT'}
+
+def GetWorldPoints(depsgraph, objs):
+    """Evaluated vertex positions of objs in world space, one (n, 3) array"""
+    chunks = []
+    for obj in objs:
+        if obj.hide_render or obj.type not in GEOMETRY_TYPES:
+            continue
+
+        obj_eval = obj.evaluated_get(depsgraph)
+        mesh = obj_eval.to_mesh()
+        if mesh is None:
+            continue
+
+        try:
+            count = len(mesh.vertices)
+            if count == 0:
+                continue
+            co = numpy.empty(count * 3, dtype=numpy.float64)
+            mesh.vertices.foreach_get('co', co)
+        finally:
+            obj_eval.to_mesh_clear()
+
+        matrix = numpy.array(obj_eval.matrix_world)
+        chunks.append(co.reshape(count, 3) @ matrix[:3, :3].T + matrix[:3, 3])
+
+    if not chunks:
+        return numpy.empty((0, 3))
+    return numpy.concatenate(chunks)
+
+def GetOrbitViews(camera_world, pivot, rotations):
+    """World to camera matrices of every angle the camera orbits through, pivot is the
+    CameraTrack's rotation space, angles turn around its Z axis"""
+    camera_world = numpy.array(camera_world)
+    pivot = numpy.array(pivot)
+    pivot_inverse = numpy.linalg.inv(pivot)
+
+    views = []
+    for i in range(max(1, rotations)):
+        angle = (math.pi * 2) * i / max(1, rotations)
+        turn = numpy.identity(4)
+        turn[:2, :2] = [[math.cos(angle), -math.sin(angle)], [math.sin(angle), math.cos(angle)]]
+        views.append(numpy.linalg.inv(pivot @ turn @ pivot_inverse @ camera_world))
+    return numpy.array(views)
+
+def GetViewBounds(points, views):
+    """(min_x, min_y, max_x, max_y) of points seen through every view"""
+    if len(points) == 0:
+        return None
+
+    # x and y of every point in every view at once
+    projected = numpy.einsum('aij,nj->ani', views[:, :2, :3], points) + views[:, None, :2, 3]
+    low = projected.min(axis=(0, 1))
+    high = projected.max(axis=(0, 1))
+    return low[0], low[1], high[0], high[1]
+
+def MergeBounds(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+def FitSpriteSize(bounds, pixel_size, padding=0, multiple=1):
+    """Smallest sprite resolution holding bounds at pixel_size world units per pixel,
+    returns (width, height, center_x, center_y)"""
+    min_x, min_y, max_x, max_y = bounds
+    width = math.ceil((max_x - min_x) / pixel_size) + padding * 2
+    height = math.ceil((max_y - min_y) / pixel_size) + padding * 2
+    width = max(multiple, math.ceil(width / multiple) * multiple)
+    height = max(multiple, math.ceil(height / multiple) * multiple)
+    return width, height, (min_x + max_x) / 2, (min_y + max_y) / 2
+
+def GetScreenBounds(points, view_projection):
+    """(min_x, min_y, max_x, max_y) of points in 0-1 frame coordinates, None when no point is in front of the camera"""
+    if len(points) == 0:
+        return None
+
+    matrix = numpy.array(view_projection)
+    clip = points @ matrix[:, :3].T + matrix[:, 3]
+    front = clip[:, 3] > 1e-6
+    if not front.any():
+        return None
+
+    ndc = clip[front, :2] / clip[front, 3:4]
+    low = (ndc.min(axis=0) + 1) / 2
+    high = (ndc.max(axis=0) + 1) / 2
+    return low[0], low[1], high[0], high[1]
+
+def GetBorderRect(bounds, width, height, padding=0):
+    """Pixel rect (x0, y0, x1, y1) covering bounds, clamped to the frame, None when nothing is left"""
+    x0 = max(0, math.floor(bounds[0] * width) - padding)
+    y0 = max(0, math.floor(bounds[1] * height) - padding)
+    x1 = min(width, math.ceil(bounds[2] * width) + padding)
+    y1 = min(height, math.ceil(bounds[3] * height) + padding)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1, y1
+
+def UncropFrame(pixels, rect, width, height):
+    # put a frame rendered with a crop border back into a transparent full size frame, rows go bottom to top
+    x0, y0, x1, y1 = rect
+    frame = numpy.zeros((height, width, pixels.shape[2]), dtype=numpy.float32)
+    crop = pixels[:y1 - y0, :x1 - x0]
+    frame[y0:y0 + crop.shape[0], x0:x0 + crop.shape[1]] = crop
+    return frame
@@ -0,0 +1,402 @@
+import hashlib
+import math
+from contextlib import contextmanager
+import os
+import shutil
+import tempfile
+import time
+
+import bpy
+import numpy
+
+from .ioutils import CountRead, CountWritten, GetFileSize
+
+SIMPLE_PROPERTY_TYPES = {'BOOLEAN', 'INT', 'FLOAT', 'STRING', 'ENUM'}
+
+# paths that change on every render, and settings the renders themselves change, that
+# don't change the rendered pixels: workers pick their thread count and crop-to-subject
+# borders are uncropped before frames are stored
+IGNORED_PROPERTIES = {
+    'rna_type', 'filepath', 'frame_path',
+    'threads', 'threads_mode',
+    'use_border', 'use_crop_to_border', 'border_min_x', 'border_max_x', 'border_min_y', 'border_max_y',
+    # bake state, the simulation settings and frame range are hashed where they matter
+    'point_cache',
+}
+
+# nested settings like ClothModifier.settings are followed this deep
+HASH_DEPTH = 2
+
+# frames used this recently are never evicted, another worker may still be reading them
+EVICT_GRACE_SECONDS = 600
+
+def GetCacheFolder(folder=""):
+    if folder:
+        return bpy.path.abspath(folder)
+    return os.path.join(tempfile.gettempdir(), "mk_sprites_cache")
+
+@contextmanager
+def FixedFrame(scene):
+    # evaluated matrices depend on the current frame, keys are taken at the first frame
+    old_frame = scene.frame_current
+    scene.frame_set(scene.frame_start)
+    try:
+        yield
+    finally:
+        scene.frame_set(old_frame)
+
+def HashIDProperties(digest, struct):
+    # custom properties, geometry nodes modifier inputs are stored as these as well
+    try:
+        keys = sorted(struct.keys())
+    except TypeError:
+        return
+
+    for key in keys:
+        value = struct[key]
+        if isinstance(value, bpy.types.ID):
+            value = value.name
+        elif hasattr(value, "to_dict"):
+            value = value.to_dict()
+        elif hasattr(value, "to_list"):
+            value = value.to_list()
+        digest.update(("[%r]=%r;" % (key, value)).encode())
+
+def HashRNA(digest, struct, depth=HASH_DEPTH):
+    if struct is None:
+        digest.update(b'None')
+        return
+
+    digest.update(struct.bl_rna.identifier.encode())
+    HashIDProperties(digest, struct)
+    for prop in struct.bl_rna.properties:
+        if prop.identifier in IGNORED_PROPERTIES:
+            continue
+
+        if prop.type in SIMPLE_PROPERTY_TYPES:
+            # read only values are derived from the others or runtime state
+            if prop.is_readonly:
+                continue
+            value = getattr(struct, prop.identifier, None)
+            if isinstance(value, set):
+                value = tuple(sorted(value))
+            value = ToHashable(value)
+            digest.update(("%s=%r;" % (prop.identifier, value)).encode())
+
+        # only the name of referenced datablocks, following them could recurse forever,
+        # nested structs are followed up to depth
+        elif prop.type == 'POINTER':
+            value = getattr(struct, prop.identifier, None)
+            if isinstance(value, bpy.types.ID):
+                digest.update(("%s->%s;" % (prop.identifier, value.name)).encode())
+            elif value is not None and depth > 0:
+                digest.update(("%s{" % prop.identifier).encode())
+                HashRNA(digest, value, depth - 1)
+                digest.update(b'}')
+
+def HashArray(digest, collection, attribute, count, width):
+    values = numpy.empty(count * width, dtype=numpy.float32)
+    collection.foreach_get(attribute, values)
+    digest.update(values.tobytes())
+
+def HashAction(digest, action):
+    if action is None:
+        digest.update(b'None')
+        return
+
+    for fcurve in action.fcurves:
+        digest.update(("%s[%d]%s%s;" % (fcurve.data_path, fcurve.array_index, fcurve.extrapolation, fcurve.mute)).encode())
+        keys = fcurve.keyframe_points
+        for attribute in ('co', 'handle_left', 'handle_right'):
+            HashArray(digest, keys, attribute, len(keys), 2)
+        digest.update(("%s;" % [(k.interpolation, k.easing) for k in keys]).encode())
+        for modifier in fcurve.modifiers:
+            HashRNA(digest, modifier)
+
+def HashAnimation(digest, id_data, with_action=True):
+    # the subject's action is left to the caller, it is hashed as the action it renders
+    anim_data = getattr(id_data, "animation_data", None)
+    if anim_data is None:
+        return
+
+    if with_action:
+        HashAction(digest, anim_data.action)
+    for track in anim_data.nla_tracks:
+        digest.update(("track=%s:%s;" % (track.name, track.mute)).encode())
+        for strip in track.strips:
+            HashRNA(digest, strip, 0)
+    for fcurve in anim_data.drivers:
+        driver = fcurve.driver
+        digest.update(("driver=%s[%d]%s:%s;" % (fcurve.data_path, fcurve.array_index, driver.type, driver.expression)).encode())
+        for variable in driver.variables:
+            digest.update(("%s:%s;" % (variable.name, variable.type)).encode())
+            for target in variable.targets:
+                HashRNA(digest, target, 0)
+
+def ToHashable(value):
+    if isinstance(value, str) or not hasattr(value, '__len__'):
+        return value
+    return tuple(value)
+
+def HashNodeTree(digest, tree):
+    if tree is None:
+        return
+
+    for node in tree.nodes:
+        HashRNA(digest, node)
+        for socket in node.inputs:
+            if hasattr(socket, 'default_value'):
+                digest.update(("%s=%r;" % (socket.identifier, ToHashable(socket.default_value))).encode())
+    for link in tree.links:
+        digest.update(("%s.%s>%s.%s;" % (link.from_node.name, link.from_socket.identifier, link.to_node.name, link.to_socket.identifier)).encode())
+
+def HashObject(digest, obj, skip=None, root=True):
+    digest.update(("%s:%s:%s;" % (obj.name, obj.type, obj.hide_render)).encode())
+    # children are hashed relative to their parent so the camera angle doesn't leak in
+    matrix = obj.matrix_local if obj.parent else obj.matrix_world
+    digest.update(numpy.array(matrix, dtype=numpy.float32).tobytes())
+    HashIDProperties(digest, obj)
+    HashAnimation(digest, obj, not root)
+
+    for modifier in obj.modifiers:
+        HashRNA(digest, modifier)
+    for constraint in obj.constraints:
+        HashRNA(digest, constraint)
+    if obj.pose is not None:
+        for bone in obj.pose.bones:
+            for constraint in bone.constraints:
+                HashRNA(digest, constraint)
+
+    if obj.type == 'MESH':
+        HashArray(digest, obj.data.vertices, 'co', len(obj.data.vertices), 3)
+    if obj.data is not None:
+        HashRNA(digest, obj.data)
+        HashAnimation(digest, obj.data)
+        shape_keys = getattr(obj.data, "shape_keys", None)
+        if shape_keys is not None:
+            for key_block in shape_keys.key_blocks:
+                HashRNA(digest, key_block, 0)
+            HashAnimation(digest, shape_keys)
+
+    for slot in obj.material_slots:
+        if slot.material is not None:
+            HashRNA(digest, slot.material)
+            HashNodeTree(digest, slot.material.node_tree)
+            HashAnimation(digest, slot.material)
+            HashAnimation(digest, slot.material.node_tree)
+
+    for child in obj.children:
+        if child != skip:
+            HashObject(digest, child, skip, root=False)
+
+def IsInHierarchy(obj, root):
+    while obj is not None:
+        if obj == root:
+            return True
+        obj = obj.parent
+    return False
+
+def GetRenderStateKey(scene, subject, action, camera_track=None, mode='FRAME'):
+    """Hash of everything but the camera angle and frame that changes the rendered sprites.
+
+    Frames cut from a grid render don't match frames rendered one by one pixel for pixel,
+    so mode keeps them apart.
+    """
+    with FixedFrame(scene):
+        digest = hashlib.sha1(("mode=%s;" % mode).encode())
+
+        HashAction(digest, action)
+        HashObject(digest, subject, camera_track)
+
+        # lights and other scenery the subject is rendered with
+        for obj in scene.objects:
+            if IsInHierarchy(obj, subject):
+                continue
+            if not obj.hide_render and obj.type in {'LIGHT', 'MESH', 'CAMERA'}:
+                digest.update(("%s:%s;" % (obj.name, obj.type)).encode())
+                digest.update(numpy.array(obj.matrix_world, dtype=numpy.float32).tobytes())
+                if obj.type == 'LIGHT':
+                    HashRNA(digest, obj.data)
+
+        if scene.world is not None:
+            HashRNA(digest, scene.world)
+            HashNodeTree(digest, scene.world.node_tree)
+
+        for settings in (scene.render, scene.render.image_settings, scene.view_settings, scene.display_settings):
+            HashRNA(digest, settings)
+        for engine in ('cycles', 'eevee'):
+            if hasattr(scene, engine):
+                HashRNA(digest, getattr(scene, engine))
+        digest.update(("frame_step=%d;" % scene.frame_step).encode())
+
+    return digest.hexdigest()
+
+def GetClothBakeKey(scene, subject, obj, modifier, action, camera_track=None):
+    """Hash of everything the cloth simulation of obj depends on while the subject plays action"""
+    with FixedFrame(scene):
+        digest = hashlib.sha1()
+
+        HashAction(digest, action)
+        HashObject(digest, subject, camera_track)
+
+        digest.update(("cloth=%s;" % obj.name).encode())
+        HashRNA(digest, modifier.settings)
+        HashRNA(digest, modifier.collision_settings)
+        digest.update(("range=%d-%d;" % (modifier.point_cache.frame_start, modifier.point_cache.frame_end)).encode())
+        digest.update(("fps=%r;gravity=%r;%r;" % (scene.render.fps / scene.render.fps_base, tuple(scene.gravity), scene.use_gravity)).encode())
+
+        # colliders outside the subject move the cloth too
+        for other in scene.objects:
+            if IsInHierarchy(other, subject) or not any(m.type == 'COLLISION' for m in other.modifiers):
+                continue
+            HashObject(digest, other, root=False)
+
+    return digest.hexdigest()
+
+def GetClothBakeFolder(folder=""):
+    return os.path.join(GetCacheFolder(folder), "cloth")
+
+def GetBakeFilePrefix(point_cache, obj):
+    # caches without a name are written under the hex encoded object name
+    return point_cache.name or "".join("%02X" % c for c in obj.name.encode())
+
+def GetBakeFiles(point_cache, obj):
+    # disk caches of a saved file are written next to it
+    blend_name = os.path.splitext(bpy.path.basename(bpy.data.filepath))[0]
+    folder = bpy.path.abspath("//blendcache_" + blend_name)
+    prefix = GetBakeFilePrefix(point_cache, obj) + "_"
+    if not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder, name) for name in os.listdir(folder) if name.startswith(prefix) and name.endswith(".bphys")]
+
+def GetStoredBake(folder):
+    # file name prefix and cache index of a stored bake, files are named <prefix>_<frame>_<index>.bphys
+    for name in sorted(os.listdir(folder)):
+        if name.endswith(".bphys"):
+            prefix, frame, index = os.path.splitext(name)[0].rsplit("_", 2)
+            return prefix, int(index)
+    return None
+
+def EvictClothBakes(folder, max_bytes):
+    # whole bakes are removed, least recently used first
+    if not os.path.isdir(folder):
+        return
+
+    entries = []
+    total = 0
+    for entry in os.scandir(folder):
+        if not entry.is_dir():
+            continue
+        try:
+            size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+            entries.append((entry.stat().st_mtime, size, entry.path))
+        except FileNotFoundError:
+            continue
+        total += size
+
+    entries.sort()
+    for mtime, size, path in entries:
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+def StoreClothBake(paths, folder):
+    # copy next to the final folder first, an interrupted copy is never mistaken for a bake
+    staging = folder + ".partial"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for path in paths:
+        shutil.copyfile(path, os.path.join(staging, os.path.basename(path)))
+        CountWritten(GetFileSize(path))
+
+    shutil.rmtree(folder, ignore_errors=True)
+    os.replace(staging, folder)
+
+def GetJobKey(scene, subject, actions, rotations, camera_track=None):
+    """Hash of a whole sheet render, the same job renders the same tiles"""
+    # an interrupted job leaves any of its actions assigned, so only a still render hashes the current one
+    action = None
+    if not actions and subject.animation_data:
+        action = subject.animation_data.action
+    digest = hashlib.sha1(GetRenderStateKey(scene, subject, action, camera_track).encode())
+
+    for action in actions:
+        digest.update(("%s%r;" % (action.name, tuple(action.frame_range))).encode())
+        HashAction(digest, action)
+    digest.update(("rotations=%d;" % rotations).encode())
+    if not actions:
+        digest.update(("frame=%d;" % scene.frame_current).encode())
+
+    return GetFrameKey(digest.hexdigest(), camera_track, "job")
+
+def GetFrameKey(state_key, camera_track, frame):
+    digest = hashlib.sha1(state_key.encode())
+    if camera_track is not None:
+        # the track keeps accumulating rotation, so compare angles rather than matrices
+        angle = round(camera_track.rotation_euler[2] % (math.pi * 2), 5) % round(math.pi * 2, 5)
+        digest.update(("angle=%r;location=%r;" % (angle, tuple(camera_track.location))).encode())
+        for child in camera_track.children:
+            HashObject(digest, child)
+    digest.update(("frame=%s" % frame).encode())
+    return digest.hexdigest()
+
+class RenderCache:
+    """On-disk frame store addressed by render keys, least recently used frames are evicted first"""
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+
+    def get(self, key):
+        # sharded workers share the cache, a frame can be evicted between any two calls
+        for file_name in (key + ".npy", key):
+            path = os.path.join(self.folder, file_name)
+            try:
+                # mark as recently used
+                os.utime(path)
+                if path.endswith(".npy"):
+                    pixels = numpy.load(path)
+                    CountRead(GetFileSize(path))
+                    return pixels
+                return path
+            except FileNotFoundError:
+                continue
+        return None
+
+    def put(self, key, source):
+        # written under a partial name first, readers never see half a frame
+        path = os.path.join(self.folder, key)
+        partial = os.path.join(self.folder, ".%s.%d.partial" % (key, os.getpid()))
+        if isinstance(source, numpy.ndarray):
+            path += ".npy"
+            with open(partial, 'wb') as f:
+                numpy.save(f, source)
+        else:
+            shutil.copyfile(source, partial)
+        os.replace(partial, path)
+        CountWritten(GetFileSize(path))
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.folder):
+            try:
+                if entry.is_file() and not entry.name.endswith(".partial"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            except FileNotFoundError:
+                continue
+
+        entries.sort()
+        now = time.time()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes or now - mtime < EVICT_GRACE_SECONDS:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
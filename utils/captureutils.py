@@ -0,0 +1,87 @@
+import bpy
+import numpy
+
+from .tileutils import GetImagePixels
+
+VIEWER_IMAGE = "Viewer Node"
+FLOAT_FORMATS = {'OPEN_EXR', 'OPEN_EXR_MULTILAYER', 'HDR'}
+
+def CanCaptureInMemory(scene):
+    # the viewer is only updated when the compositor runs
+    if not scene.render.use_compositing:
+        return False
+
+    # float outputs are stored linear, the captured pixels can be used as they are
+    if scene.render.image_settings.file_format in FLOAT_FORMATS:
+        return True
+
+    # for 8/16 bit outputs only the plain sRGB view transform can be reproduced here
+    view = scene.view_settings
+    return (scene.display_settings.display_device == 'sRGB'
+        and view.view_transform == 'Standard'
+        and view.look == 'None'
+        and view.exposure == 0.0
+        and view.gamma == 1.0
+        and not view.use_curve_mapping)
+
+def LinearToSRGB(rgb):
+    rgb = numpy.clip(rgb, 0.0, 1.0)
+    return numpy.where(rgb <= 0.0031308, rgb * 12.92, 1.055 * numpy.power(rgb, 1.0 / 2.4) - 0.055)
+
+class ViewerCapture:
+    """Temporary compositor Viewer node the rendered frames are read back from"""
+
+    def __init__(self, scene):
+        self.scene = scene
+        self.old_use_nodes = scene.use_nodes
+        self.float_output = scene.render.image_settings.file_format in FLOAT_FORMATS
+
+        scene.use_nodes = True
+        tree = scene.node_tree
+
+        # view whatever reaches the composite output so compositing effects are kept
+        composite = next((node for node in tree.nodes if node.type == 'COMPOSITE'), None)
+        self.layers = None
+        if composite and composite.inputs['Image'].is_linked:
+            source = composite.inputs['Image'].links[0].from_socket
+        else:
+            layers = next((node for node in tree.nodes if node.type == 'R_LAYERS'), None)
+            if layers is None:
+                layers = self.layers = tree.nodes.new('CompositorNodeRLayers')
+            source = layers.outputs['Image']
+
+        self.old_active = tree.nodes.active
+        self.viewer = tree.nodes.new('CompositorNodeViewer')
+        self.viewer.use_alpha = True
+        tree.links.new(source, self.viewer.inputs['Image'])
+        tree.nodes.active = self.viewer
+
+    def clear(self):
+        # a viewer the next render doesn't update reads as empty instead of the previous frame
+        image = bpy.data.images.get(VIEWER_IMAGE)
+        if image is not None:
+            image.buffers_free()
+
+    def read(self):
+        image = bpy.data.images.get(VIEWER_IMAGE)
+        if image is None or image.size[0] == 0 or image.size[1] == 0:
+            return None
+
+        pixels = GetImagePixels(image)
+        if self.float_output:
+            return pixels
+
+        # the viewer holds linear premultiplied pixels, files hold straight sRGB
+        alpha = pixels[:, :, 3:4]
+        rgb = numpy.divide(pixels[:, :, :3], alpha, out=numpy.zeros_like(pixels[:, :, :3]), where=alpha > 0)
+        pixels[:, :, :3] = LinearToSRGB(rgb)
+        return pixels
+
+    def remove(self):
+        tree = self.scene.node_tree
+        tree.nodes.remove(self.viewer)
+        if self.layers is not None:
+            tree.nodes.remove(self.layers)
+        if self.old_active is not None:
+            tree.nodes.active = self.old_active
+        self.scene.use_nodes = self.old_use_nodes
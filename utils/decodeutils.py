@@ -0,0 +1,254 @@
+import io
+import struct
+import zlib
+
+import numpy
+
+# Frame decoders that do not depend on bpy, so they can run off the main thread.
+# Every decoder returns float32 RGBA pixels shaped (height, width, 4) with rows
+# stored bottom to top, the same layout as bpy.types.Image.pixels.
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+NPY_MAGIC = b'\x93NUMPY'
+EXR_MAGIC = b'\x76\x2f\x31\x01'
+
+EXR_PIXEL_TYPES = {0: '<u4', 1: '<f2', 2: '<f4'}
+EXR_LINES_PER_BLOCK = {0: 1, 1: 1, 2: 1, 3: 16}
+
+def ToRGBA(channels, alpha=None):
+    height, width = channels[0].shape
+    pixels = numpy.ones((height, width, 4), dtype=numpy.float32)
+    if len(channels) == 1:
+        channels = channels * 3
+    for c in range(3):
+        pixels[:, :, c] = channels[c]
+    if alpha is not None:
+        pixels[:, :, 3] = alpha
+    # decoded images are top to bottom, blender stores them bottom to top
+    return pixels[::-1]
+
+def UnfilterPNG(raw, width, height, bpp):
+    stride = width * bpp
+    rows = numpy.frombuffer(raw, dtype=numpy.uint8)[:height * (stride + 1)].reshape(height, stride + 1)
+    filters = rows[:, 0]
+    data = rows[:, 1:].reshape(height, width, bpp)
+
+    if not filters.any():
+        return data.copy()
+    if filters.max() > 4:
+        raise ValueError("Unknown PNG filter type %d" % filters.max())
+    # Average and Paeth predict from the reconstructed pixel to the left, which numpy can only
+    # do one pixel at a time while holding the GIL. Such images are left to blender.
+    if filters.max() > 2:
+        return None
+
+    # None, Sub and Up rows are whole row operations, uint8 arithmetic wraps like the filters do.
+    # The first row of out is the zero row above the image.
+    out = numpy.zeros((height + 1, width, bpp), dtype=numpy.uint8)
+    for y, kind in enumerate(filters):
+        if kind == 0:
+            out[y + 1] = data[y]
+        elif kind == 1:
+            out[y + 1] = numpy.cumsum(data[y], axis=0, dtype=numpy.uint8)
+        else:
+            out[y + 1] = data[y] + out[y]
+
+    return out[1:]
+
+def DecodePNG(data):
+    pos = len(PNG_SIGNATURE)
+    header = None
+    palette = None
+    transparency = None
+    idat = []
+
+    while pos < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[pos:pos + 8])
+        chunk = data[pos + 8:pos + 8 + length]
+        pos += length + 12
+
+        if chunk_type == b'IHDR':
+            header = struct.unpack('>IIBBBBB', chunk)
+        elif chunk_type == b'PLTE':
+            palette = numpy.frombuffer(chunk, dtype=numpy.uint8).reshape(-1, 3)
+        elif chunk_type == b'tRNS':
+            transparency = numpy.frombuffer(chunk, dtype=numpy.uint8)
+        elif chunk_type == b'IDAT':
+            idat.append(chunk)
+        elif chunk_type == b'IEND':
+            break
+
+    if header is None:
+        raise ValueError("PNG is missing its IHDR chunk")
+
+    width, height, bit_depth, color_type, compression, filter_method, interlace = header
+    samples = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}.get(color_type)
+
+    # interlaced and packed low bit depth images are left to blender, and so are
+    # images using the Average or Paeth filters, see UnfilterPNG
+    if samples is None or interlace != 0 or bit_depth not in (8, 16):
+        return None
+
+    bytes_per_sample = bit_depth // 8
+    raw = zlib.decompress(b''.join(idat))
+    pixels = UnfilterPNG(raw, width, height, samples * bytes_per_sample)
+    if pixels is None:
+        return None
+
+    if bit_depth == 16:
+        pixels = pixels.reshape(height, width, samples, 2).astype(numpy.uint32)
+        values = ((pixels[..., 0] << 8) | pixels[..., 1]).astype(numpy.float32) / 65535.0
+    else:
+        values = pixels.astype(numpy.float32) / 255.0
+
+    if color_type == 3:
+        if palette is None:
+            raise ValueError("Paletted PNG is missing its PLTE chunk")
+        indices = pixels[..., 0]
+        rgb = palette.astype(numpy.float32)[indices] / 255.0
+        alpha = None
+        if transparency is not None:
+            table = numpy.full(256, 255, dtype=numpy.uint8)
+            table[:len(transparency)] = transparency
+            alpha = table[indices].astype(numpy.float32) / 255.0
+        return ToRGBA([rgb[:, :, 0], rgb[:, :, 1], rgb[:, :, 2]], alpha)
+
+    has_alpha = color_type in (4, 6)
+    color = [values[:, :, c] for c in range(samples - 1 if has_alpha else samples)]
+    return ToRGBA(color, values[:, :, samples - 1] if has_alpha else None)
+
+def ReadNullString(data, pos):
+    end = data.index(b'\x00', pos)
+    return data[pos:end].decode('latin-1'), end + 1
+
+def UnpredictEXR(data):
+    # undo the delta predictor and byte interleave applied by the ZIP and RLE codecs
+    deltas = numpy.frombuffer(data, dtype=numpy.uint8).astype(numpy.int64)
+    deltas[1:] -= 128
+    values = (numpy.cumsum(deltas) & 0xFF).astype(numpy.uint8)
+
+    half = (len(values) + 1) // 2
+    out = numpy.empty_like(values)
+    out[0::2] = values[:half]
+    out[1::2] = values[half:]
+    return out.tobytes()
+
+def DecodeRLE(data):
+    out = bytearray()
+    pos = 0
+    while pos < len(data):
+        count = struct.unpack('b', data[pos:pos + 1])[0]
+        pos += 1
+        if count < 0:
+            out += data[pos:pos - count]
+            pos -= count
+        else:
+            out += data[pos:pos + 1] * (count + 1)
+            pos += 1
+    return bytes(out)
+
+def DecodeEXR(data):
+    version = struct.unpack('<I', data[4:8])[0]
+
+    # tiled, deep and multi-part files are left to blender
+    if version & 0x1e00:
+        return None
+
+    pos = 8
+    channels = []
+    compression = None
+    data_window = None
+
+    while True:
+        name, pos = ReadNullString(data, pos)
+        if name == "":
+            break
+        attr_type, pos = ReadNullString(data, pos)
+        size = struct.unpack('<i', data[pos:pos + 4])[0]
+        value = data[pos + 4:pos + 4 + size]
+        pos += 4 + size
+
+        if name == 'channels' and attr_type == 'chlist':
+            cpos = 0
+            while value[cpos:cpos + 1] != b'\x00':
+                channel_name, cpos = ReadNullString(value, cpos)
+                pixel_type, x_sampling, y_sampling = struct.unpack('<i4xii', value[cpos:cpos + 16])
+                cpos += 16
+                if x_sampling != 1 or y_sampling != 1:
+                    return None
+                channels.append((channel_name, EXR_PIXEL_TYPES[pixel_type]))
+        elif name == 'compression':
+            compression = value[0]
+        elif name == 'dataWindow':
+            data_window = struct.unpack('<iiii', value)
+
+    if compression not in EXR_LINES_PER_BLOCK or data_window is None:
+        return None
+
+    xmin, ymin, xmax, ymax = data_window
+    width = xmax - xmin + 1
+    height = ymax - ymin + 1
+    lines_per_block = EXR_LINES_PER_BLOCK[compression]
+    blocks = (height + lines_per_block - 1) // lines_per_block
+    offsets = struct.unpack('<%dQ' % blocks, data[pos:pos + 8 * blocks])
+
+    planes = {name: numpy.zeros((height, width), dtype=numpy.float32) for name, _ in channels}
+    sample_sizes = [numpy.dtype(dtype).itemsize for _, dtype in channels]
+    line_size = width * sum(sample_sizes)
+
+    for offset in offsets:
+        y, size = struct.unpack('<ii', data[offset:offset + 8])
+        block = data[offset + 8:offset + 8 + size]
+        lines = min(lines_per_block, ymax - y + 1)
+        expected = lines * line_size
+
+        if size < expected:
+            if compression == 1:
+                block = UnpredictEXR(DecodeRLE(block))
+            elif compression in (2, 3):
+                block = UnpredictEXR(zlib.decompress(block))
+
+        bpos = 0
+        for line in range(lines):
+            row = y - ymin + line
+            for (name, dtype), sample_size in zip(channels, sample_sizes):
+                planes[name][row] = numpy.frombuffer(block, dtype=dtype, count=width, offset=bpos)
+                bpos += width * sample_size
+
+    def FindPlane(channel):
+        for name in (channel, 'Combined.' + channel):
+            for plane_name, plane in planes.items():
+                if plane_name == name or plane_name.endswith('.' + name):
+                    return plane
+        return None
+
+    color = [FindPlane(c) for c in ('R', 'G', 'B')]
+    if any(plane is None for plane in color):
+        luminance = FindPlane('Y')
+        if luminance is None:
+            return None
+        color = [luminance]
+    return ToRGBA(color, FindPlane('A'))
+
+def DecodeFrame(path):
+    """Decode a rendered frame without bpy, returns None when the format is not supported"""
+    # frames captured in memory are already decoded
+    if isinstance(path, numpy.ndarray):
+        return path
+
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        if data.startswith(PNG_SIGNATURE):
+            return DecodePNG(data)
+        if data.startswith(EXR_MAGIC):
+            return DecodeEXR(data)
+        # raw frames handed over by render workers
+        if data.startswith(NPY_MAGIC):
+            return numpy.load(io.BytesIO(data))
+
+    except (OSError, ValueError, KeyError, IndexError, struct.error, zlib.error) as e:
+        print("Unable to decode %s: %s" % (path, e))
+
+    return None
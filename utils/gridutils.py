@@ -0,0 +1,89 @@
+import math
+
+import bpy
+import mathutils
+import numpy
+
+def GetHierarchy(obj, skip=None):
+    objs = [obj]
+    for child in obj.children:
+        if child != skip:
+            objs.extend(GetHierarchy(child, skip))
+    return objs
+
+# part of a tile left empty on each side of every grid cell, so overhanging geometry,
+# shadows and glare don't reach the neighbouring tiles
+GRID_GUTTER = 0.125
+
+def GetGridGutter(width, height):
+    # even pixel counts so the tile sits in the middle of its cell
+    return 2 * math.ceil(width * GRID_GUTTER), 2 * math.ceil(height * GRID_GUTTER)
+
+def GetOrthoTileSize(camera, width, height):
+    # world size of one frame, the ortho scale covers the side picked by the sensor fit
+    fit = camera.sensor_fit
+    if fit == 'AUTO':
+        fit = 'HORIZONTAL' if width >= height else 'VERTICAL'
+    if fit == 'HORIZONTAL':
+        return camera.ortho_scale, camera.ortho_scale * height / width
+    return camera.ortho_scale * width / height, camera.ortho_scale
+
+def GetGridShape(count, width, height):
+    # as close to a square image as the tile count allows
+    cols = max(1, min(count, math.ceil(math.sqrt(count * height / width))))
+    return cols, math.ceil(count / cols)
+
+def CreateGridInstance(subject, skip, collection, action, strip_start):
+    """Linked copy of the subject hierarchy playing action from strip_start.
+
+    The copy is parented to an empty, which is returned to move the copy into its grid cell.
+    """
+    anchor = bpy.data.objects.new("mk_sprites_grid_anchor", None)
+    collection.objects.link(anchor)
+
+    mapping = {}
+    for obj in GetHierarchy(subject, skip):
+        copy = obj.copy()
+        collection.objects.link(copy)
+        mapping[obj] = copy
+
+    # point parents, armatures and constraint targets at the copies
+    for obj, copy in mapping.items():
+        copy.parent = anchor if obj == subject else mapping.get(obj.parent, obj.parent)
+        copy.matrix_parent_inverse = obj.matrix_parent_inverse
+        for modifier in copy.modifiers:
+            if getattr(modifier, "object", None) in mapping:
+                modifier.object = mapping[modifier.object]
+        for constraint in copy.constraints:
+            if getattr(constraint, "target", None) in mapping:
+                constraint.target = mapping[constraint.target]
+
+    anim_data = mapping[subject].animation_data or mapping[subject].animation_data_create()
+    anim_data.action = None
+    anim_data.nla_tracks.new().strips.new(action.name, strip_start, action)
+
+    return anchor
+
+def MoveToGridCell(anchor, base, right, up, offset_x, offset_y):
+    anchor.matrix_world = mathutils.Matrix.Translation(right * offset_x - up * offset_y) @ base
+
+def SliceGrid(pixels, cols, rows, count, gutter_x=0, gutter_y=0):
+    """Cut a rendered grid into tiles, left to right and top to bottom.
+
+    Cells hold their tile in the middle with gutter_x and gutter_y pixels around it in total,
+    the gutter is cropped off.
+    """
+    # rows are stored bottom to top
+    height, width = pixels.shape[:2]
+    cell_height = height // rows
+    cell_width = width // cols
+    tile_height = cell_height - gutter_y
+    tile_width = cell_width - gutter_x
+
+    tiles = []
+    for i in range(count):
+        col, row = i % cols, i // cols
+        x = col * cell_width + gutter_x // 2
+        y = height - (row + 1) * cell_height + gutter_y // 2
+        tiles.append(numpy.ascontiguousarray(pixels[y:y + tile_height, x:x + tile_width]))
+    return tiles
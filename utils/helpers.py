@@ -1,3 +1,5 @@
+import math
+
 def GetActionFrameCount(action, step=1):
     print("FC_s: ", action.frame_range[0])
     frame_start = int(action.frame_range[0])
@@ -5,18 +7,223 @@ def GetActionFrameCount(action, step=1):
     frame_end = int(action.frame_range[1])
     return ((frame_end - frame_start) // step) + 1
 
+class SheetGrid:
+    """Fixed cell layout of a sheet, tiles are laid out row by row from the top left"""
+
+    def __init__(self, tile_width, tile_height, columns, rows):
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.columns = max(1, columns)
+        self.rows = rows
+
+    @classmethod
+    def from_sheet(cls, tile_width, tile_height, sheet_width, sheet_height):
+        return cls(tile_width, tile_height, sheet_width // tile_width, sheet_height // tile_height)
+
+    @property
+    def size(self):
+        return (self.columns * self.tile_width, self.rows * self.tile_height)
+
+    def tile_pos(self, index):
+        return ((index % self.columns) * self.tile_width, (index // self.columns) * self.tile_height)
+
 def GetTilePos(tile_width, tile_height, sheet_width, sheet_height, index):
-    tiles_per_row = sheet_width // tile_width
-    posX = (index % tiles_per_row) * tile_width
-    posY = (index // tiles_per_row) * tile_height
-    return (posX, posY)
-
-def AutoImageSize(frame_width, frame_height, animations, rotations, step=1):
-    # Find the longest animation by the number of frames
-    max_frames = max(GetActionFrameCount(anim['action'], step) for anim in animations)
-    # Calculate the width as the product of the longest animation length and frame width
-    sheet_width = frame_width * max_frames
-    # Calculate the height as the product of the number of rotations and frame height
-    sheet_height = frame_height * rotations * len(animations)
-
-    return (sheet_width, sheet_height)
+    return SheetGrid.from_sheet(tile_width, tile_height, sheet_width, sheet_height).tile_pos(index)
+
+def FitSheetGrid(tile_count, tile_width, tile_height, fit='AREA', aspect=1.0, max_size=0):
+    """Column count for tile_count tiles, as a SheetGrid.
+
+    fit 'AREA' picks the smallest sheet whose aspect ratio is within a factor of two of
+    aspect, 'ASPECT' the sheet closest to aspect. No side is larger than max_size, None
+    is returned when the tiles can't fit.
+    """
+    candidates = []
+    for columns in range(1, max(1, tile_count) + 1):
+        rows = -(-tile_count // columns)
+        width, height = columns * tile_width, rows * tile_height
+        if max_size and (width > max_size or height > max_size):
+            continue
+
+        # how far the sheet is from the aspect ratio, as a factor
+        deviation = abs(math.log((width / max(1, height)) / aspect)) if height else 0.0
+        candidates.append((width * height, deviation, columns, rows))
+
+    if not candidates:
+        return None
+
+    if fit == 'ASPECT':
+        best = min(candidates, key=lambda c: (c[1], c[0]))
+    else:
+        close = [c for c in candidates if c[1] <= math.log(2)] or candidates
+        best = min(close, key=lambda c: (c[0], c[1]))
+    return SheetGrid(tile_width, tile_height, best[2], best[3])
+
+def GetPageMap(unit_lengths, capacity):
+    """(page, slot) of every tile when a sheet holds at most capacity tiles.
+
+    Units are the frames of one action and angle, a unit that doesn't fit on the current
+    page starts the next one unless it is larger than a whole page.
+    """
+    tiles = []
+    page = slot = 0
+    for length in unit_lengths:
+        if slot > 0 and slot + length > capacity:
+            page += 1
+            slot = 0
+        for i in range(length):
+            if slot == capacity:
+                page += 1
+                slot = 0
+            tiles.append((page, slot))
+            slot += 1
+    return tiles
+
+def GetActionTileOffsets(animations, rotations, step=1):
+    # every animation takes frames x rotations consecutive tiles
+    offsets = []
+    tile = 0
+    for anim in animations:
+        offsets.append(tile)
+        tile += GetActionFrameCount(anim['action'], step) * max(1, rotations)
+    return offsets
+
+def GetMirroredRotation(rotation, rotations):
+    # angle 0 faces the subject's mirror plane, so angle i seen in a mirror is angle -i
+    mirrored = (rotations - rotation) % max(1, rotations)
+    return mirrored if mirrored < rotation else None
+
+def GetMirroredTiles(frame_counts, rotations):
+    # tile -> tile it is a horizontal flip of, for every angle that mirrors an earlier one
+    mirrored = {}
+    tile = 0
+    for frame_count in frame_counts:
+        for rotation in range(max(1, rotations)):
+            source = GetMirroredRotation(rotation, rotations)
+            if source is not None:
+                for i in range(frame_count):
+                    mirrored[tile + i] = tile - (rotation - source) * frame_count + i
+            tile += frame_count
+    return mirrored
+
+def GetHoldFrames(poses, tolerance=1e-5):
+    # index of the first frame of the hold each frame belongs to, poses are the sampled values of every frame
+    holds = []
+    for i, pose in enumerate(poses):
+        previous = poses[i - 1] if i > 0 else None
+        if previous is not None and len(pose) == len(previous) and all(abs(a - b) <= tolerance for a, b in zip(pose, previous)):
+            holds.append(holds[-1])
+        else:
+            holds.append(i)
+    return holds
+
+def GetHeldTiles(holds, rotations):
+    # tile -> tile rendered for the same pose, holds has one GetHoldFrames list per action
+    held = {}
+    tile = 0
+    for action_holds in holds:
+        for rotation in range(max(1, rotations)):
+            for i, source in enumerate(action_holds):
+                if source != i:
+                    held[tile + i] = tile + source
+            tile += len(action_holds)
+    return held
+
+def GetSheetLayout(animations, rotations, tile_width, tile_height, sheet_width, sheet_height, mirror=False, holds=None, rects=None, pages=None, flip_mirrored=False):
+    """Name, tile rects and mirror source of every action and angle in the order the tiles are laid out.
+
+    Mirrored angles have their own flipped tiles in the sheet, mirror_of names the angle
+    they were flipped from and their rects are drawn as they are. With flip_mirrored the
+    flipped tiles are left out, the frames of a mirrored angle are those of the angle it
+    mirrors with their offsets mirrored, and flip_x tells engines to draw them flipped.
+
+    animations are dicts with the action 'name' and its 'frame_count'. With holds, one
+    GetHoldFrames list per animation, held frames are merged into the frame they repeat
+    and the frame's duration counts them. rects replaces the grid cell of a tile with its
+    packed rect and offset in the tile_width x tile_height frame. pages is a GetPageMap
+    list and the SheetGrid of every page for grids split into pages.
+    """
+    grid = SheetGrid.from_sheet(tile_width, tile_height, sheet_width, sheet_height)
+    layout = []
+    tile = 0
+    for index, anim in enumerate(animations):
+        action_holds = holds[index] if holds else None
+        for rotation in range(max(1, rotations)):
+            source = GetMirroredRotation(rotation, rotations) if mirror else None
+            flip_x = source is not None and flip_mirrored
+            frames = []
+            if flip_x:
+                # nothing is stored for the angle, it is drawn from the frames of the angle it mirrors
+                for frame in layout[len(layout) - (rotation - source)]["frames"]:
+                    frames.append(dict(frame, offset_x=frame["source_width"] - frame["width"] - frame["offset_x"]))
+                tile += anim['frame_count']
+
+            for i in range(anim['frame_count'] if not flip_x else 0):
+                if action_holds is not None and action_holds[i] != i:
+                    frames[-1]["duration"] += 1
+                else:
+                    if rects is not None and tile in rects:
+                        frame = dict(rects[tile])
+                    else:
+                        page, slot = (0, tile)
+                        if pages is not None:
+                            page, slot = pages[0][tile]
+                        x, y = (pages[1][page] if pages is not None else grid).tile_pos(slot)
+                        frame = {"x": x, "y": y, "width": tile_width, "height": tile_height, "offset_x": 0, "offset_y": 0, "page": page}
+                    frame.setdefault("page", 0)
+                    frame.update({"source_width": tile_width, "source_height": tile_height, "duration": 1})
+                    frames.append(frame)
+                tile += 1
+
+            layout.append({
+                "name": "%s_%d" % (anim['name'], rotation),
+                "action": anim['name'],
+                "rotation": rotation,
+                "frames": frames,
+                "mirror_of": "%s_%d" % (anim['name'], source) if source is not None else None,
+                "flip_x": flip_x,
+            })
+    return layout
+
+def BuildRenderPlan(animations, rotations, step=1):
+    # one unit per action and rotation, in the order the tiles are laid out
+    plan = []
+    offsets = GetActionTileOffsets(animations, rotations, step)
+    for action_index, anim in enumerate(animations):
+        frame_start = int(anim['action'].frame_range[0])
+        frames = list(range(frame_start, int(anim['action'].frame_range[1]) + 1, step))
+        for rotation in range(max(1, rotations)):
+            plan.append({
+                "action": action_index,
+                "rotation": rotation,
+                "frames": frames,
+                "tile": offsets[action_index] + rotation * len(frames),
+            })
+    return plan
+
+def ChunkRenderPlan(plan, chunk_size):
+    # tile indices of every unit cut into runs of at most chunk_size frames
+    chunks = []
+    for unit in plan:
+        for start in range(0, len(unit["frames"]), chunk_size):
+            chunks.append(list(range(unit["tile"] + start, unit["tile"] + min(start + chunk_size, len(unit["frames"])))))
+    return chunks
+
+def SplitRenderPlan(plan, workers, chunk_size=0):
+    # cut units into frame chunks and hand the largest chunks out first to the least loaded worker
+    if chunk_size <= 0:
+        total = sum(len(unit["frames"]) for unit in plan)
+        chunk_size = max(1, -(-total // (max(1, workers) * 4)))
+
+    shards = [[] for _ in range(max(1, workers))]
+    for chunk in sorted(ChunkRenderPlan(plan, chunk_size), key=len, reverse=True):
+        min(shards, key=len).extend(chunk)
+    return [sorted(shard) for shard in shards]
+
+def AutoImageSize(frame_width, frame_height, animations, rotations, step=1, fit='AREA', aspect=1.0, max_size=0):
+    # every frame of every rotation gets a tile, tiles wrap at the end of a row
+    tile_count = sum(GetActionFrameCount(anim['action'], step) for anim in animations) * max(1, rotations)
+    grid = FitSheetGrid(tile_count, frame_width, frame_height, fit, aspect, max_size)
+    if grid is None:
+        raise ValueError("%d frames of %dx%d don't fit into a %d pixel sheet" % (tile_count, frame_width, frame_height, max_size))
+
+    return grid.size
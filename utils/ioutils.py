@@ -1,44 +1,79 @@
 import os
+import shutil
+import tempfile
+import threading
+
 import bpy
 
+RAM_DISK = "/dev/shm"
+
+# scratch folder of the running job, unique so jobs sharing a base folder don't collide
+temp_folder = None
+
+# scratch bytes moved by the running job
+io_stats = {"written": 0, "read": 0}
+io_lock = threading.Lock()
+
+def GetRamDiskFolder():
+    if os.path.isdir(RAM_DISK) and os.access(RAM_DISK, os.W_OK):
+        return RAM_DISK
+    return None
+
 def GetTempFolder():
-    #render_path = bpy.context.scene.render.filepath
-    return os.path.join(bpy.app.tempdir, "tmp")
+    if temp_folder is None:
+        return os.path.join(bpy.app.tempdir, "tmp")
+    return temp_folder
 
-def CreateTempFolder():
-    tmp = GetTempFolder()
+def CreateTempFolder(base="", use_ram_disk=False):
+    global temp_folder
 
-    print(tmp)
+    if use_ram_disk:
+        base = GetRamDiskFolder() or base
+    base = bpy.path.abspath(base) if base else bpy.app.tempdir
 
     try:
-        os.mkdir(tmp)
-    except OSError:
-        print("unable to create folder, it may already exist")
-
-    # check output folder
-    if not( os.path.exists(tmp) and os.path.isdir(tmp) ):
-        print("invalid output directory")
+        os.makedirs(base, exist_ok=True)
+        temp_folder = tempfile.mkdtemp(prefix="mk_sprites_", dir=base)
+    except OSError as e:
+        print("Unable to create a scratch folder in %s: %s" % (base, e))
         return False
 
+    ResetIOStats()
     return True
 
 def ClearFolder(folder):
-    for file_name in os.listdir(folder):
-        file_path = os.path.join(folder, file_name)
+    shutil.rmtree(folder, ignore_errors=True)
 
-        try:
-            # delete files
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
+def ClearTempFolder():
+    global temp_folder
 
-            # delete folders recursively
-            elif os.path.isdir(file_path):
-                ClearFolder(file_path)
+    if temp_folder is not None:
+        ClearFolder(temp_folder)
+    temp_folder = None
 
-        except Exception as e:
-            print('Failed to delete %s. Reason: %s' % (file_path, e))
+def GetFileSize(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
 
-    os.rmdir(folder)
+def CountWritten(size):
+    with io_lock:
+        io_stats["written"] += size
 
-def ClearTempFolder():
-    ClearFolder(GetTempFolder())
\ No newline at end of file
+def CountRead(size):
+    with io_lock:
+        io_stats["read"] += size
+
+def ResetIOStats():
+    with io_lock:
+        io_stats["written"] = 0
+        io_stats["read"] = 0
+
+def GetIOStats():
+    with io_lock:
+        return io_stats["written"], io_stats["read"]
+
+def FormatIOStats():
+    written, read = GetIOStats()
+    return "%.1f MB written, %.1f MB read" % (written / (1024 * 1024), read / (1024 * 1024))
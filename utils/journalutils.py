@@ -0,0 +1,141 @@
+import os
+import shutil
+import time
+
+import numpy
+
+from .ioutils import CountWritten, GetFileSize
+
+JOURNAL_NAME = "journal.txt"
+
+# interrupted jobs nobody resumed are removed after a week, and only the most recent are kept
+JOB_MAX_AGE = 7 * 24 * 60 * 60
+MAX_JOBS = 4
+
+def GetJobFolder(cache_folder, job_key):
+    # stable across sessions, unlike bpy.app.tempdir
+    return os.path.join(cache_folder, "jobs", job_key)
+
+def PruneJobFolders(cache_folder, keep=None):
+    folder = os.path.join(cache_folder, "jobs")
+    if not os.path.isdir(folder):
+        return
+
+    jobs = []
+    for entry in os.scandir(folder):
+        if entry.is_dir() and entry.path != keep:
+            try:
+                jobs.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue
+
+    jobs.sort(reverse=True)
+    now = time.time()
+    for i, (mtime, path) in enumerate(jobs):
+        if i >= MAX_JOBS - 1 or now - mtime > JOB_MAX_AGE:
+            shutil.rmtree(path, ignore_errors=True)
+
+class RenderJournal:
+    """Finished frames of a render job, kept on disk so an interrupted job can be resumed.
+
+    Frames are moved into the job folder before their tile is appended to the journal,
+    so every tile in the journal has a complete frame. The journal is flushed after every
+    frame but only synced to disk on close, it survives Blender crashing, not the machine.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.frames = {}
+        os.makedirs(folder, exist_ok=True)
+
+        path = os.path.join(folder, JOURNAL_NAME)
+        if os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    # the last line may be cut short by a crash
+                    parts = line.split()
+                    if len(parts) != 2 or not parts[0].isdigit():
+                        continue
+                    frame_path = os.path.join(folder, parts[1])
+                    if os.path.isfile(frame_path):
+                        self.frames[int(parts[0])] = frame_path
+
+        self.file = open(path, 'a')
+
+    def __contains__(self, index):
+        return index in self.frames
+
+    def __len__(self):
+        return len(self.frames)
+
+    def items(self):
+        return sorted(self.frames.items())
+
+    def record(self, index, source, remove_file=True):
+        """Store a finished frame, returns the path it is kept at"""
+        partial = os.path.join(self.folder, ".%d" % index)
+        copied = True
+
+        if isinstance(source, numpy.ndarray):
+            name = "%d.npy" % index
+            numpy.save(partial + ".npy", source)
+            os.replace(partial + ".npy", os.path.join(self.folder, name))
+        else:
+            name = str(index) + os.path.splitext(source)[1]
+            if remove_file:
+                # a rename within the same disk doesn't write the frame again
+                copied = os.stat(source).st_dev != os.stat(self.folder).st_dev
+                shutil.move(source, partial)
+            else:
+                shutil.copyfile(source, partial)
+            os.replace(partial, os.path.join(self.folder, name))
+
+        self.file.write("%d %s\n" % (index, name))
+        self.file.flush()
+
+        path = os.path.join(self.folder, name)
+        self.frames[index] = path
+        if copied:
+            CountWritten(GetFileSize(path))
+        return path
+
+    def close(self):
+        if not self.file.closed:
+            os.fsync(self.file.fileno())
+            self.file.close()
+
+    def remove(self):
+        self.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+class JournalStream:
+    """Records every frame in the journal before handing it to the sheet stream"""
+
+    def __init__(self, stream, journal):
+        self.stream = stream
+        self.journal = journal
+
+    def restore(self):
+        # frames finished by an earlier run go straight to the sheet
+        for index, path in self.journal.items():
+            self.stream.add(path, index, remove_file=False)
+
+    def add(self, source, index=None, remove_file=True):
+        path = self.journal.record(index, source, remove_file)
+        # arrays are already decoded, files are read from the journal, which keeps them
+        if isinstance(source, numpy.ndarray):
+            self.stream.add(source, index)
+        else:
+            self.stream.add(path, index, remove_file=False)
+
+    def paste_now(self, index, pixels):
+        self.journal.record(index, pixels)
+        self.stream.paste_now(index, pixels)
+
+    def finish(self):
+        self.journal.close()
+        return self.stream.finish()
+
+    def close(self):
+        self.journal.close()
+        self.stream.close()
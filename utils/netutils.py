@@ -0,0 +1,295 @@
+import hmac
+import json
+import os
+import queue
+import secrets
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy
+
+# Messages are a 4 byte big-endian length, a JSON header and an optional binary
+# payload whose length is given by the header's "size". Every message to the
+# coordinator carries the job's shared "token".
+
+# workers started by the coordinator find the token here, remote workers need it set by hand
+TOKEN_VARIABLE = "MK_SPRITES_TOKEN"
+
+MAX_HEADER_SIZE = 1 << 20
+
+# a 4096x4096 RGBA float frame
+MAX_FRAME_SIZE = 4096 * 4096 * 4 * 4
+
+def GetWorkerToken():
+    return os.environ.get(TOKEN_VARIABLE, "")
+
+def ReceiveExactly(sock, size):
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+def SendMessage(sock, header, payload=b''):
+    data = json.dumps(dict(header, size=len(payload))).encode()
+    sock.sendall(struct.pack('>I', len(data)) + data)
+    if payload:
+        sock.sendall(payload)
+
+def ReceiveMessage(sock, max_payload=None):
+    length = struct.unpack('>I', ReceiveExactly(sock, 4))[0]
+    if length > MAX_HEADER_SIZE:
+        raise ValueError("Message header of %d bytes is too large" % length)
+    header = json.loads(ReceiveExactly(sock, length))
+    size = header.get('size') or 0
+    if not isinstance(size, int) or size < 0 or (max_payload is not None and size > max_payload):
+        raise ValueError("Message payload of %r bytes is too large" % size)
+    payload = ReceiveExactly(sock, size) if size else b''
+    return header, payload
+
+class RenderCoordinator:
+    """Hands render units to workers over TCP and collects the frames they send back.
+
+    A unit is leased to one worker at a time. Leases that see no traffic for
+    lease_timeout seconds go back into the queue, a unit that failed max_attempts
+    times fails the job. Frames are queued for the caller's thread, which owns the sheet.
+    Only localhost is served unless host says otherwise, connections whose messages
+    don't carry token are dropped. A random token is made when none is given.
+    """
+
+    def __init__(self, units, options, host="127.0.0.1", port=0, lease_timeout=300, max_attempts=3, scene_path=None,
+            token=None, max_payload=MAX_FRAME_SIZE):
+        self.units = {i: list(tiles) for i, tiles in enumerate(units)}
+        self.options = options
+        self.token = token or secrets.token_hex(16)
+        self.max_payload = max_payload
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.scene_path = scene_path
+
+        self.pending = deque(self.units)
+        self.leases = {}
+        self.attempts = defaultdict(int)
+        self.received = set()
+        self.failed = []
+        self.frames = queue.Queue()
+        self.connections = 0
+        self.last_activity = time.time()
+        self.lock = threading.Lock()
+
+        coordinator = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                coordinator.serve(self.request)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def serve(self, sock):
+        worker = object()
+        with self.lock:
+            self.connections += 1
+
+        try:
+            while True:
+                header, payload = ReceiveMessage(sock, self.max_payload)
+                if not hmac.compare_digest(str(header.get('token', '')), self.token):
+                    print("Render coordinator dropped a connection with a wrong token")
+                    break
+
+                self.last_activity = time.time()
+                kind = header['type']
+
+                if kind == 'scene':
+                    with open(self.scene_path, 'rb') as f:
+                        SendMessage(sock, {'type': 'scene'}, f.read())
+                elif kind == 'request':
+                    SendMessage(sock, self.lease(worker))
+                elif kind == 'heartbeat':
+                    self.renew(worker, header['unit'])
+                elif kind == 'frame':
+                    self.receive_frame(worker, header, payload)
+                elif kind == 'complete':
+                    self.complete(worker, header['unit'])
+                elif kind == 'failed':
+                    print("Render worker failed unit %s: %s" % (header['unit'], header.get('error')))
+                    self.release(worker, header['unit'])
+
+        except (ConnectionError, OSError, ValueError, KeyError, TypeError):
+            pass
+
+        finally:
+            # whatever the worker still held goes back into the queue
+            with self.lock:
+                self.connections -= 1
+                for unit, (owner, deadline) in list(self.leases.items()):
+                    if owner is worker:
+                        del self.leases[unit]
+                        self.requeue(unit)
+
+    def lease(self, worker):
+        with self.lock:
+            if self.pending:
+                unit = self.pending.popleft()
+                self.attempts[unit] += 1
+                self.leases[unit] = (worker, time.time() + self.lease_timeout)
+                return {'type': 'unit', 'unit': unit, 'tiles': self.units[unit], 'options': self.options}
+            if self.leases:
+                return {'type': 'wait', 'seconds': 1.0}
+            return {'type': 'done'}
+
+    def renew(self, worker, unit):
+        with self.lock:
+            lease = self.leases.get(unit)
+            if lease is None or lease[0] is not worker:
+                return False
+            self.leases[unit] = (worker, time.time() + self.lease_timeout)
+            return True
+
+    def receive_frame(self, worker, header, payload):
+        # frames from a worker that lost its lease are dropped, the unit was handed out again
+        if not self.renew(worker, header['unit']):
+            return
+
+        pixels = numpy.frombuffer(payload, dtype=numpy.float32).reshape(header['shape'])
+        with self.lock:
+            if header['tile'] in self.received or header['tile'] not in self.units[header['unit']]:
+                return
+            self.received.add(header['tile'])
+
+        self.frames.put((header['tile'], pixels))
+
+    def complete(self, worker, unit):
+        with self.lock:
+            lease = self.leases.get(unit)
+            if lease is None or lease[0] is not worker:
+                return
+            del self.leases[unit]
+            if not self.received.issuperset(self.units[unit]):
+                self.requeue(unit)
+
+    def release(self, worker, unit):
+        with self.lock:
+            lease = self.leases.get(unit)
+            if lease is not None and lease[0] is worker:
+                del self.leases[unit]
+                self.requeue(unit)
+
+    def requeue(self, unit):
+        # callers hold the lock
+        if self.attempts[unit] >= self.max_attempts:
+            self.failed.append(unit)
+        else:
+            self.pending.append(unit)
+
+    def expire_leases(self):
+        now = time.time()
+        with self.lock:
+            for unit, (owner, deadline) in list(self.leases.items()):
+                if deadline < now:
+                    print("Render unit %d timed out, handing it out again" % unit)
+                    del self.leases[unit]
+                    self.requeue(unit)
+
+            # nobody is connected to pick up the remaining work
+            if self.connections == 0 and now - self.last_activity > self.lease_timeout:
+                self.failed.extend(self.pending)
+                self.pending.clear()
+
+    def finished(self):
+        with self.lock:
+            return not self.pending and not self.leases
+
+    def run(self, stream, poll_interval=0.25):
+        """Paste frames into stream until every unit is done or failed, returns True on success"""
+        while not self.finished() or not self.frames.empty():
+            try:
+                tile, pixels = self.frames.get(timeout=poll_interval)
+                stream.add(pixels, tile)
+            except queue.Empty:
+                pass
+            self.expire_leases()
+
+        return not self.failed
+
+class RenderWorkerClient:
+    """Worker end of the protocol, sends heartbeats while a unit is being rendered"""
+
+    def __init__(self, host, port, token, heartbeat_interval=10.0):
+        self.sock = socket.create_connection((host, port))
+        self.token = token
+        self.lock = threading.Lock()
+        self.unit = None
+        self.closed = threading.Event()
+        self.heartbeat_interval = heartbeat_interval
+        self.thread = threading.Thread(target=self.heartbeat, daemon=True)
+        self.thread.start()
+
+    def heartbeat(self):
+        while not self.closed.wait(self.heartbeat_interval):
+            with self.lock:
+                if self.unit is not None:
+                    self.send({'type': 'heartbeat', 'unit': self.unit})
+
+    def send(self, header, payload=b''):
+        # callers hold the lock
+        SendMessage(self.sock, dict(header, token=self.token), payload)
+
+    def request(self, kind):
+        with self.lock:
+            self.send({'type': kind})
+            return ReceiveMessage(self.sock)
+
+    def fetch_scene(self, path):
+        header, payload = self.request('scene')
+        with open(path, 'wb') as f:
+            f.write(payload)
+
+    def next_unit(self):
+        while True:
+            header, payload = self.request('request')
+            if header['type'] == 'wait':
+                time.sleep(header.get('seconds', 1.0))
+                continue
+            if header['type'] == 'done':
+                return None
+            self.unit = header['unit']
+            return header
+
+    def send_frame(self, tile, pixels):
+        pixels = numpy.ascontiguousarray(pixels, dtype=numpy.float32)
+        with self.lock:
+            self.send({'type': 'frame', 'unit': self.unit, 'tile': tile, 'shape': list(pixels.shape)}, pixels.tobytes())
+
+    def complete(self):
+        with self.lock:
+            self.send({'type': 'complete', 'unit': self.unit})
+            self.unit = None
+
+    def fail(self, error):
+        with self.lock:
+            self.send({'type': 'failed', 'unit': self.unit, 'error': error})
+            self.unit = None
+
+    def close(self):
+        self.closed.set()
+        self.sock.close()
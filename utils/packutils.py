@@ -0,0 +1,230 @@
+import math
+import numpy
+
+def TrimFrame(pixels, threshold=0.0):
+    """Crop a frame to the pixels with alpha above threshold.
+
+    Returns the cropped pixels and their offset from the frame's top left corner, or None
+    when the whole frame is transparent. Rows are stored bottom to top like blender images.
+    """
+    if pixels.shape[2] < 4:
+        return pixels, 0, 0
+
+    opaque = pixels[:, :, 3] > threshold
+    rows = numpy.flatnonzero(opaque.any(axis=1))
+    if len(rows) == 0:
+        return None
+    cols = numpy.flatnonzero(opaque.any(axis=0))
+
+    trimmed = pixels[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    return trimmed, int(cols[0]), int(pixels.shape[0] - 1 - rows[-1])
+
+def PackShelves(sizes, width=0, padding=0):
+    """Place (width, height) rects on shelves, tallest first.
+
+    Returns the top left corner of every rect in the order given and the size of the sheet.
+    Without a width the sheet is kept roughly square.
+    """
+    if not sizes:
+        return [], (0, 0)
+
+    if width <= 0:
+        area = sum((w + padding) * (h + padding) for w, h in sizes)
+        width = max(max(w for w, h in sizes), int(math.ceil(math.sqrt(area))))
+
+    positions = [None] * len(sizes)
+    x = y = shelf_height = used_width = 0
+    for i in sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0])):
+        w, h = sizes[i]
+        if x > 0 and x + w > width:
+            y += shelf_height + padding
+            x = shelf_height = 0
+
+        positions[i] = (x, y)
+        used_width = max(used_width, x + w)
+        x += w + padding
+        shelf_height = max(shelf_height, h)
+
+    return positions, (used_width, y + shelf_height)
+
+def PackShelvesInto(sizes, width, height, padding=0):
+    positions, used = PackShelves(sizes, width, padding)
+    return positions if used[1] <= height else None
+
+def SplitFreeRect(free, x, y, w, h):
+    # the parts of free not covered by the placed rect
+    fx, fy, fw, fh = free
+    parts = []
+    if x > fx:
+        parts.append((fx, fy, x - fx, fh))
+    if x + w < fx + fw:
+        parts.append((x + w, fy, fx + fw - x - w, fh))
+    if y > fy:
+        parts.append((fx, fy, fw, y - fy))
+    if y + h < fy + fh:
+        parts.append((fx, y + h, fw, fy + fh - y - h))
+    return parts
+
+def ContainsRect(a, b):
+    return b[0] >= a[0] and b[1] >= a[1] and b[0] + b[2] <= a[0] + a[2] and b[1] + b[3] <= a[1] + a[3]
+
+def PackMaxRects(sizes, width, height, padding=0):
+    """MaxRects packing with the best short side fit rule, largest rects first.
+
+    Returns the top left corner of every rect in the order given, or None when they
+    don't fit into width x height.
+    """
+    # padding is kept on the right and bottom of every rect, the sheet edge needs none
+    free = [(0, 0, width + padding, height + padding)]
+    positions = [None] * len(sizes)
+
+    for i in sorted(range(len(sizes)), key=lambda i: (-max(sizes[i]), -min(sizes[i]))):
+        w, h = sizes[i][0] + padding, sizes[i][1] + padding
+
+        best = None
+        for fx, fy, fw, fh in free:
+            if w <= fw and h <= fh:
+                score = (min(fw - w, fh - h), max(fw - w, fh - h), fy, fx)
+                if best is None or score < best:
+                    best = score
+        if best is None:
+            return None
+
+        x, y = best[3], best[2]
+        positions[i] = (x, y)
+
+        kept = []
+        created = []
+        for rect in free:
+            if x >= rect[0] + rect[2] or x + w <= rect[0] or y >= rect[1] + rect[3] or y + h <= rect[1]:
+                kept.append(rect)
+            else:
+                created.extend(SplitFreeRect(rect, x, y, w, h))
+
+        # untouched free rects never contain each other, only the new ones can be redundant
+        unique = []
+        for j, rect in enumerate(created):
+            if any(ContainsRect(other, rect) for other in kept):
+                continue
+            if any(ContainsRect(other, rect) and (other != rect or k < j) for k, other in enumerate(created) if k != j):
+                continue
+            unique.append(rect)
+        free = kept + unique
+
+    return positions
+
+# packers fill a sheet of a given size and return None when the rects don't fit
+PACKERS = {
+    'SHELF': PackShelvesInto,
+    'MAXRECTS': PackMaxRects,
+}
+
+def NextPowerOfTwo(value):
+    return 1 << max(0, int(value) - 1).bit_length()
+
+def GetUsedSize(sizes, positions):
+    return (max(x + w for (x, y), (w, h) in zip(positions, sizes)), max(y + h for (x, y), (w, h) in zip(positions, sizes)))
+
+def PackFrames(sizes, method='MAXRECTS', objective='AREA', padding=0, max_size=0):
+    """Pack (width, height) rects with one of PACKERS into the smallest sheet.
+
+    objective 'AREA' minimizes the sheet's area, 'POT' picks the smallest power of two sheet.
+    Returns the top left corner of every rect and the sheet size, or None when the rects
+    don't fit into max_size x max_size.
+    """
+    if not sizes:
+        return [], (0, 0)
+
+    pack = PACKERS[method]
+    area = sum((w + padding) * (h + padding) for w, h in sizes)
+    widest = max(w for w, h in sizes)
+    tallest = max(h for w, h in sizes)
+    limit = max_size or max(widest, tallest) + int(math.ceil(math.sqrt(area))) * 2
+    if widest > limit or tallest > limit:
+        return None
+
+    if objective == 'POT':
+        limit = max_size or NextPowerOfTwo(limit)
+        candidates = []
+        width = NextPowerOfTwo(widest)
+        while width <= limit:
+            height = max(NextPowerOfTwo(tallest), NextPowerOfTwo(area / width))
+            while height <= limit:
+                candidates.append((width * height, max(width, height), width, height))
+                height *= 2
+            width *= 2
+
+        for sheet_area, side, width, height in sorted(candidates):
+            if sheet_area < area:
+                continue
+            positions = pack(sizes, width, height, padding)
+            if positions is not None:
+                return positions, (width, height)
+        return None
+
+    # try widths around the square root of the area, growing the height until everything fits
+    best = None
+    side = math.sqrt(area)
+    for factor in (0.7, 0.85, 1.0, 1.2, 1.5):
+        width = min(limit, max(widest, int(math.ceil(side * factor))))
+        height = max(tallest, int(math.ceil(area / width)))
+        while height <= limit:
+            if best is not None and width * height >= best[1][0] * best[1][1]:
+                break
+            positions = pack(sizes, width, height, padding)
+            if positions is not None:
+                best = (positions, GetUsedSize(sizes, positions))
+                break
+            height = int(math.ceil(height * 1.05))
+    return best
+
+def PackLargestRun(items, sizes, method, objective, padding, max_size):
+    # most items from the start of the list whose rects fit one page, with their packing
+    best = None
+    low, high = 1, len(items)
+    while low <= high:
+        middle = (low + high) // 2
+        result = PackFrames([sizes[i] for item in items[:middle] for i in item], method, objective, padding, max_size)
+        if result is not None:
+            best = (middle, result)
+            low = middle + 1
+        else:
+            high = middle - 1
+    return best
+
+def PackPages(sizes, groups, method='MAXRECTS', objective='AREA', padding=0, max_size=0):
+    """Pack rects onto as many max_size x max_size pages as they need.
+
+    groups holds a group id for every rect, rects of a group (the frames of one action
+    and angle) stay on one page unless the group is larger than a page. Returns the page
+    and top left corner of every rect and the size of every page.
+    """
+    runs = []
+    for i, group in enumerate(groups):
+        if runs and groups[runs[-1][0]] == group:
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+
+    placements = [None] * len(sizes)
+    page_sizes = []
+    while runs:
+        best = PackLargestRun(runs, sizes, method, objective, padding, max_size)
+        if best is not None:
+            count, (positions, size) = best
+            placed = [i for run in runs[:count] for i in run]
+            runs = runs[count:]
+        else:
+            # a group larger than a page is split over pages
+            best = PackLargestRun([[i] for i in runs[0]], sizes, method, objective, padding, max_size)
+            if best is None:
+                raise ValueError("A %dx%d frame doesn't fit into a %d pixel page" % (sizes[runs[0][0]] + (max_size,)))
+            count, (positions, size) = best
+            placed = runs[0][:count]
+            runs[0] = runs[0][count:]
+
+        for i, position in zip(placed, positions):
+            placements[i] = (len(page_sizes), position)
+        page_sizes.append(size)
+
+    return placements, page_sizes
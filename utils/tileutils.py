@@ -1,48 +1,359 @@
 import bpy
 import os
 import math
-from .helpers import GetActionFrameCount, GetTilePos
+import numpy
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .helpers import GetActionFrameCount, SheetGrid
+from .decodeutils import DecodeFrame
+from .ioutils import CountRead, CountWritten, GetFileSize
+from .packutils import PackFrames, PackPages, TrimFrame
 
 def CeilToMultiple(number, multiple):
     return multiple * math.ceil(float(number) / float(multiple))
 
-def PasteImage(target, source, posx, posy, spritesheet_height):
-    target_pixels = list(target.pixels)
-    source_pixels = list(source.pixels)
-    width = source.size[0]
-    height = source.size[1]
+def GetImagePixels(image):
+    # read the whole buffer in one call, rows are stored bottom to top
+    width, height = image.size
+    pixels = numpy.empty(width * height * image.channels, dtype=numpy.float32)
+    image.pixels.foreach_get(pixels)
+    return pixels.reshape(height, width, image.channels)
+
+def SetImagePixels(image, pixels):
+    image.pixels.foreach_set(pixels.ravel())
+    image.update()
+
+def ReleaseImage(image):
+    # keep the finished page as packed PNG data and free its pixel buffer until it is used again
+    image.pack()
+    image.buffers_free()
+
+def PastePixels(target_pixels, source_pixels, posx, posy, spritesheet_height):
+    height, width = source_pixels.shape[:2]
+    target_height, target_width = target_pixels.shape[:2]
 
     # Adjust posy to start from the bottom of the target image
     posy = spritesheet_height - posy - height
 
-    if posy < 0 or posx + width > target.size[0] or posy + height > target.size[1]:
+    if posy < 0 or posx + width > target_width or posy + height > target_height:
         print(spritesheet_height, height)
         print(posy, posx)
         raise ValueError("Attempting to paste image out of the bounds of the target spritesheet.")
 
-    for Y in range(height):
-        for X in range(width):
-            sp = (X + Y * width) * source.channels
-            tp = ((X + posx) + (Y + posy) * target.size[0]) * target.channels
+    channels = min(source_pixels.shape[2], target_pixels.shape[2])
+    target_pixels[posy:posy + height, posx:posx + width, :channels] = source_pixels[:, :, :channels]
+
+def LoadImagePixels(path):
+    img = None
+
+    # try to load image into blender
+    try:
+        img = bpy.data.images.load(path)
+    except:
+        raise NameError("Cannot load image %s" % path)
+
+    pixels = GetImagePixels(img)
+    bpy.data.images.remove(img)
+    return pixels
+
+class SpritesheetBuffer:
+    """Sheet pixels held in memory while frames are tiled, written to the image once"""
+
+    def __init__(self, spritesheet, keep_existing=False):
+        self.spritesheet = spritesheet
+        self.width = spritesheet.size[0]
+        self.height = spritesheet.size[1]
+        self.grid = None
+
+        # patching a sheet only replaces the tiles that get pasted
+        if keep_existing:
+            self.pixels = GetImagePixels(spritesheet)
+        else:
+            self.pixels = numpy.zeros((self.height, self.width, spritesheet.channels), dtype=numpy.float32)
+
+    def paste(self, source_pixels, index):
+        tile_height, tile_width = source_pixels.shape[:2]
+        if self.grid is None or (self.grid.tile_width, self.grid.tile_height) != (tile_width, tile_height):
+            self.grid = SheetGrid.from_sheet(tile_width, tile_height, self.width, self.height)
+        posX, posY = self.grid.tile_pos(index)
+        PastePixels(self.pixels, source_pixels, posX, posY, self.height)
+
+    def commit(self):
+        SetImagePixels(self.spritesheet, self.pixels)
+
+class PagedSpritesheet:
+    """Grid sheet split into pages, page_map holds the (page, slot) of every tile.
+
+    A page's pixels are only held while tiles of it are still to come, each page is written
+    to its image as soon as its last tile is pasted and the image is packed and released.
+    Pages after the first get their images from get_page_image(page, width, height).
+    """
+
+    def __init__(self, spritesheet, page_map, page_grids, get_page_image):
+        self.spritesheet = spritesheet
+        self.page_map = page_map
+        self.page_grids = page_grids
+        self.get_page_image = get_page_image
+        self.page_images = {}
+        self.buffers = {}
+        self.done = set()
+        self.pending = {}
+        for index, (page, slot) in enumerate(page_map):
+            self.pending.setdefault(page, set()).add(index)
+
+    def skip(self, indices):
+        # tiles that are never pasted, like held frames
+        for index in indices:
+            page, slot = self.page_map[index]
+            self.pending[page].discard(index)
+
+    def get_image(self, page):
+        if page == 0:
+            return self.spritesheet
+        if page not in self.page_images:
+            width, height = self.page_grids[page].size
+            self.page_images[page] = self.get_page_image(page, width, height)
+        return self.page_images[page]
+
+    def get_buffer(self, page):
+        # a page that was already written is read back in
+        if page not in self.buffers:
+            self.buffers[page] = SpritesheetBuffer(self.get_image(page), keep_existing=page in self.done)
+        return self.buffers[page]
+
+    def paste(self, source_pixels, index):
+        page, slot = self.page_map[index]
+        self.get_buffer(page).paste(source_pixels, slot)
+
+        self.pending[page].discard(index)
+        if not self.pending[page]:
+            self.commit_page(page)
+
+    def commit_page(self, page):
+        self.get_buffer(page).commit()
+        ReleaseImage(self.get_image(page))
+        del self.buffers[page]
+        self.done.add(page)
+
+    def commit(self):
+        for page in range(len(self.page_grids)):
+            if page in self.buffers or page not in self.done:
+                self.commit_page(page)
+
+# bytes of frames a packed sheet keeps in memory until it is committed
+PACKED_MEMORY_LIMIT = 1 << 30
+
+class PackedSpritesheet:
+    """Frames packed by one of packutils.PACKERS and written when the sheet is committed.
+
+    With trim, frames are cropped to their alpha bounds first. The image is resized to the
+    packed size. rects holds the sheet rect, page and the offset in the original frame of
+    every tile, empty frames get an empty rect and are never pasted. With max_size frames
+    spill onto more pages, keeping frames with the same groups entry together, and the
+    images of pages after the first come from get_page_image(page, width, height).
+    Frames past memory_limit bytes are kept in spill_folder until the sheet is committed.
+    """
+
+    def __init__(self, spritesheet, method='MAXRECTS', objective='AREA', padding=1, trim=True, threshold=0.0,
+            max_size=0, groups=None, get_page_image=None, spill_folder=None, memory_limit=PACKED_MEMORY_LIMIT):
+        self.spritesheet = spritesheet
+        self.method = method
+        self.objective = objective
+        self.padding = padding
+        self.trim = trim
+        self.threshold = threshold
+        self.max_size = max_size
+        self.groups = groups
+        self.get_page_image = get_page_image
+        self.spill_folder = spill_folder
+        self.memory_limit = memory_limit
+        self.memory = 0
+        self.error = None
+        self.page_images = {}
+        self.frames = {}
+        self.rects = {}
+
+    def paste(self, source_pixels, index):
+        trimmed = TrimFrame(source_pixels, self.threshold)
+        if trimmed is None:
+            self.frames[index] = None
+            return
+        if not self.trim:
+            trimmed = (source_pixels, 0, 0)
+
+        pixels, offset_x, offset_y = trimmed
+        # found while rendering rather than once every frame is in, render handlers swallow
+        # the error so commit raises it again
+        if self.max_size and (pixels.shape[1] > self.max_size or pixels.shape[0] > self.max_size):
+            self.error = ValueError("A %dx%d frame doesn't fit into a %d pixel page" % (pixels.shape[1], pixels.shape[0], self.max_size))
+            raise self.error
+
+        if self.spill_folder is not None and self.memory + pixels.nbytes > self.memory_limit:
+            path = os.path.join(self.spill_folder, "packed_%d.npy" % index)
+            numpy.save(path, pixels)
+            CountWritten(GetFileSize(path))
+            self.frames[index] = (path, pixels.shape[1], pixels.shape[0], offset_x, offset_y)
+        else:
+            # copy, the source may be a view of a shared frame buffer
+            self.memory += pixels.nbytes
+            self.frames[index] = (pixels.copy(), pixels.shape[1], pixels.shape[0], offset_x, offset_y)
+
+    def load_frame(self, index):
+        frame = self.frames[index][0]
+        if isinstance(frame, str):
+            CountRead(GetFileSize(frame))
+            frame = numpy.load(frame)
+        return frame
+
+    def commit(self):
+        if self.error is not None:
+            raise self.error
+
+        indices = [index for index in sorted(self.frames) if self.frames[index] is not None]
+        sizes = [(self.frames[index][1], self.frames[index][2]) for index in indices]
 
-            for C in range(min(source.channels, target.channels)):
-                target_pixels[tp + C] = source_pixels[sp + C]
+        if self.max_size:
+            groups = [self.groups[index] for index in indices] if self.groups else indices
+            placements, page_sizes = PackPages(sizes, groups, self.method, self.objective, self.padding, self.max_size)
+        else:
+            positions, size = PackFrames(sizes, self.method, self.objective, self.padding)
+            placements = [(0, position) for position in positions]
+            page_sizes = [size]
 
-    target.pixels = target_pixels
-    target.update()
+        self.rects = {}
+        for index, frame in self.frames.items():
+            if frame is None:
+                self.rects[index] = {"x": 0, "y": 0, "width": 0, "height": 0, "offset_x": 0, "offset_y": 0, "page": 0}
 
-def TilePathsIntoImage(spritesheet_name_string, image_path_list, width, height):
+        # one page in memory at a time
+        for page, (width, height) in enumerate(page_sizes or [(1, 1)]):
+            width, height = max(1, width), max(1, height)
+            if page == 0:
+                image = self.spritesheet
+                if tuple(image.size) != (width, height):
+                    image.scale(width, height)
+            else:
+                image = self.page_images[page] = self.get_page_image(page, width, height)
+            pixels = numpy.zeros((height, width, image.channels), dtype=numpy.float32)
+
+            for index, (frame_page, (x, y)) in zip(indices, placements):
+                if frame_page != page:
+                    continue
+                frame = self.load_frame(index)
+                offset_x, offset_y = self.frames[index][3:]
+                PastePixels(pixels, frame, x, y, height)
+                self.rects[index] = {"x": x, "y": y, "width": frame.shape[1], "height": frame.shape[0], "offset_x": offset_x, "offset_y": offset_y, "page": page}
+
+            SetImagePixels(image, pixels)
+            del pixels
+            ReleaseImage(image)
+
+        for frame in self.frames.values():
+            if frame is not None and isinstance(frame[0], str):
+                os.remove(frame[0])
+        self.frames = {}
+        self.memory = 0
+
+class SpritesheetStream:
+    """Tiles frames into the sheet buffer while the remaining frames are still rendering.
+
+    Files are decoded on a thread pool and removed as soon as they are pasted, at most
+    read_ahead frames are kept in flight.
+    """
+
+    def __init__(self, spritesheet, keep_existing=False, workers=None, read_ahead=8, packer=None, pages=None):
+        if packer is not None:
+            self.sheet = PackedSpritesheet(spritesheet, **packer)
+        elif pages is not None:
+            self.sheet = PagedSpritesheet(spritesheet, **pages)
+        else:
+            self.sheet = SpritesheetBuffer(spritesheet, keep_existing)
+        self.pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self.read_ahead = read_ahead
+        self.pending = deque()
+        self.deferred = []
+        self.count = 0
+        # tile -> tiles that are horizontal flips of it
+        self.mirrors = {}
+
+    def add(self, source, index=None, remove_file=True):
+        if index is None:
+            index = self.count
+        self.count = max(self.count, index + 1)
+
+        self.pending.append((index, source, remove_file, self.pool.submit(DecodeFrame, source)))
+        self.drain(self.read_ahead)
+
+    def drain(self, limit):
+        # paste decoded frames in order, only waiting when too many are in flight
+        while self.pending and (len(self.pending) > limit or self.pending[0][3].done()):
+            index, source, remove_file, future = self.pending.popleft()
+            pixels = future.result()
+
+            # blender can't load images from inside the render handlers, keep these for the end
+            if pixels is None:
+                self.deferred.append((index, source, remove_file))
+                continue
+
+            self.paste(index, source, pixels, remove_file)
+
+    def paste_now(self, index, pixels):
+        # frames borrowed from a shared buffer are copied into the sheet before this returns
+        self.count = max(self.count, index + 1)
+        print(f"Generating spritesheet, processing image no. {index}")
+        self.paste_mirrored(index, pixels)
+
+    def paste_mirrored(self, index, pixels):
+        self.sheet.paste(pixels, index)
+        for mirrored in self.mirrors.get(index, ()):
+            self.sheet.paste(pixels[:, ::-1], mirrored)
+
+    def paste(self, index, source, pixels, remove_file):
+        print(f"Generating spritesheet, processing image no. {index}")
+        self.paste_mirrored(index, pixels)
+
+        if isinstance(source, str):
+            CountRead(GetFileSize(source))
+            # frames are deleted as soon as they are in the sheet
+            if remove_file:
+                os.remove(source)
+
+    def finish(self):
+        try:
+            self.drain(0)
+        finally:
+            self.pool.shutdown()
+
+        for index, source, remove_file in self.deferred:
+            self.paste(index, source, LoadImagePixels(source), remove_file)
+        self.deferred = []
+
+        self.sheet.commit()
+        return self.sheet.spritesheet
+
+    def close(self):
+        # frames still decoding are dropped, for renders that end early
+        self.pool.shutdown(cancel_futures=True)
+        self.pending.clear()
+        self.deferred = []
+
+def IsMirrorImage(a, b, tolerance=0.02):
+    # compare one frame with the other flipped horizontally
+    if a.shape != b.shape:
+        return False
+    return float(numpy.abs(a - b[:, ::-1]).mean()) < tolerance
+
+def GetSpritesheet(spritesheet_name_string, width, height):
     # create spritesheet image
     spritesheet = None
 
-
     print("Building pritesheet: %s" % spritesheet_name_string)
     # check if sprite sheet exists
     if spritesheet_name_string in bpy.data.images:
         spritesheet = bpy.data.images[spritesheet_name_string]
 
-        print("Existing pritesheet res: %s %s" % (spritesheet.resolution[0],spritesheet.resolution[1]))
-        if spritesheet.resolution[0] != width or spritesheet.resolution[1] != height:
+        print("Existing pritesheet res: %s %s" % (spritesheet.size[0],spritesheet.size[1]))
+        if spritesheet.size[0] != width or spritesheet.size[1] != height:
             print("Spritesheet resolution changed, re-creating") 
             bpy.data.images.remove(spritesheet)
             spritesheet = bpy.data.images.new(spritesheet_name_string, width, height, alpha=True)
@@ -53,25 +364,4 @@ def TilePathsIntoImage(spritesheet_name_string, image_path_list, width, height):
         print("Creating new spritesheet: %s (%s %s)" % (spritesheet_name_string, width, height))
         spritesheet = bpy.data.images.new(spritesheet_name_string, width, height, alpha=True)
 
-    # load sprites and append into sheet
-
-    print("Spritesheet res: %s %s size(%s, %s)" % (spritesheet.resolution[0],spritesheet.resolution[1], spritesheet.size[0], spritesheet.size[1]))
-    for i in range(len(image_path_list)):
-
-        print(f"Generating spritesheet, processing image no. {i}/{len(image_path_list)}")
-        # locals
-        path = image_path_list[i]
-        img = None
-
-        # try to load image into blender
-        try:
-            img = bpy.data.images.load(path)
-        except:
-            raise NameError("Cannot load image %s" % path)
-
-        posX, posY = GetTilePos(img.size[0], img.size[1], spritesheet.size[0], spritesheet.size[1], i)
-        PasteImage(spritesheet, img, posX, posY, spritesheet.size[1])
-
-        bpy.data.images.remove(img)
-
     return spritesheet
@@ -1,5 +1,13 @@
 import unittest
-from helpers import AutoImageSize
+import numpy
+from helpers import AutoImageSize, FitSheetGrid, GetPageMap, GetActionTileOffsets, BuildRenderPlan, SplitRenderPlan, GetHoldFrames, GetHeldTiles, GetSheetLayout
+from boundsutils import FitSpriteSize, GetOrbitViews, GetViewBounds
+from packutils import PackFrames, PackMaxRects, PackPages, PackShelves, TrimFrame
+from netutils import ReceiveMessage, RenderCoordinator, SendMessage
+from decodeutils import DecodeEXR, DecodePNG
+import socket
+import struct
+import zlib
 
 # Mock Action class to simulate the action.frame_range attribute
 class MockAction:
@@ -10,17 +18,259 @@ class TestAutoImageSize(unittest.TestCase):
      def test_auto_image_size(self):
         # Test cases with mock actions
         test_cases = [
-            ((64, 64, [{'action': MockAction((0, 9))}], 1, 1), (640, 64)),
+            ((64, 64, [{'action': MockAction((0, 9))}], 1, 1), (256, 192)),
             ((32, 48, [{'action': MockAction((0, 4))}], 4, 1), (160, 192)),
-            ((50, 50, [{'action': MockAction((0, -1))}], 3, 1), (0, 150)),
-            ((100, 100, [{'action': MockAction((0, 2))}], 0, 1), (300, 0)),
-            ((256, 256, [{'action': MockAction((0, 40))}], 4, 4), (2816, 1024)),
-            ((256, 256, [{'action': MockAction((0, 40))}, {'action': MockAction((0, 50))}, {'action': MockAction((0, 40))}], 4, 4), (3200, 3072))
+            ((50, 50, [{'action': MockAction((0, -1))}], 3, 1), (50, 0)),
+            ((100, 100, [{'action': MockAction((0, 2))}], 0, 1), (200, 200)),
+            ((256, 256, [{'action': MockAction((0, 40))}], 4, 4), (1280, 2304)),
+            ((256, 256, [{'action': MockAction((0, 40))}, {'action': MockAction((0, 50))}, {'action': MockAction((0, 40))}], 4, 4), (2560, 3584))
         ]
 
         for inputs, expected in test_cases:
             frame_width, frame_height, animations, rotations, step = inputs
             self.assertEqual(AutoImageSize(frame_width, frame_height, animations, rotations, step), expected)
 
+class TestFitSheetGrid(unittest.TestCase):
+     def test_fit_sheet_grid(self):
+        self.assertEqual(FitSheetGrid(10, 64, 64, 'ASPECT', 2.5).size, (320, 128))
+        self.assertEqual(FitSheetGrid(12, 32, 64).size, (192, 128))
+        self.assertIsNone(FitSheetGrid(10, 64, 64, max_size=200))
+
+        grid = FitSheetGrid(10, 64, 64, max_size=256)
+        self.assertTrue(max(grid.size) <= 256 and grid.columns * grid.rows >= 10)
+        self.assertEqual(grid.tile_pos(5), (64 * (5 % grid.columns), 64 * (5 // grid.columns)))
+
+class TestPages(unittest.TestCase):
+     def test_page_map(self):
+        # the second unit starts a new page, the third is larger than a page and is split
+        pages = GetPageMap([3, 3, 5, 2], 4)
+        self.assertEqual(pages[3:6], [(1, 0), (1, 1), (1, 2)])
+        self.assertEqual(pages[6:], [(2, 0), (2, 1), (2, 2), (2, 3), (3, 0), (3, 1), (3, 2)])
+
+     def test_pack_pages(self):
+        placements, page_sizes = PackPages([(4, 4)] * 5 + [(2, 2)] * 2, [0, 0, 0, 1, 1, 2, 2], 'SHELF', 'AREA', 0, 8)
+        self.assertEqual([page for page, position in placements], [0, 0, 0, 1, 1, 1, 1])
+        self.assertTrue(all(max(size) <= 8 for size in page_sizes))
+        self.assertRaises(ValueError, PackPages, [(16, 4)], [0], 'SHELF', 'AREA', 0, 8)
+
+class TestGetActionTileOffsets(unittest.TestCase):
+     def test_action_tile_offsets(self):
+        animations = [{'action': MockAction((0, 9))}, {'action': MockAction((0, 4))}, {'action': MockAction((0, 2))}]
+        self.assertEqual(GetActionTileOffsets(animations, 4, 1), [0, 40, 60])
+        self.assertEqual(GetActionTileOffsets(animations, 0, 1), [0, 10, 15])
+        self.assertEqual(GetActionTileOffsets(animations, 2, 2), [0, 10, 16])
+
+class TestRenderPlan(unittest.TestCase):
+     def test_render_plan(self):
+        animations = [{'action': MockAction((0, 9))}, {'action': MockAction((5, 8))}]
+        plan = BuildRenderPlan(animations, 2, 1)
+        self.assertEqual([(unit['action'], unit['rotation'], unit['tile']) for unit in plan], [(0, 0, 0), (0, 1, 10), (1, 0, 20), (1, 1, 24)])
+        self.assertEqual(plan[2]['frames'], [5, 6, 7, 8])
+
+        shards = SplitRenderPlan(plan, 3)
+        self.assertEqual(sorted(tile for shard in shards for tile in shard), list(range(28)))
+        self.assertTrue(max(len(shard) for shard in shards) - min(len(shard) for shard in shards) <= 3)
+
+class TestHoldFrames(unittest.TestCase):
+     def test_hold_frames(self):
+        holds = GetHoldFrames([(0.0, 1.0), (0.0, 1.0), (0.5, 1.0), (0.5, 1.0), (0.5, 1.0), (0.0, 1.0)])
+        self.assertEqual(holds, [0, 0, 2, 2, 2, 5])
+        self.assertEqual(GetHeldTiles([holds, [0, 1]], 2), {1: 0, 3: 2, 4: 2, 7: 6, 9: 8, 10: 8})
+
+        layout = GetSheetLayout([{'name': 'Idle', 'frame_count': 6}], 1, 32, 32, 128, 64, holds=[holds])
+        self.assertEqual([(frame['x'], frame['y'], frame['duration']) for frame in layout[0]['frames']], [(0, 0, 2), (64, 0, 3), (32, 32, 1)])
+
+class TestSheetLayout(unittest.TestCase):
+     def test_mirrored_angles(self):
+        # mirrored angles point at their own flipped tiles, which are drawn as they are
+        layout = GetSheetLayout([{'name': 'walk', 'frame_count': 2}], 4, 32, 32, 256, 32, mirror=True)
+        self.assertEqual([animation['mirror_of'] for animation in layout], [None, None, None, 'walk_1'])
+        self.assertEqual([frame['x'] for frame in layout[3]['frames']], [192, 224])
+        self.assertFalse(layout[3]['flip_x'])
+
+     def test_flip_mirrored_angles(self):
+        # left out mirrored angles reuse the packed rects of their source, drawn flipped
+        rects = {tile: {"x": tile * 10, "y": 0, "width": 20, "height": 30, "offset_x": 3, "offset_y": 1} for tile in range(6)}
+        layout = GetSheetLayout([{'name': 'walk', 'frame_count': 2}], 4, 32, 32, 256, 32, mirror=True, rects=rects, flip_mirrored=True)
+        self.assertEqual([animation['flip_x'] for animation in layout], [False, False, False, True])
+        self.assertEqual([frame['x'] for frame in layout[3]['frames']], [20, 30])
+        self.assertEqual([frame['offset_x'] for frame in layout[3]['frames']], [9, 9])
+        self.assertEqual(layout[1]['frames'][0]['offset_x'], 3)
+
+class TestTrimFrames(unittest.TestCase):
+     def test_trim_frame(self):
+        # rows are bottom to top, the opaque block sits 1 pixel from the top and 2 from the left
+        pixels = numpy.zeros((4, 5, 4), dtype=numpy.float32)
+        pixels[1:3, 2:4, 3] = 1.0
+        trimmed, offset_x, offset_y = TrimFrame(pixels)
+        self.assertEqual((trimmed.shape[:2], offset_x, offset_y), ((2, 2), 2, 1))
+        self.assertIsNone(TrimFrame(numpy.zeros((4, 5, 4), dtype=numpy.float32)))
+
+     def test_pack_shelves(self):
+        positions, size = PackShelves([(4, 2), (4, 4), (2, 2), (4, 2)], width=8)
+        self.assertEqual(positions, [(4, 0), (0, 0), (4, 4), (0, 4)])
+        self.assertEqual(size, (8, 6))
+
+class TestPackFrames(unittest.TestCase):
+     def test_pack_max_rects(self):
+        self.assertEqual(PackMaxRects([(4, 2), (2, 2), (6, 2)], 6, 4), [(0, 2), (4, 2), (0, 0)])
+        self.assertIsNone(PackMaxRects([(4, 4), (4, 4)], 6, 4))
+
+     def test_pack_objective(self):
+        self.assertEqual(PackFrames([(64, 64)] * 10, 'MAXRECTS', 'POT')[1], (256, 256))
+        self.assertEqual(PackFrames([(64, 64)] * 10, 'SHELF', 'AREA')[1], (128, 320))
+        self.assertIsNone(PackFrames([(3, 3)] * 5, 'MAXRECTS', 'POT', max_size=4))
+
+class TestFitSpriteSize(unittest.TestCase):
+     def test_fit_sprite_size(self):
+        # camera 10 units in front of the origin looking along +y, orbiting around z
+        camera = numpy.identity(4)
+        camera[:3, :3] = [[1, 0, 0], [0, 0, -1], [0, 1, 0]]
+        camera[:3, 3] = [0, -10, 0]
+        views = GetOrbitViews(camera, numpy.identity(4), 4)
+
+        points = numpy.array([[2.0, 0.0, 1.0], [-1.0, 0.0, -1.0]])
+        self.assertEqual(GetViewBounds(points, views), (-2.0, -1.0, 2.0, 1.0))
+        self.assertEqual(FitSpriteSize((-2.0, -1.0, 2.0, 1.0), 0.1, 1, 2), (42, 22, 0.0, 0.0))
+
+def FilterPNGRow(kind, row, previous, bpp):
+    # reference encoder for the five PNG filters
+    out = bytearray()
+    for i, value in enumerate(row):
+        a = row[i - bpp] if i >= bpp else 0
+        b = previous[i]
+        c = previous[i - bpp] if i >= bpp else 0
+        p = a + b - c
+        paeth = min((abs(p - a), 0, a), (abs(p - b), 1, b), (abs(p - c), 2, c))[2]
+        out.append((value - [0, a, b, (a + b) // 2, paeth][kind]) & 0xFF)
+    return bytes([kind]) + bytes(out)
+
+def EncodePNG(pixels, filters):
+    height, width, bpp = pixels.shape
+    rows = [bytes(row) for row in pixels.reshape(height, width * bpp)]
+    raw = b''.join(FilterPNGRow(filters[y], rows[y], rows[y - 1] if y else bytes(width * bpp), bpp) for y in range(height))
+
+    def Chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + Chunk(b'IHDR', header) + Chunk(b'IDAT', zlib.compress(raw)) + Chunk(b'IEND', b'')
+
+def PredictEXR(data):
+    # byte interleave and delta predictor of the ZIP codecs
+    values = numpy.frombuffer(data, dtype=numpy.uint8)
+    values = numpy.concatenate([values[0::2], values[1::2]]).astype(numpy.int64)
+    deltas = values.copy()
+    deltas[1:] = (values[1:] - values[:-1] + 128) & 0xFF
+    return deltas.astype(numpy.uint8).tobytes()
+
+def EncodeEXR(planes, compression):
+    height, width = planes['R'].shape
+    names = sorted(planes)
+    channels = b''.join(name.encode() + b'\x00' + struct.pack('<i4xii', 1, 1, 1) for name in names) + b'\x00'
+
+    def Attribute(name, kind, value):
+        return name.encode() + b'\x00' + kind.encode() + b'\x00' + struct.pack('<i', len(value)) + value
+    header = (b'\x76\x2f\x31\x01' + struct.pack('<I', 2) + Attribute('channels', 'chlist', channels) +
+        Attribute('compression', 'compression', bytes([compression])) +
+        Attribute('dataWindow', 'box2i', struct.pack('<iiii', 0, 0, width - 1, height - 1)) + b'\x00')
+
+    blocks = []
+    for y in range(height):
+        data = b''.join(planes[name][y].astype('<f2').tobytes() for name in names)
+        # blocks that don't get smaller are stored uncompressed
+        if compression == 2 and len(zlib.compress(PredictEXR(data))) < len(data):
+            data = zlib.compress(PredictEXR(data))
+        blocks.append(struct.pack('<ii', y, len(data)) + data)
+
+    offset = len(header) + 8 * height
+    offsets = []
+    for block in blocks:
+        offsets.append(offset)
+        offset += len(block)
+    return header + struct.pack('<%dQ' % height, *offsets) + b''.join(blocks)
+
+class TestDecodeFrames(unittest.TestCase):
+     def test_decode_png(self):
+        rng = numpy.random.default_rng(3)
+        pixels = rng.integers(0, 256, (12, 7, 4), dtype=numpy.uint8)
+        # None, Sub and Up rows are decoded without blender
+        filters = [0, 1, 2, 2, 1, 0, 1, 2, 0, 2, 1, 0]
+        decoded = DecodePNG(EncodePNG(pixels, filters))
+        numpy.testing.assert_allclose(decoded, pixels[::-1].astype(numpy.float32) / 255.0)
+
+        # Average and Paeth rows are left to blender
+        self.assertIsNone(DecodePNG(EncodePNG(pixels, [0, 1, 2, 3] + [0] * 8)))
+        self.assertIsNone(DecodePNG(EncodePNG(pixels, [4] + [0] * 11)))
+
+     def test_decode_exr(self):
+        # smooth planes so the compressed blocks are smaller than the raw ones
+        ramp = numpy.linspace(0.0, 1.0, 5 * 32).reshape(5, 32)
+        planes = {name: (ramp * (i + 1)).astype(numpy.float16) for i, name in enumerate('RGBA')}
+        expected = numpy.stack([planes[name] for name in 'RGBA'], axis=2)[::-1].astype(numpy.float32)
+
+        for compression in (0, 2):
+            numpy.testing.assert_array_equal(DecodeEXR(EncodeEXR(planes, compression)), expected)
+
+class TestRenderCoordinator(unittest.TestCase):
+     def setUp(self):
+        self.coordinator = RenderCoordinator([[0, 1], [2]], {}, lease_timeout=60, max_attempts=2)
+
+     def tearDown(self):
+        self.coordinator.server.server_close()
+
+     def frame(self, unit, tile):
+        return {'unit': unit, 'tile': tile, 'shape': [1, 1, 4]}, numpy.zeros(4, dtype=numpy.float32).tobytes()
+
+     def test_lease_and_requeue(self):
+        first, second = object(), object()
+        self.assertEqual(self.coordinator.lease(first)['unit'], 0)
+        self.assertEqual(self.coordinator.lease(second)['unit'], 1)
+        self.assertEqual(self.coordinator.lease(second)['type'], 'wait')
+
+        # an expired lease is handed out again, the old worker's frames are dropped
+        self.coordinator.leases[0] = (first, 0)
+        self.coordinator.expire_leases()
+        self.assertEqual(self.coordinator.lease(second)['unit'], 0)
+        self.coordinator.receive_frame(first, *self.frame(0, 0))
+        self.assertTrue(self.coordinator.frames.empty())
+
+        # a unit completed with missing frames goes back into the queue until it runs out of attempts
+        self.coordinator.receive_frame(second, *self.frame(0, 0))
+        self.coordinator.complete(second, 0)
+        self.assertEqual(self.coordinator.failed, [0])
+        self.coordinator.release(second, 1)
+        self.assertEqual(self.coordinator.lease(first)['unit'], 1)
+
+     def test_duplicate_frames(self):
+        worker = object()
+        self.coordinator.lease(worker)
+        self.coordinator.receive_frame(worker, *self.frame(0, 0))
+        self.coordinator.receive_frame(worker, *self.frame(0, 0))
+        # tiles outside the leased unit are ignored
+        self.coordinator.receive_frame(worker, *self.frame(0, 2))
+        self.assertEqual(self.coordinator.frames.qsize(), 1)
+
+        self.coordinator.receive_frame(worker, *self.frame(0, 1))
+        self.coordinator.complete(worker, 0)
+        self.assertEqual(self.coordinator.frames.qsize(), 2)
+        self.assertEqual(list(self.coordinator.pending), [1])
+
+     def test_token_and_limits(self):
+        self.assertEqual(self.coordinator.server.server_address[0], '127.0.0.1')
+
+        coordinator_end, worker_end = socket.socketpair()
+        SendMessage(worker_end, {'type': 'request', 'token': 'wrong'})
+        self.coordinator.serve(coordinator_end)
+        self.assertEqual(len(self.coordinator.pending), 2)
+        coordinator_end.close()
+        worker_end.close()
+
+        coordinator_end, worker_end = socket.socketpair()
+        SendMessage(worker_end, {'type': 'frame'}, b'0' * 64)
+        with self.assertRaises(ValueError):
+            ReceiveMessage(coordinator_end, max_payload=16)
+        coordinator_end.close()
+        worker_end.close()
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,221 @@
+import json
+import os
+import shutil
+import subprocess
+import time
+
+import bpy
+import numpy
+
+from .decodeutils import DecodeFrame
+from .ioutils import CountWritten, GetFileSize, GetRamDiskFolder
+from .tileutils import LoadImagePixels
+
+CLI_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cli.py")
+
+# tile, height, width and channels of the frame held by a ring slot, tile is -1 while the slot is free
+RING_HEADER = 4
+RING_ALIGN = 64
+RING_SLOTS = 8
+
+def GetWorkerThreads(workers):
+    # split the cores between the workers so they don't oversubscribe the machine
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+class ShardWriter:
+    """Stands in for the sheet stream in worker processes, frames are handed back as numbered files"""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def add(self, source, index=None, remove_file=True):
+        target = os.path.join(self.folder, str(index))
+        partial = os.path.join(self.folder, ".%d" % index)
+
+        # frames only appear under their final name once they are complete
+        if isinstance(source, numpy.ndarray):
+            numpy.save(partial + ".npy", source)
+            os.replace(partial + ".npy", target + ".npy")
+            CountWritten(GetFileSize(target + ".npy"))
+            return
+
+        ext = os.path.splitext(source)[1]
+        if remove_file:
+            shutil.move(source, partial + ext)
+        else:
+            shutil.copyfile(source, partial + ext)
+        os.replace(partial + ext, target + ext)
+
+    def finish(self):
+        return None
+
+def GetRingFolder(fallback):
+    # rings live in RAM where the system offers a tmpfs, the page cache backs them otherwise
+    return GetRamDiskFolder() or fallback
+
+def GetRingFrameSize(scene):
+    # large enough for any frame of the scene, percentages below 100 just leave slots partly unused
+    scale = max(100, scene.render.resolution_percentage)
+    return scene.render.resolution_y * scale // 100, scene.render.resolution_x * scale // 100
+
+class FrameRing:
+    """Memory-mapped ring of raw RGBA float frames shared by one worker and the UI session.
+
+    The worker writes a frame into the next slot and publishes it by writing the slot
+    header last, the reader hands out views into the mapping and frees the slot once
+    the frame is pasted, so frames cross the process boundary without a codec or a copy.
+    """
+
+    def __init__(self, path, slots, height, width, create=False):
+        self.path = path
+        self.slots = slots
+        self.next = 0
+
+        header_size = slots * RING_HEADER * 8
+        data_offset = (header_size + RING_ALIGN - 1) // RING_ALIGN * RING_ALIGN
+        size = data_offset + slots * height * width * 4 * 4
+
+        self.buffer = numpy.memmap(path, dtype=numpy.uint8, mode='w+' if create else 'r+', shape=(size,))
+        self.header = self.buffer[:header_size].view(numpy.int64).reshape(slots, RING_HEADER)
+        self.data = self.buffer[data_offset:].view(numpy.float32).reshape(slots, height, width, 4)
+
+        if create:
+            self.header[:, 0] = -1
+
+    def put(self, index, pixels, timeout=300.0):
+        slot = self.next % self.slots
+        deadline = time.time() + timeout
+        while self.header[slot, 0] >= 0:
+            if time.time() > deadline:
+                raise TimeoutError("Frame ring %s is not being read" % self.path)
+            time.sleep(0.001)
+
+        height, width, channels = pixels.shape
+        self.data[slot, :height, :width, :channels] = pixels
+        self.header[slot, 1:] = (height, width, channels)
+        self.header[slot, 0] = index
+        self.next += 1
+
+    def poll(self):
+        """Yield (index, pixels) for every published frame, pixels are only valid until the next iteration"""
+        while True:
+            slot = self.next % self.slots
+            index = int(self.header[slot, 0])
+            if index < 0:
+                return
+
+            height, width, channels = self.header[slot, 1:]
+            yield index, self.data[slot, :height, :width, :channels]
+
+            self.header[slot, 0] = -1
+            self.next += 1
+
+    def close(self, remove=False):
+        del self.header, self.data
+        self.buffer._mmap.close()
+        del self.buffer
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+
+class RingWriter:
+    """Stands in for the sheet stream in worker processes, captured frames go through a FrameRing.
+
+    Frames written to files are handed back as files, a rename costs the worker less than
+    decoding them here, and the UI session decodes them on its thread pool.
+    """
+
+    def __init__(self, ring, fallback):
+        self.ring = ring
+        self.fallback = fallback
+
+    def add(self, source, index=None, remove_file=True):
+        if not isinstance(source, numpy.ndarray):
+            self.fallback.add(source, index, remove_file)
+            return
+
+        self.ring.put(index, source)
+
+    def finish(self):
+        self.ring.close()
+        return None
+
+class NetworkFrameWriter:
+    """Stands in for the sheet stream in network workers, frames are sent to the coordinator as raw pixels"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def add(self, source, index=None, remove_file=True):
+        pixels = DecodeFrame(source)
+        if pixels is None:
+            pixels = LoadImagePixels(source)
+
+        self.client.send_frame(index, pixels)
+
+        if remove_file and isinstance(source, str):
+            os.remove(source)
+
+    def finish(self):
+        return None
+
+def WriteShardJobs(folder, shards, options, rings=None):
+    paths = []
+    for i, tiles in enumerate(shards):
+        output = os.path.join(folder, "frames")
+        os.makedirs(output, exist_ok=True)
+
+        job = dict(options, tiles=tiles, output=output)
+        if rings is not None:
+            job["ring"] = {"path": rings[i].path, "slots": rings[i].slots}
+        path = os.path.join(folder, "shard_%d.json" % i)
+        with open(path, 'w') as f:
+            json.dump(job, f)
+        paths.append(path)
+
+    return paths
+
+def LaunchWorkers(blend_path, job_paths):
+    processes = []
+    for path in job_paths:
+        args = [bpy.app.binary_path, "-b", blend_path, "--python", CLI_SCRIPT, "--", "--worker", path]
+        print("Starting render worker: %s" % " ".join(args))
+        processes.append(subprocess.Popen(args))
+    return processes
+
+def LaunchNetworkWorkers(host, port, count, threads, token):
+    # the token goes through the environment, command lines are visible to other users
+    env = dict(os.environ, MK_SPRITES_TOKEN=token)
+    processes = []
+    for i in range(count):
+        args = [bpy.app.binary_path, "-b", "--python", CLI_SCRIPT, "--",
+            "--net-worker", "%s:%d" % (host, port), "--threads", str(threads)]
+        print("Starting network render worker: %s" % " ".join(args))
+        processes.append(subprocess.Popen(args, env=env))
+    return processes
+
+def CollectShardFrames(folder, stream, processes, rings=(), poll_interval=0.25):
+    """Tile frames as the workers finish them, returns the number of frames collected"""
+    seen = set()
+    received = 0
+
+    while True:
+        # check before scanning so frames written right before a worker exits are still picked up
+        running = any(process.poll() is None for process in processes)
+
+        for ring in rings:
+            for index, pixels in ring.poll():
+                stream.paste_now(index, pixels)
+                received += 1
+
+        for entry in os.scandir(folder):
+            name = os.path.splitext(entry.name)[0]
+            if entry.name in seen or not name.isdigit():
+                continue
+            seen.add(entry.name)
+            stream.add(entry.path, int(name))
+
+        if not running:
+            return len(seen) + received
+
+        # rings hold only a few frames, keep them drained so the workers don't stall
+        time.sleep(poll_interval if not rings else min(poll_interval, 0.005))